@@ -2,132 +2,411 @@
 # Contributers: Michael Durkan + Alexander Carey
 
 
-from data import tasks, employees
-from classes import Task, Employee, Chromosome
-from fitness import EvaluateFitness
-import random
-import copy
+from classes import Task, Employee, Chromosome, Error
+from instance import DefaultInstance
+from fitness import EvaluateFitnessBatch
+from telemetry import OpenLog, DIVERSITY_LOG_COLUMNS
+from profiler import NULL_PROFILER
+from bounds import ReachedBound
+from population import CheckGeneList
+from checkpoint import ResumeState, RestoreRng, RestoreStopping
+from diversity import GenotypeIndex, DiversityRecord
+from rng import MakeRng
+import numpy as np
 import time
-import csv
 
 # Inputs:
 #   numAnts: number of ants in colony
 #   evapRate: evaporation rate of pheremones
 #   depositConstant: degree to which pheremones are deposited relative to fitness
 #   maxIterations: number of times function creates new colonies
+#   instance: ProblemInstance to solve, defaults to the synthetic data
+#   cache: optional FitnessCache to reuse scores of repeated ant solutions
+#   rng: optional numpy random Generator
+#   log: csv file or telemetry Sink streamed the iteration, cost, time,
+#       feasability, gene entropy and unique count as they are produced (a
+#       Sink with only the first four columns gets those), None to skip
+#   callback: optional function called each iteration with the iteration,
+#       best cost and best solution, returning True stops the run
+#   profiler: optional Profiler timing the phases of every iteration
+#   stopping: optional StoppingCriteria ending the run early and holding the
+#       best solution so far
+#   candidateLists: limit each task to the employees with its skill and level
+#       (or the least penalised when nobody has both), keeping pheremone only
+#       for those pairs
+#   maxCandidates: optional cap on each task's candidates in candidate list
+#       mode, keeping the employees with the most hours
+#   localSearch: optional LocalSearch improving some ants' solutions before
+#       they are scored
+#   checkpoint: optional Checkpointer saving the run's state every so often
+#   resume: optional checkpoint file or loaded checkpoint to carry on from,
+#       giving the same results as a run that was never stopped
+#   initial: optional gene list of a previous solution to start from, laying
+#       pheremone along it and keeping it as the best solution until beaten
+#   perturbation: chance each ant first gives a task to another employee
+#       than in initial
+#   dedupe: re-mutate ants that build the same solution as an earlier ant of
+#       the iteration before they are scored
+#   seed: seed for the random stream when no rng is given, random when None
 # Outputs:
 #   bestSolution: best solution vector after completion
 #   bestCost: best cost of that vector after completion
-def AntColonyOptimisation(numAnts, evapRate, depositConstant, maxIterations):
-    # Start timer and create results list for graphing
+def AntColonyOptimisation(numAnts, evapRate, depositConstant, maxIterations,
+                          instance=None, cache=None, rng=None,
+                          log='acoCostResults.csv', callback=None, profiler=None,
+                          stopping=None, candidateLists=False, maxCandidates=None,
+                          localSearch=None, checkpoint=None, resume=None, initial=None,
+                          perturbation=0.1, dedupe=False, seed=None):
+    # Start timer
     timeStart = time.perf_counter()
-    results = []
 
-    # Create lists of tasks and employee objects and get there cardinality
-    taskList = [Task(**taskData) for taskData in tasks]
-    empList = [Employee(**empData) for empData in employees]
-    numTasks = len(taskList)
-    numEmps = len(empList)
+    # Get the cardinality of the tasks and employees
+    if instance is None:
+        instance = DefaultInstance()
+    resume = ResumeState(resume, "aco", instance)
 
-    # Initialize matrix of inital pheremones
-    tau = [[1.0 for _ in range(numEmps)] for _ in range(numTasks)]
+    # Open the log sink for graphing, cut back to the checkpoint when resuming
+    sink = OpenLog(log, resume["log"] if resume is not None else None,
+                   DIVERSITY_LOG_COLUMNS)
+
+    # Settings saved with checkpoints, so the run can be resumed
+    params = {"numAnts": numAnts, "evapRate": evapRate, "depositConstant": depositConstant,
+              "maxIterations": maxIterations, "candidateLists": candidateLists,
+              "maxCandidates": maxCandidates, "dedupe": dedupe,
+              "log": log if isinstance(log, str) else None}
+
+    if rng is None:
+        rng = MakeRng(seed)
+    if profiler is None:
+        profiler = NULL_PROFILER
+    profiler.Begin(ACO_PHASES, cache)
+    if stopping is not None:
+        stopping.Begin()
+    numTasks = instance.numTasks
+    numEmps = instance.numEmps
+
+    # Index of each iteration's solutions, to keep clones out of the colony
+    index = GenotypeIndex(numEmps) if dedupe else None
+
+    # Initialize matrix of inital pheremones, or in candidate list mode the
+    # pheremone of each task's candidates stored one task after another
+    candidates = None
+    if candidateLists:
+        candidates = CandidateLists(instance, maxCandidates)
+        tau = candidates.InitialPheremone(instance)
+    else:
+        tau = np.ones((numTasks, numEmps))
 
     # Initialize best solution and score
-    bestSol = None
+    bestSolution = None
+    bestSolutionCost = None
     bestScore = -float("inf")
+    startIteration = 0
 
-    for iteration in range(1, maxIterations + 1):
-        # Create lists for ants in iteration and there fitness values  
-        antChromos = [] 
-        # Construct a solution for each ant in colony
-        for _ in range(1, numAnts + 1):
-            curSolution = []
-            # Increment through tasks and build a solution
-            for taskIdx in range(numTasks):
-                # Create list for feasible next solution index
-                allowed = list(range(numEmps))
-                
-                # Calculate total pheremone for emp-task assignments
-                totalPheremone = sum(tau[taskIdx][empIdx] for empIdx in allowed)
-
-                # Generate a random threshold between 0 and totalPheremone
-                r = random.uniform(0.0, totalPheremone)
-
-                # Select next move using cumulative pheremone
-                cumulative = 0.0
-                chosen = allowed[-1]
-
-                # Calculate cumulative prob to decide which employee does task
-                for empIdx in allowed:
-                    cumulative += tau[taskIdx][empIdx]
-                    if cumulative >= r:
-                        chosen = empIdx
-                        break
-                curSolution.append(chosen + 1) 
-            antChromos.append(Chromosome(curSolution))
-
-        # Evaluate the constructed solution (uses chromosome fitness eval) 
-        EvaluateFitness(antChromos)
-
-        # Create list of ants and there scores for use in pheremone deposit
-        antList = [c.geneList for c in antChromos]
-        scoreList = [c.fitness for c in antChromos]
-        
-        # Compare get the best score, solution and cost of ants in colony
-        for chromo in antChromos:
-            if chromo.fitness > bestScore:
-                bestScore = chromo.fitness
-                bestSolution = chromo.geneList.copy()
-        bestCost = min(c.cost for c in antChromos)
-
-        # Calculate total violations of ants in population for graphing
-        totalViolations = sum((chromo.overPenalty + chromo.skillPenalty + 
-                               chromo.diffPenalty + chromo.deadlinePenalty + 
-                               chromo.assignPenalty) for chromo in antChromos)
-
-        # Calculate elapsed time of iteration and add to graphing list details
-        elapsedTime = time.perf_counter() - timeStart
-        results.append([iteration, bestCost, elapsedTime, totalViolations]) 
+    # Lead the ants along a previous solution, which is the best until beaten
+    if initial is not None and resume is None:
+        initial = CheckGeneList(initial, instance)
+        tau = WarmPheremone(tau, initial, perturbation, candidates)
+        scores = EvaluateFitnessBatch(initial[np.newaxis], instance, cache)
+        profiler.Count("evaluations")
+        bestScore = scores["fitness"][0].item()
+        bestSolution = initial.tolist()
+        bestSolutionCost = scores["cost"][0].item()
+
+    # Carry on from the checkpointed pheremone, best solution and random stream
+    if resume is not None:
+        startIteration = resume["iteration"]
+        rng = RestoreRng(resume["rng"])
+        timeStart -= resume["elapsedTime"]
+        tau = resume["arrays"]["tau"]
+        bestSolution = resume["arrays"]["bestSolution"].tolist()
+        bestSolutionCost = resume["values"]["bestSolutionCost"]
+        bestScore = resume["values"]["bestScore"]
+        RestoreStopping(stopping, resume)
+
+    for iteration in range(startIteration + 1, maxIterations + 1):
+        # Construct a solution for each ant in colony all at once
+        with profiler.Phase("construct"):
+            if candidates is not None:
+                antGenes, antPicks = candidates.Construct(tau, numAnts, rng)
+            else:
+                antGenes = ConstructAnts(tau, numAnts, rng)
+
+        # Improve some of the ants' solutions, finding the candidate entries
+        # of changed solutions so pheremone is deposited where they now are
+        if localSearch is not None:
+            with profiler.Phase("localsearch"):
+                changed = localSearch.Improve(antGenes, rng)
+                if candidates is not None and len(changed):
+                    antPicks[changed] = candidates.Locate(antGenes[changed])
+
+        # Change ants that copy an earlier ant, so no evaluations are spent
+        # on clones
+        if index is not None:
+            with profiler.Phase("dedupe"):
+                changed = index.Deduplicate(antGenes, rng)
+                if candidates is not None and len(changed):
+                    antPicks[changed] = candidates.Locate(antGenes[changed])
+            profiler.Count("duplicates", len(changed))
+
+        # Evaluate the constructed solutions as one batch
+        with profiler.Phase("evaluate"):
+            scores = EvaluateFitnessBatch(antGenes, instance, cache)
+        profiler.Count("evaluations", numAnts)
+
+        with profiler.Phase("log"):
+            # Compare get the best score, solution and cost of ants in colony
+            bestAnt = int(np.argmax(scores["fitness"]))
+            if scores["fitness"][bestAnt] > bestScore:
+                bestScore = scores["fitness"][bestAnt].item()
+                bestSolution = antGenes[bestAnt].tolist()
+                bestSolutionCost = scores["cost"][bestAnt].item()
+            bestCost = scores["cost"].min().item()
+
+            # Calculate total violations of ants in population for graphing
+            totalViolations = scores["totalViolations"].sum().item()
+
+            # Calculate elapsed time of iteration and add to graphing list details
+            elapsedTime = time.perf_counter() - timeStart
+            if sink is not None:
+                sink.Write(DiversityRecord(sink, [iteration, bestCost, elapsedTime,
+                                                  totalViolations], antGenes, numEmps))
         
         # Calculate Pheremone evaporation
-        tau = CalcPhereEvap(tau, numTasks, numEmps, evapRate)
+        with profiler.Phase("evaporate"):
+            tau = CalcPhereEvap(tau, evapRate)
 
         # Calculate Pheremone Deposit
-        tau = CalcPhereDeposit(tau, antList, scoreList, bestScore, depositConstant)
+        with profiler.Phase("deposit"):
+            if candidates is not None:
+                tau = candidates.Deposit(tau, antPicks, scores["fitness"], bestScore,
+                                         depositConstant)
+            else:
+                tau = CalcPhereDeposit(tau, antGenes, scores["fitness"], bestScore,
+                                       depositConstant)
+        profiler.Count("iterations")
+        profiler.EndIteration(iteration)
+
+        # Let the caller see progress and stop the run early
+        if callback is not None and callback(iteration, bestSolutionCost, bestSolution):
+            break
+        if stopping is not None and stopping.Update(iteration, bestSolutionCost,
+                                                    bestSolution, numAnts, antGenes):
+            break
+
+        # Stop once the best cost matches the lower bound, it cannot improve
+        if ReachedBound(bestSolutionCost, instance):
+            break
+
+        # Save the run's state so it can be resumed from this iteration
+        if checkpoint is not None and checkpoint.Due(iteration):
+            with profiler.Phase("checkpoint"):
+                checkpoint.Save("aco", iteration, params,
+                                {"tau": tau, "bestSolution": bestSolution},
+                                {"bestSolutionCost": bestSolutionCost, "bestScore": bestScore},
+                                rng, instance, time.perf_counter() - timeStart, sink,
+                                stopping)
     
-    # Output generation, cost, time and feasability to csv
-    with open('acoCostResults.csv', 'w', newline='') as csvFile:
-        wr = csv.writer(csvFile)
-        wr.writerow(['generation', 'bestCost', 'elapsedTime', 'feasability'])
-        wr.writerows(results)
+    # Flush the rest of the generation, cost, time and feasability log
+    if sink is not None:
+        sink.Close()
+    profiler.End()
+
+    return bestSolution, bestSolutionCost
 
-    return bestSolution, bestCost
+# Phases of an iteration timed by a Profiler
+ACO_PHASES = ("construct", "localsearch", "dedupe", "evaluate", "log", "evaporate", "deposit",
+              "checkpoint")
+
+# Name: ConstructAnts
+# Purpose: Build every ant's solution for an iteration at once. Each row of tau
+#   is normalised and cumulated, rows are offset by their task index so the
+#   flattened matrix is increasing, and one batched binary search of uniform
+#   draws picks the first employee whose cumulative pheremone reaches each draw
+# Input: tau: pheremone matrix (tasks x employees), numAnts: number of ants,
+#   rng: numpy random Generator
+# Output: gene array (ants x tasks) of employee numbers
+def ConstructAnts(tau, numAnts, rng):
+    numTasks, numEmps = tau.shape
+    taskOffset = np.arange(numTasks)
+
+    cumulative = np.cumsum(tau / tau.sum(axis=1, keepdims=True), axis=1)
+    cumulative += taskOffset[:, np.newaxis]
+    thresholds = rng.random((numAnts, numTasks)) + taskOffset
+
+    picks = np.searchsorted(cumulative.ravel(), thresholds.ravel(), side="left")
+    chosen = picks.reshape(numAnts, numTasks) - taskOffset * numEmps
+
+    # Rounding can land a draw just outside its own row
+    np.clip(chosen, 0, numEmps - 1, out=chosen)
+    return chosen + 1
 
 # Name: CalcPhereEvap
 # Purpose: Calculate and update pheremone values due to evaporation
-# Input: tau: pheremone matrix, numTaks: number of tasks, numEmps: number of
-#   employees, evapRate: evaporationRate
+# Input: tau: pheremone matrix, evapRate: evaporationRate
 # Output: tau: pheremone matrix
-def CalcPhereEvap(tau, numTasks, numEmps, evapRate):
-    for taskIdx in range(numTasks):
-        for empIdx in range(numEmps):
-            tau[taskIdx][empIdx] *= (1.0 - evapRate)
+def CalcPhereEvap(tau, evapRate):
+    tau *= (1.0 - evapRate)
     
     return tau
 
 # Name: CalcPhereDeposit
-# Purpose: Calculate an update the pheremone matrix based on the score of solution
-# Input: tau: pheremone matrix, antList: list of solutions, scoreList: list of scores
-#   bestScore: best score achieved, depositConstant: how much pheremone left behind
+# Purpose: Calculate an update the pheremone matrix based on the score of
+#   solution, scatter adding every ant's deposit onto its task-emp pairs
+# Input: tau: pheremone matrix, antGenes: gene array of solutions (ants x tasks),
+#   scoreList: array of scores, bestScore: best score achieved,
+#   depositConstant: how much pheremone left behind
 # Output: tau: peheremone matrix 
-def CalcPhereDeposit(tau, antList, scoreList, bestScore, depositConstant):
-    for curAnt, curFit in zip(antList, scoreList):
-        for taskIdx, emp in enumerate(curAnt):
-            empIdx = emp - 1
-            tau[taskIdx][empIdx] += depositConstant / (1.0 + (bestScore - curFit))
+def CalcPhereDeposit(tau, antGenes, scoreList, bestScore, depositConstant):
+    numTasks, numEmps = tau.shape
+    deposit = depositConstant / (1.0 + (bestScore - np.asarray(scoreList)))
+    pairIdx = np.arange(numTasks) * numEmps + (antGenes - 1)
+    tau += np.bincount(pairIdx.ravel(), weights=np.repeat(deposit, numTasks),
+                       minlength=numTasks * numEmps).reshape(numTasks, numEmps)
 
     return tau
 
+# Name: WarmPheremone
+# Purpose: Raise the pheremone of a previous solution's task-emp pairs, so at
+#   first each ant gives a task to its previous employee with probability
+#   1 - perturbation, in place
+# Input: tau: pheremone matrix, or candidate pheremone array, geneList:
+#   previous solution array, perturbation: chance of picking another
+#   employee, candidates: CandidateLists in candidate list mode
+# Output: tau: pheremone matrix or array
+def WarmPheremone(tau, geneList, perturbation, candidates=None):
+    if not 0.0 < perturbation <= 1.0:
+        raise Error("perturbation must be above 0 and at most 1")
+    flat = tau.reshape(-1)
+    if candidates is None:
+        numTasks, numEmps = tau.shape
+        entries = np.arange(numTasks) * numEmps + (geneList - 1)
+        rowSum = tau.sum(axis=1)
+    else:
+        # Previous employees no longer among the candidates are left out
+        entries = candidates.Locate(geneList[np.newaxis])[0]
+        rowSum = np.add.reduceat(tau, candidates.indptr[:-1])[entries >= 0]
+        entries = entries[entries >= 0]
+
+    others = rowSum - flat[entries]
+    flat[entries] = np.maximum(flat[entries], others * (1.0 - perturbation) / perturbation)
+    return tau
+
+# Name: CandidateLists
+# Purpose: Employees each task may be given to, stored in a compressed sparse
+#   row layout: the candidates of task t are candidates[indptr[t]:indptr[t+1]]
+#   and a pheremone array of the same length holds one value per candidate
+class CandidateLists:
+    # Inputs:
+    #   instance: ProblemInstance
+    #   maxCandidates: optional cap on each task's candidates, keeping the
+    #       employees with the most hours
+    def __init__(self, instance, maxCandidates=None):
+        if maxCandidates is not None and maxCandidates < 1:
+            raise Error("maxCandidates must be at least 1")
+
+        # Tasks needing the same skill and difficulty share one list, which
+        # holds the employees with the skill and level, or when there are none
+        # the employees with the least skill and difficulty penalty
+        needs = np.stack([instance.taskSkillCode, instance.taskDifficulty], axis=1)
+        kinds, taskKind = np.unique(needs, axis=0, return_inverse=True)
+        taskKind = taskKind.ravel()
+        kindLists = []
+        for skillCode, difficulty in kinds:
+            penalty = ((~instance.empHasSkill[int(skillCode)]).astype(np.int64) +
+                       np.maximum(difficulty - instance.empLevel, 0))
+            # Least penalised first, then most hours
+            ranked = np.lexsort((-instance.empHours, penalty))
+            size = (penalty == penalty.min()).sum().item()
+            if maxCandidates is not None:
+                size = min(size, maxCandidates)
+            kindLists.append(np.sort(ranked[:size]))
+
+        # Lay the lists out task by task
+        kindLength = np.array([len(emps) for emps in kindLists])
+        kindStart = np.concatenate([[0], np.cumsum(kindLength)[:-1]])
+        lengths = kindLength[taskKind]
+        self.indptr = np.concatenate([[0], np.cumsum(lengths)])
+        self.numEntries = self.indptr[-1].item()
+        self.entryTask = np.repeat(np.arange(instance.numTasks), lengths)
+        offset = np.arange(self.numEntries) - self.indptr[self.entryTask]
+        self.candidates = np.concatenate(kindLists)[kindStart[taskKind][self.entryTask] + offset]
+
+        # Increasing key of each entry, for finding the entry of a task-employee pair
+        self.numEmps = instance.numEmps
+        self.entryKey = self.entryTask * self.numEmps + self.candidates
+
+    # Name: InitialPheremone
+    # Purpose: Starting pheremone of each candidate. Employees on many lists
+    #   would be overloaded by uniform pheremone, so a weight per employee is
+    #   scaled over a few rounds until each employee's expected hours are in
+    #   proportion to their available hours. Each task's values average 1, as
+    #   in the dense matrix.
+    # Input: instance: ProblemInstance, rounds: number of scaling rounds
+    # Output: tau: pheremone of each candidate
+    def InitialPheremone(self, instance, rounds=20):
+        lengths = np.diff(self.indptr)[self.entryTask]
+        entryTime = instance.taskTime[self.entryTask]
+        target = instance.empHours * (instance.taskTime.sum() / instance.empHours.sum())
+        weight = np.ones(instance.numEmps)
+        for _ in range(rounds + 1):
+            tau = weight[self.candidates]
+            tau /= np.add.reduceat(tau, self.indptr[:-1])[self.entryTask]
+            expected = np.bincount(self.candidates, weights=tau * entryTime,
+                                   minlength=instance.numEmps)
+            weight *= np.where(expected > 0, target / np.maximum(expected, 1e-12), 1.0)
+        return tau * lengths
+
+    # Name: Construct
+    # Purpose: Build every ant's solution at once from the candidates, as
+    #   ConstructAnts does over the whole pheremone matrix
+    # Input: tau: pheremone of each candidate, numAnts: number of ants, rng:
+    #   numpy random Generator
+    # Output: gene array (ants x tasks) of employee numbers, and the candidate
+    #   entry each ant picked for each task
+    def Construct(self, tau, numAnts, rng):
+        numTasks = len(self.indptr) - 1
+        rowStart = self.indptr[:-1]
+        taskOffset = np.arange(numTasks)
+
+        # Cumulate each task's normalised pheremone, offset by the task index
+        normalised = tau / np.add.reduceat(tau, rowStart)[self.entryTask]
+        cumulative = np.cumsum(normalised)
+        before = np.concatenate([[0.0], cumulative[rowStart[1:] - 1]])
+        cumulative += (self.entryTask - before[self.entryTask])
+        thresholds = rng.random((numAnts, numTasks)) + taskOffset
+
+        # Rounding can land a draw just outside its own task's candidates
+        picks = np.searchsorted(cumulative, thresholds, side="left")
+        np.clip(picks, rowStart, self.indptr[1:] - 1, out=picks)
+        return self.candidates[picks] + 1, picks
+
+    # Name: Locate
+    # Purpose: Find the candidate entry of each gene
+    # Input: genes: gene array (ants x tasks) of employee numbers
+    # Output: array of candidate entries, -1 where the employee is not one of
+    #   the task's candidates
+    def Locate(self, genes):
+        keys = np.arange(genes.shape[1]) * self.numEmps + (genes - 1)
+        entries = np.searchsorted(self.entryKey, keys)
+        np.minimum(entries, self.numEntries - 1, out=entries)
+        return np.where(self.entryKey[entries] == keys, entries, -1)
+
+    # Name: Deposit
+    # Purpose: Add every ant's deposit onto the candidates it picked, as
+    #   CalcPhereDeposit does over the whole pheremone matrix
+    # Input: tau: pheremone of each candidate, picks: candidate entries picked
+    #   by each ant (-1 for none), scoreList: array of scores, bestScore: best
+    #   score achieved, depositConstant: how much pheremone left behind
+    # Output: tau: pheremone of each candidate
+    def Deposit(self, tau, picks, scoreList, bestScore, depositConstant):
+        deposit = depositConstant / (1.0 + (bestScore - np.asarray(scoreList)))
+        weights = np.repeat(deposit, picks.shape[1])
+        picks = picks.ravel()
+        valid = picks >= 0
+        tau += np.bincount(picks[valid], weights=weights[valid], minlength=len(tau))
+        return tau
+
 # Allows for execution of ant colony optimization individually
 if __name__ == "__main__":
 
@@ -0,0 +1,347 @@
+# Batched genetic algorithm, solving many small rosters together in padded
+# arrays so each generation is one set of array operations for all of them
+# Contributers: Michael Durkan
+
+from classes import Error
+from population import Population, SCORE_FIELDS
+from fitness import PENALTY_FIELDS
+from ga import Crossover, Mutate
+from telemetry import OpenLog
+from bounds import ReachedBound
+from rng import MakeRng
+import numpy as np
+import time
+
+# Parent selection methods the batched genetic algorithm supports
+BATCH_SELECTION_METHODS = ("roulette", "tournament", "rank")
+
+# Name: InstanceBatch
+# Purpose: Stack the arrays of several problem instances, padded to the most
+#   tasks and employees of any of them. Padded tasks take no time and are
+#   masked out of the penalties, padded employees are never assigned.
+class InstanceBatch:
+    # Inputs:
+    #   instances: list of ProblemInstance
+    def __init__(self, instances):
+        if len(instances) == 0:
+            raise Error("batch needs at least one instance")
+        self.instances = list(instances)
+        self.size = len(self.instances)
+        self.taskCounts = np.array([instance.numTasks for instance in self.instances])
+        self.empCounts = np.array([instance.numEmps for instance in self.instances])
+        self.numTasks = int(self.taskCounts.max())
+        self.numEmps = int(self.empCounts.max())
+        shape = (self.size, self.numTasks)
+
+        self.taskMask = np.arange(self.numTasks) < self.taskCounts[:, np.newaxis]
+        self.taskTime = np.zeros(shape, dtype=np.result_type(
+            *[instance.taskTime for instance in self.instances]))
+        self.taskDifficulty = np.zeros(shape, dtype=np.result_type(
+            *[instance.taskDifficulty for instance in self.instances]))
+        self.taskDeadline = np.zeros(shape, dtype=np.result_type(
+            *[instance.taskDeadline for instance in self.instances]))
+        self.empHours = np.zeros((self.size, self.numEmps), dtype=np.result_type(
+            *[instance.empHours for instance in self.instances]))
+        self.empLevel = np.zeros((self.size, self.numEmps), dtype=np.result_type(
+            *[instance.empLevel for instance in self.instances]))
+        # Padded tasks rank after the real ones, they take no time so do not
+        # move any real task's finish time
+        self.timeRank = np.tile(np.arange(self.numTasks), (self.size, 1))
+
+        # The skill x employee tables are stacked, with each instance's task
+        # skill codes offset to its own rows
+        self.taskSkillCode = np.zeros(shape, dtype=np.int64)
+        offsets = np.cumsum([0] + [len(instance.empHasSkill) for instance in self.instances])
+        self.empHasSkill = np.zeros((offsets[-1], self.numEmps), dtype=bool)
+
+        for b, instance in enumerate(self.instances):
+            numTasks, numEmps = instance.numTasks, instance.numEmps
+            self.taskTime[b, :numTasks] = instance.taskTime
+            self.taskDifficulty[b, :numTasks] = instance.taskDifficulty
+            self.taskDeadline[b, :numTasks] = instance.taskDeadline
+            self.empHours[b, :numEmps] = instance.empHours
+            self.empLevel[b, :numEmps] = instance.empLevel
+            self.timeRank[b, :numTasks] = instance.timeRank
+            self.taskSkillCode[b, :numTasks] = instance.taskSkillCode + offsets[b]
+            self.empHasSkill[offsets[b]:offsets[b + 1], :numEmps] = instance.empHasSkill
+
+    # Name: Subset
+    # Purpose: Batch of some of the instances, as finished ones are dropped
+    # Input: keep: indexes of the instances to keep
+    # Output: InstanceBatch
+    def Subset(self, keep):
+        return InstanceBatch([self.instances[b] for b in keep])
+
+# Name: CalcPenaltiesBatched
+# Purpose: Calculate the five penalty terms of the populations of every
+#   instance of a batch at once. Gives the same values as CalcPenaltiesBatch
+#   run on each instance in turn.
+# Input: genes: 3-D integer array (instances x individuals x tasks) of
+#   employee numbers, padded tasks holding 1, batch: InstanceBatch
+# Output: penalties array (instances x individuals x penalty terms), columns
+#   ordered as PENALTY_FIELDS
+def CalcPenaltiesBatched(genes, batch):
+    numInstances, numVectors, numTasks = genes.shape
+    numEmps = batch.numEmps
+    if numInstances != batch.size or numTasks != batch.numTasks:
+        raise IndexError("gene array does not match the batch")
+    empIdx = genes - 1
+    if genes.size and (empIdx.min() < 0 or
+                       (empIdx >= batch.empCounts[:, np.newaxis, np.newaxis]).any()):
+        raise IndexError("gene outside of employee range")
+    mask = batch.taskMask[:, np.newaxis, :]
+
+    # Offsets into the flattened per instance employee and task arrays
+    empOffset = (np.arange(numInstances) * numEmps)[:, np.newaxis, np.newaxis]
+    taskOffset = (np.arange(numInstances) * numTasks)[:, np.newaxis, np.newaxis]
+    taskTime = np.broadcast_to(batch.taskTime[:, np.newaxis, :], genes.shape)
+
+    # Overload: hours assigned to each employee of each vector by bincount
+    numRows = numInstances * numVectors
+    binIdx = empIdx.reshape(numRows, numTasks) + (np.arange(numRows) * numEmps)[:, np.newaxis]
+    assignedHrs = np.bincount(binIdx.ravel(), weights=taskTime.ravel(),
+                              minlength=numRows * numEmps)
+    assignedHrs = assignedHrs.reshape(numInstances, numVectors, numEmps)
+    assignedHrs = assignedHrs.astype(batch.taskTime.dtype)
+    overPenalty = np.maximum(assignedHrs - batch.empHours[:, np.newaxis, :], 0).sum(axis=2)
+
+    # Skill and difficulty: gather from the stacked skill x employee tables
+    # and the employee levels
+    skillMatch = batch.empHasSkill[batch.taskSkillCode[:, np.newaxis, :], empIdx]
+    skillPenalty = (~skillMatch & mask).sum(axis=2)
+    empLevel = batch.empLevel.ravel()[empIdx + empOffset]
+    diffPenalty = (np.maximum(batch.taskDifficulty[:, np.newaxis, :] - empLevel, 0) *
+                   mask).sum(axis=2)
+    assignPenalty = np.zeros((numInstances, numVectors), dtype=np.int64)
+
+    # Deadline: order each vector by employee then processing time, and take
+    # a cumulative sum of time that restarts at the start of each employee
+    order = np.argsort(empIdx * numTasks + batch.timeRank[:, np.newaxis, :], axis=2)
+    sortedEmp = np.take_along_axis(empIdx, order, axis=2)
+    sortedTime = batch.taskTime.ravel()[order + taskOffset]
+    runningTime = np.cumsum(sortedTime, axis=2)
+    isStart = np.ones(genes.shape, dtype=bool)
+    isStart[:, :, 1:] = sortedEmp[:, :, 1:] != sortedEmp[:, :, :-1]
+    startPos = np.maximum.accumulate(np.where(isStart, np.arange(numTasks), 0), axis=2)
+    finish = runningTime - np.take_along_axis(runningTime - sortedTime, startPos, axis=2)
+    late = np.maximum(finish - batch.taskDeadline.ravel()[order + taskOffset], 0)
+    deadlinePenalty = (late * batch.taskMask.ravel()[order + taskOffset]).sum(axis=2)
+
+    return np.stack([overPenalty, skillPenalty, diffPenalty, deadlinePenalty,
+                     assignPenalty], axis=2)
+
+# Name: EvaluateBatched
+# Purpose: Score the populations of every instance of a batch in one pass,
+#   each instance's fitness ratios and roulette probabilities taken over its
+#   own population, as in EvaluateFitnessBatch
+# Input: genes: 3-D integer array (instances x individuals x tasks), batch:
+#   InstanceBatch
+# Output: dictionary of arrays (instances x individuals), keyed by the
+#   Chromosome field names
+def EvaluateBatched(genes, batch):
+    penalties = CalcPenaltiesBatched(genes, batch)
+    scores = {field: penalties[:, :, i] for i, field in enumerate(PENALTY_FIELDS)}
+    scores["totalViolations"] = penalties.sum(axis=2)
+    scores["cost"] = 0.2 * scores["totalViolations"]
+    scores["fitness"] = 1.0 / (scores["cost"] + 1e-8)
+    scores["fitnessRatio"] = scores["fitness"] / scores["fitness"].sum(axis=1, keepdims=True)
+    scores["cumulativeProb"] = np.cumsum(scores["fitnessRatio"], axis=1)
+    return scores
+
+# Name: SelectParentsBatched
+# Purpose: Draw every parent needed by every instance for a generation, each
+#   from its own population
+# Input: scores: dictionary from EvaluateBatched, num: parents per instance,
+#   method: one of BATCH_SELECTION_METHODS, rng: numpy random Generator,
+#   tournamentSize: individuals in each tournament
+# Output: array of selected row indexes (instances x num)
+def SelectParentsBatched(scores, num, method, rng, tournamentSize=2):
+    fitness = scores["fitness"]
+    numInstances, size = fitness.shape
+    if method == "tournament":
+        entrants = rng.integers(0, size, size=(numInstances, num, tournamentSize))
+        entrantFitness = np.take_along_axis(fitness[:, np.newaxis, :],
+                                            entrants.reshape(numInstances, -1)[:, np.newaxis, :],
+                                            axis=2).reshape(entrants.shape)
+        winners = np.argmax(entrantFitness, axis=2)
+        return np.take_along_axis(entrants, winners[:, :, np.newaxis], axis=2)[:, :, 0]
+
+    if method == "roulette":
+        cumulativeProb = scores["cumulativeProb"]
+    elif method == "rank":
+        # Linear ranking with a pressure of 1.5, as RankSelect
+        rank = np.empty(fitness.shape)
+        np.put_along_axis(rank, np.argsort(fitness, axis=1, kind="stable"),
+                          np.arange(size)[np.newaxis, :], axis=1)
+        weights = 0.5 + rank / (size - 1) if size > 1 else np.ones(fitness.shape)
+        cumulativeProb = np.cumsum(weights / weights.sum(axis=1, keepdims=True), axis=1)
+    else:
+        raise Error("unknown batch selection method " + str(method))
+
+    # One binary search over every instance's wheel, each shifted into its
+    # own unit interval
+    shift = np.arange(numInstances)[:, np.newaxis]
+    picks = np.searchsorted((cumulativeProb + shift).ravel(),
+                            (rng.random((numInstances, num)) + shift).ravel(), side="left")
+    return np.clip(picks.reshape(numInstances, num) - shift * size, 0, size - 1)
+
+# Inputs:
+#   instances: list of ProblemInstance, solved independently
+#   populationSize: size of each instance's population
+#   maxGenerations: maximum number of generations
+#   crossoverRate: rate of genetic crossover
+#   mutationRate: rate of genetic mutation
+#   elitism: Number of best chromosomes kept each generation
+#   rng: optional numpy random Generator
+#   selection: parent selection method, roulette, tournament or rank
+#   tournamentSize: individuals in each tournament for tournament selection
+#   logs: optional list of one csv file or telemetry Sink per instance,
+#       streamed its generation, cost, time and feasability, None entries skip
+#   callback: optional function called each generation with the generation
+#       and a list of each instance's best cost, returning True stops the run
+#   seed: seed for the random stream when no rng is given, random when None
+# Outputs:
+#   best: list of the best chromosome of each instance after the algorithm
+#       finishes, an instance stops early once its cost reaches the lower bound
+def BatchGeneticAlgorithm(instances, populationSize, maxGenerations, crossoverRate,
+                          mutationRate, elitism, rng=None, selection="roulette",
+                          tournamentSize=2, logs=None, callback=None, seed=None):
+    timeStart = time.perf_counter()
+    if selection not in BATCH_SELECTION_METHODS:
+        raise Error("unknown batch selection method " + str(selection))
+    if elitism >= populationSize:
+        raise Error("elitism must be smaller than the population size")
+    if rng is None:
+        rng = MakeRng(seed)
+    batch = InstanceBatch(instances)
+    if logs is None:
+        logs = [None] * batch.size
+    if len(logs) != batch.size:
+        raise Error("need one log per instance")
+    sinks = [OpenLog(log) for log in logs]
+
+    # Generations alternate between two gene buffers, offspring are made in
+    # pairs so there is room for a spare row when their number is odd
+    numPairs = (populationSize - elitism + 1) // 2
+    capacity = elitism + 2 * numPairs
+    buffers = [np.ones((batch.size, capacity, batch.numTasks), dtype=np.int64)
+               for _ in range(2)]
+
+    # Random initial populations, padded tasks held on employee 1
+    genes = buffers[0][:, :populationSize]
+    genes[:] = rng.integers(1, batch.empCounts[:, np.newaxis, np.newaxis] + 1,
+                            size=genes.shape)
+    genes[~np.broadcast_to(batch.taskMask[:, np.newaxis, :], genes.shape)] = 1
+    scores = EvaluateBatched(genes, batch)
+
+    # Positions of the instances still running in the original list
+    active = np.arange(batch.size)
+    results = [None] * batch.size
+    bestCosts = [None] * batch.size
+    generation = 0
+    while True:
+        # Log each running instance's best and drop those that are finished
+        bestIdx = np.argmax(scores["fitness"], axis=1)
+        elapsedTime = time.perf_counter() - timeStart
+        finished = []
+        for i, b in enumerate(active.tolist()):
+            cost = scores["cost"][i, bestIdx[i]].item()
+            bestCosts[b] = cost
+            if sinks[b] is not None:
+                sinks[b].Write((generation, cost, elapsedTime if generation else 0,
+                                scores["totalViolations"][i].sum().item()))
+            if generation >= maxGenerations or ReachedBound(cost, batch.instances[i]):
+                finished.append(i)
+                results[b] = BestChromosome(genes[i], scores, i, bestIdx[i],
+                                            batch.taskCounts[i])
+        stopped = callback is not None and generation > 0 and callback(generation,
+                                                                        list(bestCosts))
+        if stopped or len(finished) == len(active):
+            break
+        if finished:
+            keep = np.setdiff1d(np.arange(len(active)), finished)
+            active = active[keep]
+            batch = batch.Subset(keep)
+            buffers = [buffer[keep] for buffer in buffers]
+            genes = buffers[generation % 2][:, :populationSize]
+            scores = {field: values[keep] for field, values in scores.items()}
+
+        # Breed and score the next populations of every running instance
+        genes = NextBatchGeneration(genes, scores, buffers[(generation + 1) % 2], batch,
+                                    crossoverRate, mutationRate, elitism, rng, selection,
+                                    tournamentSize)
+        scores = EvaluateBatched(genes, batch)
+        generation += 1
+
+    # Instances still running when stopped by the callback
+    bestIdx = np.argmax(scores["fitness"], axis=1)
+    for i, b in enumerate(active.tolist()):
+        if results[b] is None:
+            results[b] = BestChromosome(genes[i], scores, i, bestIdx[i],
+                                        batch.taskCounts[i])
+    for sink in sinks:
+        if sink is not None:
+            sink.Close()
+    return results
+
+# Name: NextBatchGeneration
+# Purpose: Breed the next populations of every instance of a batch, as
+#   NextGeneration does for one: elites are copied over, parents selected and
+#   copied into the offspring rows in pairs, then crossed over and mutated in
+#   place, padded tasks left on employee 1
+# Input: genes: current populations (instances x individuals x tasks),
+#   scores: their scores, newGenes: gene buffer to fill, batch: InstanceBatch,
+#   crossoverRate, mutationRate, elitism, rng: numpy random Generator,
+#   selection: parent selection method, tournamentSize
+# Output: new populations, a view of the first rows of newGenes
+def NextBatchGeneration(genes, scores, newGenes, batch, crossoverRate, mutationRate,
+                        elitism, rng, selection="roulette", tournamentSize=2):
+    numInstances, populationSize, numTasks = genes.shape
+    numPairs = (newGenes.shape[1] - elitism) // 2
+    rows = np.arange(numInstances)[:, np.newaxis]
+
+    # Copy the elitism best rows of each instance to the start of its new
+    # population
+    elites = np.argsort(-scores["fitness"], axis=1, kind="stable")[:, :elitism]
+    newGenes[:, :elitism] = genes[rows, elites]
+
+    # Choose every parent for the generation and copy them in pairs, into
+    # one contiguous array so every instance's offspring can be worked on as
+    # a single block of rows
+    parents = SelectParentsBatched(scores, 2 * numPairs, selection, rng, tournamentSize)
+    offspring = genes[rows, parents]
+
+    # Crossover and mutation over every instance's offspring at once, cut
+    # and picked within each instance's real tasks
+    Crossover(offspring.reshape(numInstances * numPairs, 2, numTasks), crossoverRate, rng,
+              np.repeat(batch.taskCounts, numPairs))
+    Mutate(offspring.reshape(-1, numTasks), mutationRate, rng,
+           np.repeat(batch.taskMask, 2 * numPairs, axis=0))
+    newGenes[:, elitism:] = offspring
+
+    return newGenes[:, :populationSize]
+
+# Name: BestChromosome
+# Purpose: Copy one instance's best individual out as a Chromosome object,
+#   with the padding removed
+# Input: genes: the instance's population, scores: batch scores, i: the
+#   instance's row in the batch, idx: the individual, numTasks: its real tasks
+# Output: Chromosome with its gene list and scores set
+def BestChromosome(genes, scores, i, idx, numTasks):
+    population = Population(genes[:, :numTasks])
+    for field in SCORE_FIELDS:
+        setattr(population, field, scores[field][i])
+    return population.ToChromosome(int(idx))
+
+# Allows for seperate execution of the batched genetic algorithm
+if __name__ == "__main__":
+    from bench import GenerateInstance
+
+    # Solve a night's worth of small team rosters together
+    instances = [GenerateInstance(12 + i % 9, 3 + i % 4, seed=i) for i in range(200)]
+    timeStart = time.perf_counter()
+    best = BatchGeneticAlgorithm(instances, 60, 200, 0.77, 0.2, 1,
+                                 seed=0)
+    print("Batch GA instances:", len(best))
+    print("Batch GA mean best cost:", sum(chromo.cost for chromo in best) / len(best))
+    print("Batch GA time:", time.perf_counter() - timeStart)
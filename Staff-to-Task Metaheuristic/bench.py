@@ -0,0 +1,257 @@
+# Scaling benchmarks of the solvers on seeded synthetic instances
+# Contributers: Michael Durkan
+
+from classes import Task, Employee, Error
+from instance import ProblemInstance
+from profiler import Profiler
+from bounds import CostLowerBound, OptimalityGap, SolveExact
+from portfolio import SOLVER_PARAMS
+from ga import GeneticAlgorithm
+from aco import AntColonyOptimisation
+from pso import pso
+import numpy as np
+import tracemalloc
+import argparse
+import json
+import time
+
+# Benchmark cases, each solver is given the same number of fitness evaluations,
+# small cases marked exact are also solved to optimality for reference. A
+# case's params give solver settings overriding SOLVER_PARAMS, the largest
+# cases run the ant colony on candidate lists as its dense pheremone and
+# heuristic matrices would not fit in memory.
+SUITES = {
+    "quick": [
+        {"name": "t10e5", "numTasks": 10, "numEmps": 5, "budget": 30000, "exact": True},
+        {"name": "t200e20", "numTasks": 200, "numEmps": 20, "budget": 20000},
+        {"name": "t1000e100", "numTasks": 1000, "numEmps": 100, "budget": 10000,
+         "skillSparsity": 0.8},
+    ],
+    "full": [
+        {"name": "t10e5", "numTasks": 10, "numEmps": 5, "budget": 30000, "exact": True},
+        {"name": "t1000e100", "numTasks": 1000, "numEmps": 100, "budget": 30000},
+        {"name": "t5000e200", "numTasks": 5000, "numEmps": 200, "budget": 20000},
+        {"name": "t5000e200tight", "numTasks": 5000, "numEmps": 200, "budget": 20000,
+         "deadlineTightness": 3.0},
+        {"name": "t20000e1000", "numTasks": 20000, "numEmps": 1000, "budget": 5000,
+         "skillSparsity": 0.9, "params": {"aco": {"candidateLists": True}}},
+        {"name": "t50000e2000", "numTasks": 50000, "numEmps": 2000, "budget": 2000,
+         "skillSparsity": 0.95, "params": {"aco": {"candidateLists": True}}},
+    ],
+}
+
+# Allowed change from the baseline before a result is flagged as a regression,
+# as a fraction of the baseline value
+TOLERANCES = {"evalsPerSecond": 0.15, "peakMemoryMB": 0.20, "timeToTarget": 0.25,
+              "finalCost": 0.05}
+
+# Name: GenerateInstance
+# Purpose: Build a seeded synthetic instance of any size
+# Input: numTasks, numEmps, numSkills: defaults to one per ten employees (at
+#   least three), skillSparsity: chance an employee lacks each skill (each
+#   still has at least one), deadlineTightness: higher values give less slack
+#   between a task's time and its deadline, seed
+# Output: ProblemInstance
+def GenerateInstance(numTasks, numEmps, numSkills=None, skillSparsity=0.5,
+                     deadlineTightness=1.0, seed=0):
+    if numTasks < 1 or numEmps < 1:
+        raise Error("instance needs at least one task and one employee")
+    if not 0.0 <= skillSparsity < 1.0:
+        raise Error("skillSparsity must be in [0, 1)")
+    if deadlineTightness <= 0:
+        raise Error("deadlineTightness must be positive")
+    rng = np.random.default_rng(seed)
+    if numSkills is None:
+        numSkills = max(3, numEmps // 10)
+    skillNames = ["S" + str(skill) for skill in range(numSkills)]
+
+    # Task times, difficulties and skills as in data.py
+    times = rng.integers(1, 9, size=numTasks)
+    difficulties = rng.integers(1, 8, size=numTasks)
+    skills = rng.integers(0, numSkills, size=numTasks)
+
+    # Employees share the total work with about 10% spare capacity
+    meanLoad = times.sum() / numEmps
+    hours = np.maximum(np.rint(meanLoad * rng.uniform(0.8, 1.4, size=numEmps)), 1)
+    levels = rng.integers(1, 8, size=numEmps)
+    hasSkill = rng.random((numEmps, numSkills)) >= skillSparsity
+    hasSkill[np.arange(numEmps), rng.integers(0, numSkills, size=numEmps)] = True
+
+    # Deadlines leave random slack up to an employee's mean load
+    slack = rng.random(numTasks) * meanLoad / deadlineTightness
+    deadlines = times + np.rint(slack).astype(np.int64)
+
+    taskList = [Task("T" + str(i + 1), int(times[i]), int(difficulties[i]),
+                     int(deadlines[i]), skillNames[skills[i]]) for i in range(numTasks)]
+    empList = [Employee("E" + str(i + 1), int(hours[i]), int(levels[i]),
+                        [skillNames[s] for s in np.nonzero(hasSkill[i])[0]])
+               for i in range(numEmps)]
+    return ProblemInstance(taskList, empList)
+
+# Name: RunSolver
+# Purpose: Run one solver on an instance for a fixed evaluation budget,
+#   recording throughput, time to reach the target cost and final cost
+# Input: solver: ga, aco or pso, instance: ProblemInstance, budget: fitness
+#   evaluations, seed, targetCost: cost to time the run to, or None,
+#   trackMemory: measure peak memory with tracemalloc (slows the run),
+#   params: optional settings overriding SOLVER_PARAMS
+# Output: result dict
+def RunSolver(solver, instance, budget, seed=0, targetCost=None, trackMemory=True,
+              params=None):
+    if solver not in SOLVER_PARAMS:
+        raise Error("unknown solver " + str(solver))
+    settings = dict(SOLVER_PARAMS[solver])
+    settings.update(params or {})
+    rng = np.random.default_rng(seed)
+    profiler = Profiler()
+    reached = {"time": None}
+    timeStart = time.perf_counter()
+
+    # Note the first time the best cost reaches the target
+    def Callback(iteration, bestCost, bestSolution):
+        if reached["time"] is None and targetCost is not None and bestCost <= targetCost:
+            reached["time"] = time.perf_counter() - timeStart
+        return False
+
+    common = {"instance": instance, "rng": rng, "log": None, "callback": Callback,
+              "profiler": profiler}
+    if trackMemory:
+        tracemalloc.start()
+    try:
+        if solver == "ga":
+            best = GeneticAlgorithm(
+                maxGenerations=max(budget // settings["populationSize"] - 1, 1),
+                **settings, **common)
+            finalCost = best.cost
+        elif solver == "aco":
+            _, finalCost = AntColonyOptimisation(
+                maxIterations=max(budget // settings["numAnts"], 1), **settings, **common)
+        else:
+            _, finalCost = pso(maxIter=max(budget // settings["numParticles"] - 1, 1),
+                               **settings, **common)
+        peakMemory = tracemalloc.get_traced_memory()[1] if trackMemory else 0
+    finally:
+        if trackMemory:
+            tracemalloc.stop()
+
+    summary = profiler.Summary()
+    return {"evaluations": summary["counters"]["evaluations"],
+            "time": summary["totalTime"], "evalsPerSecond": summary["evalsPerSecond"],
+            "timeToTarget": reached["time"], "peakMemoryMB": peakMemory / 2 ** 20,
+            "finalCost": float(finalCost), "lowerBound": CostLowerBound(instance),
+            "gap": OptimalityGap(finalCost, instance)}
+
+# Name: RunSuite
+# Purpose: Run every solver on every case of a suite. Each run is repeated
+#   with the same seed, so gives the same costs, and the fastest repeat is
+#   kept to reduce timing noise. Peak memory is measured on an extra run, as
+#   tracemalloc slows the run it watches.
+# Input: cases: list of case dicts, solvers: solver names, seed, baseline:
+#   optional baseline results, whose final costs become the target costs of
+#   cases without one, repeats: timed runs of each solver, trackMemory
+# Output: dict of "case/solver" to result dict
+def RunSuite(cases, solvers=("ga", "aco", "pso"), seed=0, baseline=None, repeats=3,
+             trackMemory=True):
+    results = {}
+    for case in cases:
+        instance = GenerateInstance(case["numTasks"], case["numEmps"],
+                                    case.get("numSkills"), case.get("skillSparsity", 0.5),
+                                    case.get("deadlineTightness", 1.0), seed)
+        optimum = SolveExact(instance)[1] if case.get("exact") else None
+        for solver in solvers:
+            key = case["name"] + "/" + solver
+            targetCost = case.get("targetCost")
+            if targetCost is None and baseline and key in baseline:
+                targetCost = baseline[key]["finalCost"]
+            params = case.get("params", {}).get(solver)
+            runs = [RunSolver(solver, instance, case["budget"], seed, targetCost, False,
+                              params)
+                    for _ in range(max(repeats, 1))]
+            result = max(runs, key=lambda run: run["evalsPerSecond"])
+            if trackMemory:
+                result["peakMemoryMB"] = RunSolver(solver, instance, case["budget"], seed,
+                                                   None, True, params)["peakMemoryMB"]
+            result["targetCost"] = targetCost
+            result["optimum"] = optimum
+            results[key] = result
+    return results
+
+# Name: CompareBaseline
+# Purpose: Flag results that are worse than the baseline by more than the
+#   tolerance, lower throughput or higher memory, time to target and cost
+# Input: results, baseline: dicts of "case/solver" to result, tolerances:
+#   dict of metric to allowed fraction
+# Output: list of (key, metric, baseline value, new value)
+def CompareBaseline(results, baseline, tolerances=TOLERANCES):
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        for metric, tolerance in tolerances.items():
+            oldValue, newValue = old.get(metric), result.get(metric)
+            if metric == "timeToTarget" and result.get("targetCost") is not None:
+                # Never reaching the target counts as a regression
+                if oldValue is not None and newValue is None:
+                    regressions.append((key, metric, oldValue, newValue))
+                    continue
+            if oldValue is None or newValue is None:
+                continue
+            if metric == "evalsPerSecond":
+                worse = newValue < oldValue * (1.0 - tolerance)
+            else:
+                # Small absolute slack so zero costs and tiny times do not flag
+                worse = newValue > oldValue * (1.0 + tolerance) + 1e-3
+            if worse:
+                regressions.append((key, metric, oldValue, newValue))
+    return regressions
+
+# Name: FormatResults
+# Purpose: Lay out the results as a table
+# Input: results dict
+# Output: table string
+def FormatResults(results):
+    lines = ["%-24s %10s %10s %10s %10s %8s" % ("case/solver", "evals/s", "target s",
+                                                 "peak MB", "cost", "gap")]
+    for key, result in results.items():
+        target = result["timeToTarget"]
+        lines.append("%-24s %10.0f %10s %10.1f %10.2f %7.1f%%" % (
+            key, result["evalsPerSecond"], "-" if target is None else "%.3f" % target,
+            result["peakMemoryMB"], result["finalCost"], 100.0 * result["gap"]))
+    return "\n".join(lines)
+
+# Allows the benchmarks to be run from the command line
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Staff-to-Task solver benchmarks")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick")
+    parser.add_argument("--solvers", nargs="+", default=["ga", "aco", "pso"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="baseline json to compare against")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="timed runs of each solver, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the peak memory run")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+
+    results = RunSuite(SUITES[args.suite], args.solvers, args.seed, baseline,
+                       args.repeats, not args.no_memory)
+    print(FormatResults(results))
+
+    if args.save:
+        with open(args.save, "w") as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+
+    # Exit with an error when anything got worse, for use in scripts
+    if baseline is not None:
+        regressions = CompareBaseline(results, baseline)
+        for key, metric, oldValue, newValue in regressions:
+            print("REGRESSION", key, metric, oldValue, "->", newValue)
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,214 @@
+# Lower bounds on the cost of a roster, and an exact solver for small instances
+# Contributers: Michael Durkan
+
+from classes import Error
+from instance import DefaultInstance
+from fitness import EvaluateFitnessBatch
+import numpy as np
+import sys
+
+# Name: TaskTermBounds
+# Purpose: Least skill plus difficulty penalty each task can get from any
+#   employee, and the least difficulty penalty alone. The difficulty gap only
+#   shrinks as the level rises, so only the highest level overall and the
+#   highest level holding each skill need to be checked.
+# Input: instance: ProblemInstance
+# Output: array of least skill plus difficulty penalty, array of least
+#   difficulty penalty, one of each per task
+def TaskTermBounds(instance):
+    maxLevel = instance.empLevel.max()
+    skillLevels = np.where(instance.empHasSkill, instance.empLevel, -np.inf)
+    bestSkilled = skillLevels.max(axis=1)[instance.taskSkillCode]
+
+    minDiff = np.maximum(instance.taskDifficulty - maxLevel, 0)
+    skilled = np.maximum(instance.taskDifficulty - bestSkilled, 0)
+    return np.minimum(skilled, 1 + minDiff), minDiff
+
+# Name: EarliestFinish
+# Purpose: Earliest time the kth of a set of tasks can finish on a number of
+#   employees, which is no earlier than the kth shortest time, nor the k
+#   shortest times shared evenly over the employees
+# Input: sortedTimes: task times in increasing order, numEmps: employees the
+#   tasks are shared over
+# Output: array of earliest finish times
+def EarliestFinish(sortedTimes, numEmps):
+    return np.maximum(sortedTimes, np.cumsum(sortedTimes) / numEmps)
+
+# Name: TardinessBound
+# Purpose: Lower bound on the total deadline violation of a set of tasks done
+#   on a number of employees, pairing the earliest finish times with the
+#   deadlines in order, which gives the least possible violation
+# Input: times: task times, deadlines: task deadlines, numEmps: employees the
+#   tasks are shared over
+# Output: lower bound on the violation
+def TardinessBound(times, deadlines, numEmps):
+    finish = EarliestFinish(np.sort(times), numEmps)
+    return np.maximum(finish - np.sort(deadlines), 0).sum().item()
+
+# Name: ViolationLowerBound
+# Purpose: Lower bound on the total violations of any roster, the best of two
+#   relaxations. Both bound the overload by the hours over the total capacity.
+#   The first adds the least skill and difficulty penalty of each task and the
+#   deadline bound of all tasks over all employees. The second adds the least
+#   difficulty penalty of each task and, for each skill, the best trade off
+#   between tasks given to employees without the skill (a skill penalty each)
+#   and the deadline bound of the rest over the employees with it.
+# Input: instance: ProblemInstance, defaults to the synthetic data
+# Output: lower bound on the total violations
+def ViolationLowerBound(instance=None):
+    if instance is None:
+        instance = DefaultInstance()
+    taskTime = instance.taskTime
+    taskDeadline = instance.taskDeadline
+    overloadBound = max((taskTime.sum() - instance.empHours.sum()).item(), 0)
+    taskBound, diffBound = TaskTermBounds(instance)
+
+    allTasks = (overloadBound + taskBound.sum().item() +
+                TardinessBound(taskTime, taskDeadline, instance.numEmps))
+
+    skillGroups = overloadBound + diffBound.sum().item()
+    skilledEmps = instance.empHasSkill.sum(axis=1)
+    for code in np.unique(instance.taskSkillCode):
+        inGroup = instance.taskSkillCode == code
+        numGroup = inGroup.sum().item()
+        if skilledEmps[code] == 0:
+            # Nobody has the skill, so every task gets a skill penalty
+            skillGroups += numGroup
+            continue
+
+        # With some tasks given to employees without the skill, the rest take
+        # no less than the group's shortest times and are due no later than
+        # its latest deadlines
+        finish = EarliestFinish(np.sort(taskTime[inGroup]), skilledEmps[code])
+        deadlines = np.sort(taskDeadline[inGroup])
+        best = numGroup
+        for elsewhere in range(numGroup):
+            # Moving tasks away costs at least one each, so no better from here
+            if elsewhere >= best:
+                break
+            tardiness = np.maximum(finish[:numGroup - elsewhere] - deadlines[elsewhere:], 0)
+            best = min(best, elsewhere + tardiness.sum().item())
+        skillGroups += best
+
+    return max(allTasks, skillGroups)
+
+# Name: CostLowerBound
+# Purpose: Lower bound on the cost of any roster, worked out once per instance
+# Input: instance: ProblemInstance, defaults to the synthetic data
+# Output: lower bound on the cost
+def CostLowerBound(instance=None):
+    if instance is None:
+        instance = DefaultInstance()
+    if instance.costBound is None:
+        # Cost weighting as in CalcCost
+        instance.costBound = 0.2 * ViolationLowerBound(instance)
+    return instance.costBound
+
+# Name: ReachedBound
+# Purpose: Check whether a cost matches the lower bound, so cannot improve
+# Input: cost, instance: ProblemInstance
+# Output: True when the cost is optimal
+def ReachedBound(cost, instance):
+    return cost is not None and cost <= CostLowerBound(instance) + 1e-9
+
+# Name: OptimalityGap
+# Purpose: Relative distance of a cost above the lower bound
+# Input: cost, instance: ProblemInstance, defaults to the synthetic data
+# Output: gap from 0 (proven optimal) to 1
+def OptimalityGap(cost, instance=None):
+    bound = CostLowerBound(instance)
+    if cost <= bound + 1e-9:
+        return 0.0
+    return (cost - bound) / cost
+
+# Name: SolveExact
+# Purpose: Branch and bound over every roster of a small instance. Tasks are
+#   assigned in time order, so each task finishes after the tasks already
+#   given to its employee and every penalty can be added as it is assigned.
+#   A branch is cut when its penalties plus the least skill and difficulty
+#   penalty of the tasks left cannot beat the best roster found, and
+#   employees alike in hours, level, skills and current load are tried once.
+# Input: instance: ProblemInstance, defaults to the synthetic data,
+#   incumbent: optional gene list of a known roster to cut against, maxNodes:
+#   branches to try before giving up on proving optimality
+# Output: best gene list, its cost, and whether it is proven optimal
+def SolveExact(instance=None, incumbent=None, maxNodes=2000000):
+    if instance is None:
+        instance = DefaultInstance()
+    numTasks, numEmps = instance.numTasks, instance.numEmps
+
+    order = instance.timeOrder.tolist()
+    taskTime = instance.taskTime.tolist()
+    taskDeadline = instance.taskDeadline.tolist()
+    empHours = instance.empHours.tolist()
+    skillCost = (~instance.empHasSkill[instance.taskSkillCode]).astype(np.int64)
+    taskEmpCost = (skillCost + np.maximum(instance.taskDifficulty[:, np.newaxis] -
+                                          instance.empLevel[np.newaxis, :], 0)).tolist()
+    empKind = [(empHours[e], instance.empLevel[e].item(),
+                instance.empHasSkill[:, e].tobytes()) for e in range(numEmps)]
+
+    # Least penalty of all the tasks from each position in the order onward
+    taskBound, _ = TaskTermBounds(instance)
+    remaining = np.concatenate([np.cumsum(taskBound[order][::-1])[::-1], [0]]).tolist()
+    lowerBound = ViolationLowerBound(instance)
+
+    state = {"best": float("inf"), "genes": None, "nodes": 0, "complete": True}
+    if incumbent is not None:
+        state["best"] = EvaluateFitnessBatch([incumbent], instance)["totalViolations"][0].item()
+        state["genes"] = list(incumbent)
+    genes = [0] * numTasks
+    empLoad = [0] * numEmps
+
+    def Branch(pos, violations):
+        if pos == numTasks:
+            state["best"] = violations
+            state["genes"] = list(genes)
+            return
+        taskIdx = order[pos]
+        time, deadline = taskTime[taskIdx], taskDeadline[taskIdx]
+
+        # Penalty added by giving the task to each employee, cheapest first
+        moves = []
+        seen = set()
+        for emp in range(numEmps):
+            load = empLoad[emp]
+            if (empKind[emp], load) in seen:
+                continue
+            seen.add((empKind[emp], load))
+            added = (taskEmpCost[taskIdx][emp] + max(load + time - deadline, 0) +
+                     max(load + time - empHours[emp], 0) - max(load - empHours[emp], 0))
+            moves.append((added, emp))
+        moves.sort()
+
+        for added, emp in moves:
+            if violations + added + remaining[pos + 1] >= state["best"]:
+                break
+            if state["nodes"] >= maxNodes:
+                state["complete"] = False
+                return
+            state["nodes"] += 1
+            genes[taskIdx] = emp + 1
+            empLoad[emp] += time
+            Branch(pos + 1, violations + added)
+            empLoad[emp] -= time
+            if state["best"] <= lowerBound:
+                return
+
+    recursionLimit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursionLimit, numTasks + 100))
+    try:
+        Branch(0, 0)
+    finally:
+        sys.setrecursionlimit(recursionLimit)
+
+    if state["genes"] is None:
+        raise Error("node limit reached before any roster was found")
+    return state["genes"], 0.2 * state["best"], state["complete"]
+
+# Allows the bounds to be checked on the synthetic data
+if __name__ == "__main__":
+
+    bestSolExact, bestCostExact, optimal = SolveExact()
+    print("Lower bound on cost:", CostLowerBound())
+    print("Exact Best sol:", bestSolExact)
+    print("Exact Best sol cost:", bestCostExact, "(optimal)" if optimal else "(node limit)")
@@ -0,0 +1,163 @@
+# Periodic checkpoints of solver state, so long runs can be resumed exactly
+# Contributers: Michael Durkan
+
+from classes import Error
+import numpy as np
+import hashlib
+import json
+import time
+import os
+
+# Format version written into every checkpoint
+CHECKPOINT_VERSION = 2
+
+# Name: Checkpointer
+# Purpose: Decide when a solver saves its state and write the checkpoint file.
+#   The solver calls Due at the end of each iteration and Save when it is due.
+class Checkpointer:
+    # Inputs:
+    #   path: checkpoint file, replaced at each save
+    #   every: iterations between checkpoints, None to save on time alone
+    #   seconds: optional seconds between checkpoints, whichever comes first
+    def __init__(self, path, every=100, seconds=None):
+        if every is None and seconds is None:
+            raise Error("every or seconds must be given")
+        if every is not None and every < 1:
+            raise Error("every must be at least 1")
+        if seconds is not None and seconds <= 0:
+            raise Error("seconds must be positive")
+        self.path = path
+        self.every = every
+        self.seconds = seconds
+        self.lastSave = time.perf_counter()
+        self.saves = 0
+
+    # Name: Due
+    # Purpose: Check whether a checkpoint should be saved after an iteration
+    # Input: iteration: iteration or generation just finished
+    # Output: True when the state should be saved
+    def Due(self, iteration):
+        if self.every is not None and iteration % self.every == 0:
+            return True
+        return (self.seconds is not None and
+                time.perf_counter() - self.lastSave >= self.seconds)
+
+    # Name: Save
+    # Purpose: Write a solver's state after an iteration
+    # Input: solver: ga, aco or pso, iteration: iteration just finished,
+    #   params: the solver's settings, arrays: dict of name to state array,
+    #   values: dict of name to state number, rng: numpy random Generator,
+    #   instance: ProblemInstance, elapsedTime: seconds run so far, sink:
+    #   optional log Sink, stopping: optional StoppingCriteria
+    # Output: None
+    def Save(self, solver, iteration, params, arrays, values, rng, instance, elapsedTime,
+             sink=None, stopping=None):
+        meta = {"version": CHECKPOINT_VERSION, "solver": solver, "iteration": iteration,
+                "params": params, "values": values, "rng": rng.bit_generator.state,
+                "fingerprint": InstanceFingerprint(instance), "elapsedTime": elapsedTime,
+                "log": None, "stopping": None}
+        arrays = dict(arrays)
+
+        # Flush the log so a resumed run can cut it back to this iteration
+        if sink is not None:
+            meta["log"] = sink.State()
+        if stopping is not None:
+            meta["stopping"] = stopping.Snapshot()
+            best = meta["stopping"].pop("bestSolution")
+            if best is not None:
+                arrays["stoppingBest"] = best
+
+        SaveCheckpoint(self.path, meta, arrays)
+        self.lastSave = time.perf_counter()
+        self.saves += 1
+
+# Name: SaveCheckpoint
+# Purpose: Write a checkpoint atomically, to a temporary file that replaces
+#   the old checkpoint only once it is complete, so a run killed while saving
+#   leaves the previous checkpoint intact. Arrays are compressed and integer
+#   arrays stored in the smallest type holding their values.
+# Input: path: checkpoint file, meta: json serialisable dict, arrays: dict of
+#   name to array
+# Output: None
+def SaveCheckpoint(path, meta, arrays):
+    meta = dict(meta, dtypes={})
+    packed = {}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        meta["dtypes"][name] = array.dtype.str
+        if array.dtype.kind in "iu" and array.size and array.min() >= 0:
+            array = array.astype(np.min_scalar_type(array.max()))
+        packed[name] = array
+
+    tempPath = path + ".tmp"
+    with open(tempPath, "wb") as checkpointFile:
+        np.savez_compressed(checkpointFile, meta=np.array(json.dumps(meta)), **packed)
+        checkpointFile.flush()
+        os.fsync(checkpointFile.fileno())
+    os.replace(tempPath, path)
+
+# Name: LoadCheckpoint
+# Purpose: Read a checkpoint written by SaveCheckpoint
+# Input: path: checkpoint file
+# Output: dict of the saved fields, with the arrays in its "arrays" entry
+def LoadCheckpoint(path):
+    with np.load(path, allow_pickle=False) as data:
+        if "meta" not in data.files:
+            raise Error(path + " is not a checkpoint")
+        checkpoint = json.loads(data["meta"].item())
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise Error(path + " has an unsupported checkpoint version")
+        checkpoint["arrays"] = {name: data[name].astype(dtype)
+                                for name, dtype in checkpoint.pop("dtypes").items()}
+    return checkpoint
+
+# Name: InstanceFingerprint
+# Purpose: Hash the arrays a solver reads, so a checkpoint is only resumed on
+#   the instance it was saved from
+# Input: instance: ProblemInstance
+# Output: hex digest string
+def InstanceFingerprint(instance):
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (instance.taskTime, instance.taskDifficulty, instance.taskDeadline,
+                  instance.taskSkillCode, instance.empHours, instance.empLevel,
+                  instance.empHasSkill):
+        digest.update(str(array.shape).encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+# Name: RestoreRng
+# Purpose: Rebuild a random Generator exactly as it was saved
+# Input: state: bit generator state dict
+# Output: numpy random Generator
+def RestoreRng(state):
+    bitGenerator = getattr(np.random, state["bit_generator"])()
+    bitGenerator.state = state
+    return np.random.Generator(bitGenerator)
+
+# Name: ResumeState
+# Purpose: Load and check the checkpoint a solver was asked to resume from
+# Input: resume: checkpoint path, a loaded checkpoint dict, or None, solver:
+#   ga, aco or pso, instance: ProblemInstance being solved
+# Output: checkpoint dict, or None when not resuming
+def ResumeState(resume, solver, instance):
+    if resume is None:
+        return None
+    if isinstance(resume, str):
+        resume = LoadCheckpoint(resume)
+    if resume["solver"] != solver:
+        raise Error("checkpoint is from the " + resume["solver"] + " solver, not " + solver)
+    if resume["fingerprint"] != InstanceFingerprint(instance):
+        raise Error("checkpoint was saved from a different instance")
+    return resume
+
+# Name: RestoreStopping
+# Purpose: Carry a stopping criteria's counters and incumbent over from a
+#   checkpoint, so budgets and stagnation count from the start of the run
+# Input: stopping: StoppingCriteria or None, resume: checkpoint dict
+# Output: None
+def RestoreStopping(stopping, resume):
+    if stopping is None or resume["stopping"] is None:
+        return
+    snapshot = dict(resume["stopping"])
+    snapshot["bestSolution"] = resume["arrays"].get("stoppingBest")
+    stopping.Restore(snapshot)
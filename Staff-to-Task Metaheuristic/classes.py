@@ -20,6 +20,10 @@ class Task:
         self.skill = skill
 
 class Chromosome:
+    __slots__ = ("geneList", "fitness", "finish", "violation", "overPenalty",
+                 "skillPenalty", "diffPenalty", "deadlinePenalty", "assignPenalty",
+                 "cost", "fitnessRatio", "cumulativeProb", "totalViolations")
+
     def __init__(self, geneList=None):
         self.geneList = geneList
         self.fitness = 0
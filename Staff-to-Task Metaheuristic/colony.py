@@ -0,0 +1,284 @@
+# Multi-colony Ant Colony Optimization, building ants in a process pool over
+# pheremone held in shared memory
+# Contributers: Michael Durkan
+
+from classes import Error
+from instance import DefaultInstance
+from fitness import EvaluateFitnessBatch
+from aco import ConstructAnts, CandidateLists
+from telemetry import OpenLog
+from bounds import ReachedBound
+from rng import RootEntropy, KeyedRng
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+import time
+
+# Inputs:
+#   numAnts: number of ants in each colony
+#   evapRate: evaporation rate of pheremones
+#   depositConstant: degree to which pheremones are deposited relative to fitness
+#   maxIterations: number of times each colony builds new ants
+#   numColonies: colonies with their own pheremone, 1 for one shared colony
+#   exchangeInterval: iterations between colonies laying pheremone along the
+#       best trail of the previous colony in a ring
+#   instance: ProblemInstance to solve, defaults to the synthetic data
+#   seed: seed for the ants' random streams, random when None
+#   processes: worker processes, defaults to the cpu count, 0 builds the ants
+#       in this process
+#   blockSize: ants built by a worker at a time, results do not depend on the
+#       number of processes
+#   candidateLists: limit each task to its candidate employees, as in
+#       AntColonyOptimisation
+#   maxCandidates: optional cap on each task's candidates
+#   log: csv file or telemetry Sink streamed the iteration, cost, time and
+#       feasability as they are produced, None to skip
+#   callback: optional function called each iteration with the iteration,
+#       best cost and best solution, returning True stops the run
+#   stopping: optional StoppingCriteria ending the run early and holding the
+#       best solution so far
+# Outputs:
+#   bestSolution: best solution vector over all colonies after completion
+#   bestCost: best cost of that vector after completion
+def MultiColonyACO(numAnts, evapRate, depositConstant, maxIterations, numColonies=1,
+                   exchangeInterval=10, instance=None, seed=None, processes=None,
+                   blockSize=64, candidateLists=False, maxCandidates=None,
+                   log='colonyCostResults.csv', callback=None, stopping=None):
+    timeStart = time.perf_counter()
+    if instance is None:
+        instance = DefaultInstance()
+    if numAnts < 1 or numColonies < 1 or blockSize < 1:
+        raise Error("numAnts, numColonies and blockSize must be at least 1")
+    if exchangeInterval < 1:
+        raise Error("exchangeInterval must be at least 1")
+
+    # Open the log only once the arguments are known to be good, so a bad
+    # call leaves an existing log as it was
+    sink = OpenLog(log)
+    if stopping is not None:
+        stopping.Begin()
+    numTasks = instance.numTasks
+
+    # Each colony's pheremone is one row of a shared array, the full matrix
+    # flattened or one value per candidate, with the ants' genes and chosen
+    # entries alongside it so workers never send them back
+    candidates = None
+    if candidateLists:
+        candidates = CandidateLists(instance, maxCandidates)
+        initialTau = candidates.InitialPheremone(instance)
+        rowStart = candidates.indptr
+    else:
+        initialTau = np.ones(numTasks * instance.numEmps)
+        rowStart = np.arange(numTasks + 1) * instance.numEmps
+    shapes = {"tau": (numColonies, len(initialTau), np.float64),
+              "genes": (numColonies, numAnts, numTasks, np.int64),
+              "picks": (numColonies, numAnts, numTasks, np.int64)}
+    blocks, arrays = CreateShared(shapes)
+    arrays["tau"][:] = initialTau
+
+    # Fixed blocks of ants, each with its own random stream every iteration
+    entropy = RootEntropy(seed)
+    antBlocks = [(colony, start, min(start + blockSize, numAnts))
+                 for colony in range(numColonies) for start in range(0, numAnts, blockSize)]
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    settings = {"names": {name: block.name for name, block in blocks.items()},
+                "shapes": shapes, "instance": instance, "candidateLists": candidateLists,
+                "maxCandidates": maxCandidates, "rowStart": rowStart}
+    pool = None
+    if processes > 0:
+        pool = multiprocessing.Pool(processes, initializer=InitColonyWorker,
+                                    initargs=(settings,))
+    else:
+        InitColonyWorker(settings, arrays)
+    Map = pool.map if pool is not None else lambda func, jobs: list(map(func, jobs))
+
+    # Tasks split into ranges so workers update disjoint parts of the pheremone
+    numRanges = max(processes, 1)
+    taskRanges = np.linspace(0, numTasks, numRanges + 1).astype(np.int64)
+
+    colonyBestScore = np.full(numColonies, -np.inf)
+    colonyBestCost = np.full(numColonies, np.inf)
+    colonyBest = np.zeros((numColonies, numTasks), dtype=np.int64)
+    bestSolution = None
+    bestSolutionCost = None
+    try:
+        for iteration in range(1, maxIterations + 1):
+            # Build and score every colony's ants, a block per job
+            jobs = [(entropy, iteration, colony, start, stop)
+                    for colony, start, stop in antBlocks]
+            fitness = np.empty((numColonies, numAnts))
+            cost = np.empty((numColonies, numAnts))
+            totalViolations = 0
+            for colony, start, scores in Map(BuildAnts, jobs):
+                fitness[colony, start:start + len(scores["fitness"])] = scores["fitness"]
+                cost[colony, start:start + len(scores["cost"])] = scores["cost"]
+                totalViolations += scores["totalViolations"].sum().item()
+
+            # Keep each colony's best ant so far
+            bestAnts = np.argmax(fitness, axis=1)
+            for colony, bestAnt in enumerate(bestAnts.tolist()):
+                if fitness[colony, bestAnt] > colonyBestScore[colony]:
+                    colonyBestScore[colony] = fitness[colony, bestAnt]
+                    colonyBestCost[colony] = cost[colony, bestAnt]
+                    colonyBest[colony] = arrays["genes"][colony, bestAnt]
+            bestColony = int(np.argmin(colonyBestCost))
+            bestSolutionCost = colonyBestCost[bestColony].item()
+            bestSolution = colonyBest[bestColony].tolist()
+
+            elapsedTime = time.perf_counter() - timeStart
+            if sink is not None:
+                sink.Write([iteration, cost.min().item(), elapsedTime, totalViolations])
+
+            # Evaporate and deposit once per iteration, every worker taking
+            # a range of tasks of a colony
+            jobs = [(colony, taskRanges[r].item(), taskRanges[r + 1].item(), fitness[colony],
+                     colonyBestScore[colony].item(), evapRate, depositConstant)
+                    for colony in range(numColonies) for r in range(numRanges)
+                    if taskRanges[r] < taskRanges[r + 1]]
+            Map(UpdatePheremone, jobs)
+
+            # Lay pheremone along each colony's best trail in the next colony
+            if numColonies > 1 and iteration % exchangeInterval == 0:
+                ExchangeTrails(arrays["tau"], colonyBest, depositConstant, candidates,
+                               instance.numEmps)
+
+            # Let the caller see progress and stop the run early
+            if callback is not None and callback(iteration, bestSolutionCost, bestSolution):
+                break
+            if stopping is not None and stopping.Update(iteration, bestSolutionCost,
+                                                        bestSolution, numColonies * numAnts,
+                                                        arrays["genes"].reshape(-1, numTasks)):
+                break
+            if ReachedBound(bestSolutionCost, instance):
+                break
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        # Drop every view of the shared memory before releasing it
+        colonyWorker.clear()
+        arrays.clear()
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
+    # Flush the rest of the generation, cost, time and feasability log
+    if sink is not None:
+        sink.Close()
+
+    return bestSolution, bestSolutionCost
+
+# Name: CreateShared
+# Purpose: Allocate shared memory blocks and numpy arrays over them
+# Input: shapes: dict of name to shape tuple, ending with the dtype
+# Output: dict of name to SharedMemory, dict of name to array
+def CreateShared(shapes):
+    blocks, arrays = {}, {}
+    try:
+        for name, shape in shapes.items():
+            size = max(int(np.prod(shape[:-1])) * np.dtype(shape[-1]).itemsize, 1)
+            blocks[name] = shared_memory.SharedMemory(create=True, size=size)
+            arrays[name] = np.ndarray(shape[:-1], dtype=shape[-1], buffer=blocks[name].buf)
+    except Exception:
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+        raise
+    return blocks, arrays
+
+# Name: ExchangeTrails
+# Purpose: Deposit each colony's best solution onto the next colony's
+#   pheremone, as much as the best ant of an iteration leaves
+# Input: tau: shared pheremone (colonies x entries), colonyBest: best gene
+#   array of each colony, depositConstant, candidates: CandidateLists or None,
+#   numEmps: number of employees
+# Output: None
+def ExchangeTrails(tau, colonyBest, depositConstant, candidates, numEmps):
+    numColonies, numTasks = colonyBest.shape
+    if candidates is not None:
+        entries = candidates.Locate(colonyBest)
+    else:
+        entries = np.arange(numTasks) * numEmps + (colonyBest - 1)
+    for colony in range(numColonies):
+        trail = entries[colony]
+        tau[(colony + 1) % numColonies, trail[trail >= 0]] += depositConstant
+
+# Shared arrays and settings used by a worker process
+colonyWorker = {}
+
+# Name: InitColonyWorker
+# Purpose: Attach the shared arrays and build the candidate lists once in
+#   each worker, so they are not sent with every job
+# Input: settings: dict of the shared block names and shapes, instance,
+#   candidate list settings and each task's first pheremone entry, arrays:
+#   the arrays themselves when running in this process
+# Output: None
+def InitColonyWorker(settings, arrays=None):
+    colonyWorker.clear()
+    if arrays is None:
+        arrays = {}
+        colonyWorker["blocks"] = []
+        for name, shape in settings["shapes"].items():
+            block = shared_memory.SharedMemory(name=settings["names"][name])
+            colonyWorker["blocks"].append(block)
+            arrays[name] = np.ndarray(shape[:-1], dtype=shape[-1], buffer=block.buf)
+    colonyWorker.update(arrays)
+    colonyWorker["instance"] = settings["instance"]
+    colonyWorker["rowStart"] = settings["rowStart"]
+    colonyWorker["candidates"] = None
+    if settings["candidateLists"]:
+        colonyWorker["candidates"] = CandidateLists(settings["instance"],
+                                                    settings["maxCandidates"])
+
+# Name: BuildAnts
+# Purpose: Build and score a block of one colony's ants, writing their genes
+#   and pheremone entries into the shared arrays
+# Input: job: seed entropy, iteration, colony, first and last ant
+# Output: colony, first ant, score arrays of the block
+def BuildAnts(job):
+    entropy, iteration, colony, start, stop = job
+    rng = KeyedRng(entropy, iteration, colony, start)
+    instance = colonyWorker["instance"]
+    tau = colonyWorker["tau"][colony]
+    candidates = colonyWorker["candidates"]
+    if candidates is not None:
+        genes, picks = candidates.Construct(tau, stop - start, rng)
+    else:
+        genes = ConstructAnts(tau.reshape(instance.numTasks, instance.numEmps),
+                              stop - start, rng)
+        picks = np.arange(instance.numTasks) * instance.numEmps + (genes - 1)
+    colonyWorker["genes"][colony, start:stop] = genes
+    colonyWorker["picks"][colony, start:stop] = picks
+
+    scores = EvaluateFitnessBatch(genes, instance)
+    return colony, start, {field: scores[field]
+                           for field in ("fitness", "cost", "totalViolations")}
+
+# Name: UpdatePheremone
+# Purpose: Evaporate and deposit the pheremone of a range of one colony's
+#   tasks, as CalcPhereEvap and CalcPhereDeposit do for the whole matrix
+# Input: job: colony, first and end task, fitness of the colony's ants, the
+#   colony's best score, evapRate, depositConstant
+# Output: None
+def UpdatePheremone(job):
+    colony, firstTask, endTask, fitness, bestScore, evapRate, depositConstant = job
+    rowStart = colonyWorker["rowStart"]
+    low, high = rowStart[firstTask].item(), rowStart[endTask].item()
+    tau = colonyWorker["tau"][colony, low:high]
+    tau *= (1.0 - evapRate)
+
+    deposit = depositConstant / (1.0 + (bestScore - fitness))
+    picks = colonyWorker["picks"][colony, :, firstTask:endTask]
+    tau += np.bincount((picks - low).ravel(),
+                       weights=np.repeat(deposit, endTask - firstTask),
+                       minlength=high - low)
+
+# Allows for execution of multi-colony ant colony optimization individually
+if __name__ == "__main__":
+
+    # Run four cooperating colonies
+    bestSolColony, bestCostColony = MultiColonyACO(120, 0.15, 60, 500, numColonies=4)
+    print("Multi-colony ACO Best sol:", bestSolColony)
+    print("Multi-colony ACO Best sol cost:", bestCostColony)
@@ -0,0 +1,430 @@
+# Long running solver process answering JSON lines requests over stdin or a
+# Unix socket, so repeated small solves skip start up and instance building
+# Contributers: Michael Durkan
+
+from classes import Error
+from instance import InstanceFromDicts
+from fitness import FitnessCache
+from portfolio import SOLVER_PARAMS
+from stopping import StoppingCriteria
+from localsearch import LocalSearch
+from bounds import CostLowerBound, OptimalityGap
+from ga import GeneticAlgorithm
+from aco import AntColonyOptimisation
+from pso import pso
+from collections import OrderedDict
+import multiprocessing
+import socketserver
+import threading
+import argparse
+import hashlib
+import json
+import time
+import sys
+import os
+
+# Solver arguments set by the daemon itself, which requests may not override
+RESERVED_PARAMS = ("instance", "cache", "rng", "log", "callback", "profiler", "stopping",
+                   "localSearch", "checkpoint", "resume", "initial", "seed")
+
+# Request fields passed on to a StoppingCriteria
+STOPPING_FIELDS = ("timeBudget", "evalBudget", "targetCost", "stagnationWindow")
+
+# Cancellation slots shared with the workers, more jobs than this must not be
+# in flight at once
+CANCEL_SLOTS = 4096
+
+# Name: SolverDaemon
+# Purpose: Accept solve requests as JSON lines and run them on a worker pool.
+#   Instances are kept by key, so later requests can name one instead of
+#   sending it again, and each worker keeps the built instances, their
+#   fitness caches and lower bounds for reuse. Each request gets an accepted
+#   event, progress events every so many iterations and a result or error
+#   event, written as JSON lines to the connection it came from.
+#
+#   Requests (op defaults to solve):
+#     {"op": "solve", "id": ..., "solver": "ga", "instance": {"tasks": [...],
+#      "employees": [...]} or "instanceKey": ..., "params": {...},
+#      "iterations": 500, "seed": ..., "timeBudget": ..., "evalBudget": ...,
+#      "targetCost": ..., "stagnationWindow": ..., "localSearch": true or
+#      {...}, "initial": [...], "progressEvery": 50}
+#     {"op": "cancel", "id": ...}
+#     {"op": "stats"}
+#     {"op": "shutdown"}
+class SolverDaemon:
+    # Inputs:
+    #   processes: worker processes, defaults to the cpu count
+    #   maxInstances: instances kept by the daemon and by each worker
+    def __init__(self, processes=None, maxInstances=16):
+        if maxInstances < 1:
+            raise Error("maxInstances must be at least 1")
+        self.maxInstances = maxInstances
+        self.instances = OrderedDict()
+        self.jobs = {}
+        self.jobCount = 0
+        self.completed = 0
+        self.lock = threading.Lock()
+
+        # Progress events come back from the workers on a queue, and each job
+        # is cancelled by writing its number into its slot
+        self.events = multiprocessing.Queue()
+        self.cancelFlags = multiprocessing.RawArray("q", CANCEL_SLOTS)
+        self.pool = multiprocessing.Pool(processes, initializer=InitDaemonWorker,
+                                         initargs=(self.events, self.cancelFlags,
+                                                   maxInstances))
+        self.forwarder = threading.Thread(target=self.ForwardEvents, daemon=True)
+        self.forwarder.start()
+
+    # Name: HandleLine
+    # Purpose: Carry out one request line, reporting any problem as an error event
+    # Input: line: JSON text, connection: Connection the request came from
+    # Output: False when the daemon was asked to shut down, otherwise True
+    def HandleLine(self, line, connection):
+        requestId = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise Error("request must be a JSON object")
+            requestId = request.get("id")
+            op = request.get("op", "solve")
+            if op == "solve":
+                self.Submit(request, connection)
+            elif op == "cancel":
+                self.Cancel(requestId)
+            elif op == "stats":
+                connection.Send(dict(self.Stats(), event="stats", id=requestId))
+            elif op == "shutdown":
+                return False
+            else:
+                raise Error("unknown op " + str(op))
+        except (Error, ValueError, TypeError, KeyError) as error:
+            connection.Send({"id": requestId, "event": "error", "message": str(error)})
+        return True
+
+    # Name: Submit
+    # Purpose: Check a solve request and queue it on the worker pool
+    # Input: request: dict, connection: Connection to stream its events to
+    # Output: None
+    def Submit(self, request, connection):
+        requestId = request.get("id")
+        if requestId is None:
+            raise Error("request needs an id")
+        solver = request.get("solver", "ga")
+        if solver not in SOLVER_PARAMS:
+            raise Error("unknown solver " + str(solver))
+        params = request.get("params", {})
+        if not isinstance(params, dict):
+            raise Error("params must be a JSON object")
+        reserved = sorted(set(params) & set(RESERVED_PARAMS))
+        if reserved:
+            raise Error("params may not set " + ", ".join(reserved))
+        localSearch = request.get("localSearch")
+        if localSearch is True:
+            localSearch = {}
+        elif localSearch is False:
+            localSearch = None
+
+        # Keep the instance under its key, new or most recently used last.
+        # Workers key it by its contents, in case a client reuses a key for
+        # changed data. A request that is turned away leaves the instances
+        # as they were.
+        with self.lock:
+            if requestId in self.jobs:
+                raise Error("request id " + str(requestId) + " is already running")
+            if len(self.jobs) >= CANCEL_SLOTS:
+                raise Error("too many requests in flight")
+            if "instance" in request:
+                contentKey = InstanceKey(request["instance"])
+                key = request.get("instanceKey") or contentKey
+                self.instances[key] = (request["instance"], contentKey)
+            else:
+                key = request.get("instanceKey")
+                if key not in self.instances:
+                    raise Error("unknown instanceKey " + str(key))
+            data, contentKey = self.instances[key]
+            self.instances.move_to_end(key)
+            while len(self.instances) > self.maxInstances:
+                self.instances.popitem(last=False)
+
+            self.jobCount += 1
+            number = self.jobCount
+            self.jobs[requestId] = (number, connection)
+
+        job = {"number": number, "id": requestId, "solver": solver, "instanceKey": contentKey,
+               "instanceData": data, "params": params,
+               "iterations": request.get("iterations", 500), "seed": request.get("seed"),
+               "stopping": {field: request[field] for field in STOPPING_FIELDS
+                            if request.get(field) is not None},
+               "localSearch": localSearch, "initial": request.get("initial"),
+               "progressEvery": request.get("progressEvery", 50)}
+        connection.Started()
+        connection.Send({"id": requestId, "event": "accepted", "instanceKey": key})
+        self.pool.apply_async(SolveJob, (job,), callback=self.Finish,
+                              error_callback=lambda error: self.Finish(
+                                  {"id": requestId, "event": "error", "message": str(error)}))
+
+    # Name: Finish
+    # Purpose: Send a job's result or error to its connection, called on the
+    #   pool's result thread
+    # Input: result: result or error event dict
+    # Output: None
+    def Finish(self, result):
+        with self.lock:
+            _, connection = self.jobs.pop(result["id"])
+            self.completed += 1
+        connection.Send(result)
+        connection.Finished()
+
+    # Name: ForwardEvents
+    # Purpose: Pass progress events from the workers to the connections of
+    #   their requests, until a None is queued. Events of finished requests
+    #   are dropped. Sending under the lock keeps an event from following its
+    #   request's result, which Finish sends once the job is removed.
+    # Input: None
+    # Output: None
+    def ForwardEvents(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            with self.lock:
+                job = self.jobs.get(event["id"])
+                if job is not None:
+                    job[1].Send(event)
+
+    # Name: Cancel
+    # Purpose: Ask a queued or running request to stop, it still sends its
+    #   result, with the status cancelled
+    # Input: requestId: id of the request
+    # Output: None
+    def Cancel(self, requestId):
+        with self.lock:
+            job = self.jobs.get(requestId)
+            if job is None:
+                raise Error("no running request with id " + str(requestId))
+            self.cancelFlags[job[0] % CANCEL_SLOTS] = job[0]
+
+    # Name: Stats
+    # Purpose: Summarise the daemon's work
+    # Input: None
+    # Output: dict of the running and completed requests and instances kept
+    def Stats(self):
+        with self.lock:
+            return {"running": len(self.jobs), "completed": self.completed,
+                    "instances": len(self.instances)}
+
+    # Name: ServeStream
+    # Purpose: Read requests from a text stream until it ends or a shutdown
+    #   request, then wait for the requests read to finish
+    # Input: inFile: text stream of requests, write: function writing event text
+    # Output: False when a shutdown was requested, otherwise True
+    def ServeStream(self, inFile, write):
+        connection = Connection(write)
+        running = True
+        for line in inFile:
+            if line.strip() and not self.HandleLine(line, connection):
+                running = False
+                break
+        connection.Wait()
+        return running
+
+    # Name: ServeSocket
+    # Purpose: Accept connections on a Unix socket, each sending requests and
+    #   receiving the events of its own requests, until a shutdown request
+    # Input: path: socket file, replaced if it exists
+    # Output: None
+    def ServeSocket(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socketserver.ThreadingUnixStreamServer(path, DaemonRequestHandler)
+        server.daemon_threads = True
+        server.solverDaemon = self
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(path)
+
+    # Name: Close
+    # Purpose: Finish the queued requests and stop the workers
+    # Input: None
+    # Output: None
+    def Close(self):
+        self.pool.close()
+        self.pool.join()
+        self.events.put(None)
+        self.forwarder.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+# Name: Connection
+# Purpose: Where the events of a client's requests are written, one JSON
+#   line at a time, counting its requests still running
+class Connection:
+    def __init__(self, write):
+        self.write = write
+        self.lock = threading.Lock()
+        self.idle = threading.Condition()
+        self.pending = 0
+
+    # Name: Send
+    # Purpose: Write one event as a JSON line, dropping it if the client is gone
+    # Input: event: dict
+    # Output: None
+    def Send(self, event):
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            try:
+                self.write(line)
+            except (OSError, ValueError):
+                pass
+
+    def Started(self):
+        with self.idle:
+            self.pending += 1
+
+    def Finished(self):
+        with self.idle:
+            self.pending -= 1
+            self.idle.notify_all()
+
+    # Name: Wait
+    # Purpose: Block until every request of the connection has finished
+    # Input: None
+    # Output: None
+    def Wait(self):
+        with self.idle:
+            self.idle.wait_for(lambda: self.pending == 0)
+
+# Name: DaemonRequestHandler
+# Purpose: Serve one Unix socket connection, a shutdown request stopping the
+#   server once the connection's requests have finished
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        def Write(text):
+            self.wfile.write(text.encode())
+            self.wfile.flush()
+
+        lines = (line.decode() for line in self.rfile)
+        if not self.server.solverDaemon.ServeStream(lines, Write):
+            threading.Thread(target=self.server.shutdown).start()
+
+# Name: InstanceKey
+# Purpose: Key an instance by a hash of its data
+# Input: data: dict of "tasks" and "employees" lists
+# Output: hex digest string
+def InstanceKey(data):
+    text = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+# Settings and instances kept by each worker process
+daemonWorker = {}
+
+# Name: InitDaemonWorker
+# Purpose: Store the event queue and cancellation slots once in each worker
+# Input: events: progress event queue, cancelFlags: shared cancellation
+#   slots, maxInstances: built instances to keep
+# Output: None
+def InitDaemonWorker(events, cancelFlags, maxInstances):
+    daemonWorker.update(events=events, cancelFlags=cancelFlags, maxInstances=maxInstances,
+                        instances=OrderedDict())
+
+# Name: WorkerInstance
+# Purpose: Get a built instance and its fitness cache, building it only the
+#   first time the worker sees its key
+# Input: key: instance key, data: dict of "tasks" and "employees" lists
+# Output: ProblemInstance, FitnessCache, whether it was already built
+def WorkerInstance(key, data):
+    instances = daemonWorker["instances"]
+    if key in instances:
+        instances.move_to_end(key)
+        return instances[key] + (True,)
+    instance = InstanceFromDicts(data["tasks"], data["employees"])
+    instances[key] = (instance, FitnessCache())
+    while len(instances) > daemonWorker["maxInstances"]:
+        instances.popitem(last=False)
+    return instances[key] + (False,)
+
+# Name: SolveJob
+# Purpose: Run one solve request in a worker, streaming progress events
+# Input: job: dict of the request's settings
+# Output: result or error event dict
+def SolveJob(job):
+    timeStart = time.perf_counter()
+    number = job["number"]
+    cancelFlags = daemonWorker["cancelFlags"]
+    events = daemonWorker["events"]
+    progress = {"iterations": 0, "status": "finished"}
+    if cancelFlags[number % CANCEL_SLOTS] == number:
+        return {"id": job["id"], "event": "result", "status": "cancelled",
+                "solver": job["solver"], "bestSolution": None, "bestCost": None,
+                "iterations": 0}
+
+    # Called by the solver every iteration, returning True stops it
+    def Callback(iteration, bestCost, bestSolution):
+        progress["iterations"] = iteration
+        if job["progressEvery"] and iteration % job["progressEvery"] == 0:
+            events.put({"id": job["id"], "event": "progress", "iteration": iteration,
+                        "bestCost": bestCost,
+                        "elapsedTime": time.perf_counter() - timeStart})
+        if cancelFlags[number % CANCEL_SLOTS] == number:
+            progress["status"] = "cancelled"
+            return True
+        return False
+
+    try:
+        instance, cache, reused = WorkerInstance(job["instanceKey"], job["instanceData"])
+        stopping = StoppingCriteria(**job["stopping"]) if job["stopping"] else None
+        localSearch = None
+        if job["localSearch"] is not None:
+            localSearch = LocalSearch(instance, **job["localSearch"])
+
+        arguments = dict(SOLVER_PARAMS[job["solver"]])
+        arguments.update(job["params"])
+        arguments.update(instance=instance, cache=cache, seed=job["seed"], log=None,
+                         callback=Callback, stopping=stopping, localSearch=localSearch,
+                         initial=job["initial"])
+        if job["solver"] == "ga":
+            best = GeneticAlgorithm(maxGenerations=job["iterations"], **arguments)
+            bestSolution, bestCost = best.geneList, best.cost
+        elif job["solver"] == "aco":
+            bestSolution, bestCost = AntColonyOptimisation(maxIterations=job["iterations"],
+                                                           **arguments)
+        else:
+            bestSolution, bestCost = pso(maxIter=job["iterations"], **arguments)
+
+        return {"id": job["id"], "event": "result", "status": progress["status"],
+                "solver": job["solver"], "bestSolution": bestSolution, "bestCost": bestCost,
+                "lowerBound": CostLowerBound(instance),
+                "gap": OptimalityGap(bestCost, instance),
+                "iterations": progress["iterations"],
+                "stopReason": stopping.reason if stopping is not None else None,
+                "instanceReused": reused, "elapsedTime": time.perf_counter() - timeStart}
+    except Exception as error:
+        # Keep the worker alive, whatever went wrong with the request
+        return {"id": job["id"], "event": "error", "message": str(error)}
+
+# Allows the daemon to be started from the command line
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Staff-to-Task solver daemon")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="serve a Unix socket instead of stdin and stdout")
+    parser.add_argument("--processes", type=int, help="worker processes")
+    parser.add_argument("--max-instances", type=int, default=16,
+                        help="instances kept for reuse between requests")
+    args = parser.parse_args()
+
+    def WriteStdout(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    with SolverDaemon(args.processes, args.max_instances) as solverDaemon:
+        if args.socket:
+            solverDaemon.ServeSocket(args.socket)
+        else:
+            solverDaemon.ServeStream(sys.stdin, WriteStdout)
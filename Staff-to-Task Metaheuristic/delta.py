@@ -0,0 +1,212 @@
+# Incremental (delta) fitness evaluation for single task moves and swaps
+# Contributers: Michael Durkan
+
+from classes import Error
+from instance import DefaultInstance
+import bisect
+
+class DeltaEvaluator:
+    # Inputs:
+    #   geneList: scored solution, employee number (1 to numEmps) for each task
+    #   instance: ProblemInstance, defaults to the synthetic data
+    def __init__(self, geneList, instance=None):
+        if instance is None:
+            instance = DefaultInstance()
+        if len(geneList) != instance.numTasks:
+            raise Error("gene list length does not match number of tasks")
+        if min(geneList) < 1 or max(geneList) > instance.numEmps:
+            raise Error("delta evaluation needs every task assigned to an employee")
+        self.instance = instance
+        self.geneList = list(geneList)
+
+        # Plain lists are faster than numpy for single element access
+        self.taskTime = instance.taskTime.tolist()
+        self.taskDeadline = instance.taskDeadline.tolist()
+        self.timeOrder = instance.timeOrder.tolist()
+        self.timeRank = instance.timeRank.tolist()
+        self.empHours = instance.empHours.tolist()
+
+        # Per employee time ranks of their tasks, kept in sorted order, along
+        # with their assigned hours and deadline violation
+        self.empRanks = [[] for _ in range(instance.numEmps)]
+        for rank, taskIdx in enumerate(self.timeOrder):
+            self.empRanks[self.geneList[taskIdx] - 1].append(rank)
+        self.empLoad = [sum(self.taskTime[self.timeOrder[r]] for r in ranks)
+                        for ranks in self.empRanks]
+        self.empDeadline = [self.CalcTardiness(ranks) for ranks in self.empRanks]
+        self.overPenalty = sum(max(load - hours, 0)
+                               for load, hours in zip(self.empLoad, self.empHours))
+        self.deadlinePenalty = sum(self.empDeadline)
+
+        self.skillPenalty = 0
+        self.diffPenalty = 0
+        for taskIdx, gene in enumerate(self.geneList):
+            skill, diff = self.TaskTerms(taskIdx, gene - 1)
+            self.skillPenalty += skill
+            self.diffPenalty += diff
+
+    # Name: TaskTerms
+    # Purpose: Skill and difficulty penalty of one task done by one employee
+    # Input: taskIdx: task index, empIdx: employee index
+    # Output: skill penalty, difficulty penalty
+    def TaskTerms(self, taskIdx, empIdx):
+        instance = self.instance
+        return (0 if instance.empHasSkill[instance.taskSkillCode[taskIdx], empIdx] else 1,
+                max((instance.taskDifficulty[taskIdx] - instance.empLevel[empIdx]).item(), 0))
+
+    # Name: CalcTardiness
+    # Purpose: Deadline violation of an employee doing tasks in time order
+    # Input: ranks: sorted time ranks of the employee's tasks
+    # Output: total violation
+    def CalcTardiness(self, ranks):
+        finish = 0
+        violation = 0
+        for rank in ranks:
+            taskIdx = self.timeOrder[rank]
+            finish += self.taskTime[taskIdx]
+            if finish > self.taskDeadline[taskIdx]:
+                violation += finish - self.taskDeadline[taskIdx]
+        return violation
+
+    # Name: Penalties
+    # Purpose: Penalty breakdown of the current solution
+    # Input: None
+    # Output: dictionary keyed by the Chromosome field names
+    def Penalties(self):
+        return MakeBreakdown(self.overPenalty, self.skillPenalty, self.diffPenalty,
+                             self.deadlinePenalty)
+
+    # Name: EvaluateReassign
+    # Purpose: Penalty breakdown if task i were given to employee e
+    # Input: taskIdx: task index, emp: employee number (1 to numEmps)
+    # Output: dictionary keyed by the Chromosome field names
+    def EvaluateReassign(self, taskIdx, emp):
+        return self.EvaluateMoves([(taskIdx, emp)])
+
+    # Name: EvaluateSwap
+    # Purpose: Penalty breakdown if tasks i and j swapped employees
+    # Input: taskIdx1, taskIdx2: task indexes
+    # Output: dictionary keyed by the Chromosome field names
+    def EvaluateSwap(self, taskIdx1, taskIdx2):
+        return self.EvaluateMoves(self.SwapMoves(taskIdx1, taskIdx2))
+
+    # Name: ApplyReassign
+    # Purpose: Give task i to employee e, updating the stored terms
+    # Input: taskIdx: task index, emp: employee number (1 to numEmps)
+    # Output: dictionary keyed by the Chromosome field names
+    def ApplyReassign(self, taskIdx, emp):
+        return self.ApplyMoves([(taskIdx, emp)])
+
+    # Name: ApplySwap
+    # Purpose: Swap the employees of tasks i and j, updating the stored terms
+    # Input: taskIdx1, taskIdx2: task indexes
+    # Output: dictionary keyed by the Chromosome field names
+    def ApplySwap(self, taskIdx1, taskIdx2):
+        return self.ApplyMoves(self.SwapMoves(taskIdx1, taskIdx2))
+
+    # Name: SwapMoves
+    # Purpose: Express a swap as two reassignments
+    # Input: taskIdx1, taskIdx2: task indexes
+    # Output: list of (taskIdx, emp) moves
+    def SwapMoves(self, taskIdx1, taskIdx2):
+        return [(taskIdx1, self.geneList[taskIdx2]), (taskIdx2, self.geneList[taskIdx1])]
+
+    # Name: EvaluateMoves
+    # Purpose: Penalty breakdown after a set of reassignments, without applying them
+    # Input: moves: list of (taskIdx, emp) reassignments
+    # Output: dictionary keyed by the Chromosome field names
+    def EvaluateMoves(self, moves):
+        newRanks, newLoad, newDeadline, skillPenalty, diffPenalty = self.MoveTerms(moves)
+
+        # Only the affected employees' load and deadline terms change
+        overPenalty = self.overPenalty
+        deadlinePenalty = self.deadlinePenalty
+        for empIdx in newRanks:
+            hours = self.empHours[empIdx]
+            overPenalty += max(newLoad[empIdx] - hours, 0) - max(self.empLoad[empIdx] - hours, 0)
+            deadlinePenalty += newDeadline[empIdx] - self.empDeadline[empIdx]
+
+        return MakeBreakdown(overPenalty, skillPenalty, diffPenalty, deadlinePenalty)
+
+    # Name: ApplyMoves
+    # Purpose: Apply a set of reassignments to the stored solution and terms
+    # Input: moves: list of (taskIdx, emp) reassignments
+    # Output: dictionary keyed by the Chromosome field names
+    def ApplyMoves(self, moves):
+        newRanks, newLoad, newDeadline, self.skillPenalty, self.diffPenalty = \
+            self.MoveTerms(moves)
+        for empIdx, ranks in newRanks.items():
+            hours = self.empHours[empIdx]
+            self.overPenalty += max(newLoad[empIdx] - hours, 0) - max(self.empLoad[empIdx] - hours, 0)
+            self.deadlinePenalty += newDeadline[empIdx] - self.empDeadline[empIdx]
+            self.empRanks[empIdx] = ranks
+            self.empLoad[empIdx] = newLoad[empIdx]
+            self.empDeadline[empIdx] = newDeadline[empIdx]
+        for taskIdx, emp in moves:
+            self.geneList[taskIdx] = emp
+
+        return self.Penalties()
+
+    # Name: MoveTerms
+    # Purpose: Work out the sorted task lists and loads of the employees touched
+    #   by a set of moves, and the new skill and difficulty totals
+    # Input: moves: list of (taskIdx, emp) reassignments
+    # Output: new rank lists, loads and deadline violations keyed by employee
+    #   index, skill penalty, difficulty penalty
+    def MoveTerms(self, moves):
+        newRanks = {}
+        newLoad = {}
+        skillPenalty = self.skillPenalty
+        diffPenalty = self.diffPenalty
+        for taskIdx, emp in moves:
+            if emp < 1 or emp > self.instance.numEmps:
+                raise Error("employee number out of range")
+
+        # Remove every moved task before inserting, so swaps stay consistent
+        genes = {taskIdx: self.geneList[taskIdx] for taskIdx, _ in moves}
+        for taskIdx, oldEmp in genes.items():
+            oldIdx = oldEmp - 1
+            if oldIdx not in newRanks:
+                newRanks[oldIdx] = self.empRanks[oldIdx][:]
+                newLoad[oldIdx] = self.empLoad[oldIdx]
+            ranks = newRanks[oldIdx]
+            del ranks[bisect.bisect_left(ranks, self.timeRank[taskIdx])]
+            newLoad[oldIdx] -= self.taskTime[taskIdx]
+            skill, diff = self.TaskTerms(taskIdx, oldIdx)
+            skillPenalty -= skill
+            diffPenalty -= diff
+
+        for taskIdx, emp in moves:
+            genes[taskIdx] = emp
+        for taskIdx, newEmp in genes.items():
+            newIdx = newEmp - 1
+            if newIdx not in newRanks:
+                newRanks[newIdx] = self.empRanks[newIdx][:]
+                newLoad[newIdx] = self.empLoad[newIdx]
+            bisect.insort(newRanks[newIdx], self.timeRank[taskIdx])
+            newLoad[newIdx] += self.taskTime[taskIdx]
+            skill, diff = self.TaskTerms(taskIdx, newIdx)
+            skillPenalty += skill
+            diffPenalty += diff
+
+        newDeadline = {empIdx: self.CalcTardiness(ranks) for empIdx, ranks in newRanks.items()}
+        return newRanks, newLoad, newDeadline, skillPenalty, diffPenalty
+
+# Name: MakeBreakdown
+# Purpose: Build a penalty breakdown with total and cost as in CalcCost, every
+#   task is assigned so the assignment penalty is zero
+# Input: penalty terms
+# Output: dictionary keyed by the Chromosome field names
+def MakeBreakdown(overPenalty, skillPenalty, diffPenalty, deadlinePenalty):
+    totalViolations = overPenalty + skillPenalty + diffPenalty + deadlinePenalty
+    cost = 0.2 * totalViolations
+    return {
+        "overPenalty": overPenalty,
+        "skillPenalty": skillPenalty,
+        "diffPenalty": diffPenalty,
+        "deadlinePenalty": deadlinePenalty,
+        "assignPenalty": 0,
+        "totalViolations": totalViolations,
+        "cost": cost,
+        "fitness": 1.0 / (cost + 1e-8),
+    }
@@ -0,0 +1,93 @@
+# Duplicate free populations and diversity measures for the solvers
+# Contributers: Michael Durkan
+
+from classes import Error
+from rng import RandomBlock
+import numpy as np
+
+# Name: GenotypeIndex
+# Purpose: Hash set of the gene lists in a population, used to re-mutate
+#   offspring or ants that copy one already in it before they are evaluated
+class GenotypeIndex:
+    # Inputs:
+    #   numEmps: number of employees genes are drawn from
+    #   maxTries: random gene changes tried on each duplicate, one still
+    #       duplicated after these is kept as it is
+    def __init__(self, numEmps, maxTries=3):
+        if maxTries < 1:
+            raise Error("maxTries must be at least 1")
+        self.numEmps = numEmps
+        self.maxTries = maxTries
+        self.keys = set()
+        self.duplicates = 0
+
+    # Name: Deduplicate
+    # Purpose: Index a population, changing one random gene of each row that
+    #   repeats an earlier row to a different employee until it is new
+    # Input: genes: 2-D gene array (individuals x tasks), changed in place,
+    #   rng: numpy random Generator, start: leading rows (such as elites)
+    #   indexed but never changed
+    # Output: row indexes of the gene lists that were changed
+    def Deduplicate(self, genes, rng, start=0):
+        self.keys = {row.tobytes() for row in genes[:start]}
+        block = RandomBlock(rng, 4 * self.maxTries)
+        changed = []
+        for i in range(start, len(genes)):
+            row = genes[i]
+            key = row.tobytes()
+            if key in self.keys:
+                self.duplicates += 1
+                if self.numEmps > 1:
+                    changed.append(i)
+                    for _ in range(self.maxTries):
+                        task = block.Integer(0, len(row))
+                        row[task] = (row[task] - 1 + block.Integer(1, self.numEmps)) % \
+                            self.numEmps + 1
+                        key = row.tobytes()
+                        if key not in self.keys:
+                            break
+            self.keys.add(key)
+        return np.array(changed, dtype=np.int64)
+
+    # Name: Unique
+    # Purpose: Number of distinct gene lists in the last population indexed
+    # Input: None
+    # Output: count
+    def Unique(self):
+        return len(self.keys)
+
+# Name: GeneEntropy
+# Purpose: Mean Shannon entropy of the employee given each task across a
+#   population, scaled by its most (every employee equally often) so it runs
+#   from 0 (every individual agrees) to 1
+# Input: genes: 2-D gene array (individuals x tasks), numEmps: number of employees
+# Output: entropy
+def GeneEntropy(genes, numEmps):
+    numVectors, numTasks = genes.shape
+    if numEmps < 2 or numVectors < 2:
+        return 0.0
+    # Count of each employee at each task in one bincount
+    keys = (genes - 1) + (np.arange(numTasks) * numEmps)
+    counts = np.bincount(keys.ravel(), minlength=numTasks * numEmps)
+    counts = counts[counts > 0]
+    entropy = (counts * np.log(numVectors / counts)).sum() / (numVectors * numTasks)
+    return (entropy / np.log(min(numEmps, numVectors))).item()
+
+# Name: UniqueCount
+# Purpose: Number of distinct gene lists in a population
+# Input: genes: 2-D gene array (individuals x tasks)
+# Output: count
+def UniqueCount(genes):
+    rows = np.ascontiguousarray(genes)
+    return len(np.unique(rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1])))))
+
+# Name: DiversityRecord
+# Purpose: Add the gene entropy and unique count columns to a log record,
+#   when the sink has columns for them
+# Input: sink: log Sink, record: list of the standard column values, genes:
+#   population or colony gene array, numEmps: number of employees
+# Output: record to write
+def DiversityRecord(sink, record, genes, numEmps):
+    if len(sink.columns) > len(record):
+        return list(record) + [GeneEntropy(genes, numEmps), UniqueCount(genes)]
+    return record
@@ -1,11 +1,18 @@
 # Functions for performing fitness evaluations
 # Contributers: Michael Durkan
 
-from data import tasks, employees
-from classes import Task, Employee, Chromosome
+from classes import Task, Employee, Chromosome, Error
+from instance import DefaultInstance
+from collections import OrderedDict
+import numpy as np
+import hashlib
 import random
 import copy
 
+# Names of the five penalty terms, in the order they are summed
+PENALTY_FIELDS = ("overPenalty", "skillPenalty", "diffPenalty",
+                  "deadlinePenalty", "assignPenalty")
+
 # Name: CalcOverloadPenalty 
 # Purpose: Calculate the penalty for employees being given to many hours
 # Input: vector: solution list, taskList: list of tasks, empList: list of employees
@@ -50,7 +57,7 @@ def CalcDiffPenalty(vector, taskList, empList):
 # Input: vector: solution list, taskList: list of tasks, empList: list of employees
 # Output: None
 def CalcDeadlinePenalty(vector, taskList, empList):
-    empTaskList = [[],[],[],[],[]]
+    empTaskList = [[] for _ in empList]
     # Create list for each employee containing there tasks
     for i, entry in enumerate(vector.geneList):
         empTaskList[entry - 1].append(taskList[i])
@@ -123,27 +130,172 @@ def totalViolations(self):
 
 
 
+# Name: FitnessCache
+# Purpose: Size bounded least recently used cache of penalty breakdowns, keyed
+#   by a hash of the gene list. A cache belongs to the first instance it is
+#   used with.
+class FitnessCache:
+    def __init__(self, maxSize=100000):
+        if maxSize < 1:
+            raise Error("cache size must be at least 1")
+        self.maxSize = maxSize
+        self.instance = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Name: Key
+    # Purpose: Compact 16 byte hash of a gene list
+    # Input: genes: 1-D integer array
+    # Output: bytes key
+    def Key(self, genes):
+        return hashlib.blake2b(genes.tobytes(), digest_size=16).digest()
+
+    # Name: Lookup
+    # Purpose: Get the penalty breakdown of each individual, scoring only those
+    #   not already cached (and each distinct gene list once)
+    # Input: genes: 2-D integer array (individuals x tasks), instance: ProblemInstance
+    # Output: penalties array (individuals x penalty terms)
+    def Lookup(self, genes, instance):
+        if self.instance is None:
+            self.instance = instance
+        elif self.instance is not instance:
+            raise Error("fitness cache used with a different instance")
+
+        penalties = [None] * len(genes)
+        missing = {}
+        for i, row in enumerate(genes):
+            key = self.Key(row)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                penalties[i] = entry
+            elif key in missing:
+                self.hits += 1
+                missing[key].append(i)
+            else:
+                self.misses += 1
+                missing[key] = [i]
+
+        if missing:
+            scored = CalcPenaltiesBatch(genes[[rows[0] for rows in missing.values()]],
+                                        instance)
+            for entry, (key, rows) in zip(scored, missing.items()):
+                self.entries[key] = entry
+                for i in rows:
+                    penalties[i] = entry
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        return np.array(penalties)
+
+    # Name: Stats
+    # Purpose: Report the hit, miss and eviction counters
+    # Input: None
+    # Output: dictionary of counters and hit rate
+    def Stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits / lookups if lookups else 0.0}
+
+# Name: CalcPenaltiesBatch
+# Purpose: Calculate the five penalty terms of a whole population at once with
+#   array operations. Gives the same values as the per-vector penalty
+#   functions above.
+# Input: genes: 2-D integer array (individuals x tasks) of employee numbers,
+#   instance: ProblemInstance
+# Output: penalties array (individuals x penalty terms), columns ordered as
+#   PENALTY_FIELDS
+def CalcPenaltiesBatch(genes, instance):
+    numVectors, numTasks = genes.shape
+    numEmps = instance.numEmps
+    if numTasks != instance.numTasks:
+        raise IndexError("gene list length does not match number of tasks")
+    if genes.size and (genes.max() > numEmps or genes.min() < 1 - numEmps):
+        raise IndexError("gene outside of employee range")
+
+    # Employee index of every gene, genes below 1 wrap like list indexing
+    empIdx = genes - 1
+    empIdx[empIdx < 0] += numEmps
+    taskIdx = np.broadcast_to(np.arange(numTasks), genes.shape)
+    taskTime = instance.taskTime
+
+    # Overload: hours assigned to each employee of each vector by bincount
+    binIdx = empIdx + (np.arange(numVectors) * numEmps)[:, np.newaxis]
+    assignedHrs = np.bincount(binIdx.ravel(), weights=np.tile(taskTime, numVectors),
+                              minlength=numVectors * numEmps)
+    assignedHrs = assignedHrs.reshape(numVectors, numEmps).astype(taskTime.dtype)
+    overPenalty = np.maximum(assignedHrs - instance.empHours, 0).sum(axis=1)
+
+    # Skill and difficulty: gather from the skill x employee table and the
+    # employee levels
+    skillMatch = instance.empHasSkill[instance.taskSkillCode, empIdx]
+    skillPenalty = ((~skillMatch) & (genes > 0)).sum(axis=1)
+    diffPenalty = np.maximum(instance.taskDifficulty - instance.empLevel[empIdx], 0).sum(axis=1)
+    assignPenalty = (genes < 1).sum(axis=1)
+
+    # Deadline: order each vector by employee then processing time, and take
+    # a cumulative sum of time that restarts at the start of each employee
+    order = np.argsort(empIdx * numTasks + instance.timeRank, axis=1)
+    sortedEmp = np.take_along_axis(empIdx, order, axis=1)
+    sortedTime = taskTime[order]
+    runningTime = np.cumsum(sortedTime, axis=1)
+    isStart = np.ones(genes.shape, dtype=bool)
+    isStart[:, 1:] = sortedEmp[:, 1:] != sortedEmp[:, :-1]
+    startPos = np.maximum.accumulate(np.where(isStart, taskIdx, 0), axis=1)
+    finish = runningTime - np.take_along_axis(runningTime - sortedTime, startPos, axis=1)
+    deadlinePenalty = np.maximum(finish - instance.taskDeadline[order], 0).sum(axis=1)
+
+    return np.stack([overPenalty, skillPenalty, diffPenalty, deadlinePenalty,
+                     assignPenalty], axis=1)
+
+# Name: EvaluateFitnessBatch
+# Purpose: Evaluate a whole population at once with array operations. Gives the
+#   same penalties, cost, fitness, fitnessRatio and cumulativeProb as the
+#   per-vector penalty functions above.
+# Input: genes: 2-D integer array (individuals x tasks) of employee numbers,
+#   instance: ProblemInstance, defaults to the synthetic data, cache: optional
+#   FitnessCache
+# Output: dictionary of arrays, one entry per individual, keyed by the
+#   Chromosome field names
+def EvaluateFitnessBatch(genes, instance=None, cache=None):
+    if instance is None:
+        instance = DefaultInstance()
+    genes = np.atleast_2d(np.asarray(genes, dtype=np.int64))
+
+    if cache is None:
+        penalties = CalcPenaltiesBatch(genes, instance)
+    else:
+        penalties = cache.Lookup(genes, instance)
+    scores = dict(zip(PENALTY_FIELDS, penalties.T))
+    scores["totalViolations"] = (scores["overPenalty"] + scores["skillPenalty"] +
+                                 scores["diffPenalty"] + scores["deadlinePenalty"] +
+                                 scores["assignPenalty"])
+
+    # Cost, fitness and roulette probabilities, as in CalcCost and CalcCumulative
+    scores["cost"] = 0.2 * scores["totalViolations"]
+    scores["fitness"] = 1.0 / (scores["cost"] + 1e-8)
+    scores["fitnessRatio"] = scores["fitness"] / np.cumsum(scores["fitness"])[-1]
+    scores["cumulativeProb"] = np.cumsum(scores["fitnessRatio"])
+
+    return scores
+
 # Name: EvaluateFitness 
 # Purpose: Evalute the Fitness of each vecotr in a population, updating there
 #   object fields.
-# Input: population: list of solution vectors
+# Input: population: list of solution vectors, instance: ProblemInstance,
+#   defaults to the synthetic data, cache: optional FitnessCache
 # Output: None
-def EvaluateFitness(population):
-    
-    # Create Employee and Task Lists with Synthetic data
-    empList = [Employee(**empData) for empData in employees]
-    taskList = [Task(**taskData) for taskData in tasks]
-    
-    for vector in population:
+def EvaluateFitness(population, instance=None, cache=None):
+    scores = EvaluateFitnessBatch([vector.geneList for vector in population],
+                                  instance, cache)
+
+    for i, vector in enumerate(population):
         vector.resetValues()
-        CalcOverloadPenalty(vector, taskList, empList) 
-        CalcSkillPenalty(vector, taskList, empList)
-        CalcAssignmentPenalty(vector, taskList, empList)
-        CalcDiffPenalty(vector, taskList, empList)
-        CalcDeadlinePenalty(vector, taskList, empList)
-    
-        vector.totalViolations = (vector.overPenalty + vector.skillPenalty + 
-                                  vector.diffPenalty + vector.deadlinePenalty + 
-                                  vector.assignPenalty)
-    CalcCost(population)
-    CalcCumulative(population)
+        for field, values in scores.items():
+            setattr(vector, field, values[i].item())
+        vector.violation = vector.deadlinePenalty
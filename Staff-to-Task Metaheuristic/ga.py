@@ -2,170 +2,326 @@
 # Contributers: Michael Durkan
 
 import time
-from data import tasks, employees
 from classes import Task, Employee, Chromosome
-import fitness as f
-import random
-import copy
-import csv
+from instance import DefaultInstance
+from population import Population, WarmGenes
+from selection import SelectParents
+from telemetry import OpenLog, DIVERSITY_LOG_COLUMNS
+from profiler import NULL_PROFILER
+from bounds import ReachedBound
+from checkpoint import ResumeState, RestoreRng, RestoreStopping
+from diversity import GenotypeIndex, DiversityRecord
+from rng import MakeRng
+import numpy as np
 
-# Inputs: 
+# Inputs:
 #   PoulationSize: size of population
 #   maxGenerations: maximum number of generations
 #   crossoverRate: rate of genetic crossover
 #   mutationRate: rate of genetic mutation
 #   elitism: Number of best chromosomes kept each generation
+#   instance: ProblemInstance to solve, defaults to the synthetic data
+#   cache: optional FitnessCache to reuse scores of repeated gene lists
+#   rng: optional numpy random Generator
+#   selection: parent selection method, roulette, alias, tournament or rank
+#   tournamentSize: individuals in each tournament for tournament selection
+#   log: csv file or telemetry Sink streamed the generation, cost, time,
+#       feasability, gene entropy and unique count as they are produced (a
+#       Sink with only the first four columns gets those), None to skip
+#   callback: optional function called each generation with the generation,
+#       best cost and best gene list, returning True stops the run
+#   profiler: optional Profiler timing the phases of every generation
+#   stopping: optional StoppingCriteria ending the run early and holding the
+#       best solution so far
+#   localSearch: optional LocalSearch improving some offspring each generation
+#   checkpoint: optional Checkpointer saving the run's state every so often
+#   resume: optional checkpoint file or loaded checkpoint to carry on from,
+#       giving the same results as a run that was never stopped
+#   initial: optional gene list of a previous solution to start from, seeding
+#       the population with it and perturbed copies of it
+#   perturbation: fraction of genes changed in each copy of initial
+#   dedupe: re-mutate offspring that copy another member of the new
+#       population before they are evaluated
+#   seed: seed for the random stream when no rng is given, random when None
 # Outputs:
-#   best: best chromosome in population after algorithm finishes 
-def GeneticAlgorithm(populationSize, maxGenerations, crossoverRate, mutationRate, elitism):
+#   best: best chromosome in population after algorithm finishes
+def GeneticAlgorithm(populationSize, maxGenerations, crossoverRate, mutationRate,
+                     elitism, instance=None, cache=None, rng=None,
+                     selection="roulette", tournamentSize=2,
+                     log='gaCostResults.csv', callback=None, profiler=None,
+                     stopping=None, localSearch=None, checkpoint=None, resume=None,
+                     initial=None, perturbation=0.1, dedupe=False, seed=None):
     # Start the timer for iteration/generation time graph
     timeStart = time.perf_counter()
-    
-    # Create list for graphing results
-    results = []
 
-    # Generate the inital population
-    population = GenInitPop(populationSize)
-    bestInIteration = GetBestIndividual(population)
+    if instance is None:
+        instance = DefaultInstance()
+    resume = ResumeState(resume, "ga", instance)
+
+    # Open the log sink for graphing results, cut back to the checkpoint
+    # when resuming
+    sink = OpenLog(log, resume["log"] if resume is not None else None,
+                   DIVERSITY_LOG_COLUMNS)
+
+    # Settings saved with checkpoints, so the run can be resumed
+    params = {"populationSize": populationSize, "maxGenerations": maxGenerations,
+              "crossoverRate": crossoverRate, "mutationRate": mutationRate,
+              "elitism": elitism, "selection": selection,
+              "tournamentSize": tournamentSize, "dedupe": dedupe,
+              "log": log if isinstance(log, str) else None}
+
+    if rng is None:
+        rng = MakeRng(seed)
+    if profiler is None:
+        profiler = NULL_PROFILER
+    profiler.Begin(GA_PHASES, cache)
+    if stopping is not None:
+        stopping.Begin()
+
+    # Generations alternate between two gene buffers instead of copying
+    # chromosome objects
+    buffers = MakeGeneBuffers(populationSize, elitism, instance.numTasks)
+
+    # Index of the population's gene lists, to keep clones out of it
+    index = GenotypeIndex(instance.numEmps) if dedupe else None
+
+    if resume is None:
+        # Generate the inital population, or copies of a previous solution
+        with profiler.Phase("init"):
+            if initial is None:
+                population = GenInitPop(populationSize, instance, rng, buffers[0])
+            else:
+                population = Population(WarmGenes(initial, populationSize, perturbation,
+                                                  instance, rng,
+                                                  buffers[0][:populationSize]))
+            if index is not None:
+                index.Deduplicate(population.genes, rng)
+        generation = 0
+    else:
+        # Carry on from the checkpointed population and random stream
+        generation = resume["iteration"]
+        rng = RestoreRng(resume["rng"])
+        timeStart -= resume["elapsedTime"]
+        genes = buffers[generation % 2][:populationSize]
+        genes[:] = resume["arrays"]["genes"]
+        population = Population(genes)
+        RestoreStopping(stopping, resume)
 
     # Evaluate the fitness of the population
-    f.EvaluateFitness(population)
-    
-    generation = 0
-  
+    with profiler.Phase("evaluate"):
+        population.Evaluate(instance, cache)
+    profiler.Count("evaluations", population.size)
+    profiler.EndIteration(generation)
+    bestInIteration = population.BestIndex()
+
     # Sum the total Violations of all vectors in population
-    feasability = sum(chromo.totalViolations for chromo in population)
-    
-    # Update csv for intial generation
-    results.append((generation, bestInIteration.cost, 0, feasability))
-
-    # Iterate through generations of populations
-    while generation < maxGenerations:
-        #and bestInIteration.cost != 0.0: (Can close early this way)
-        
-        # Sort the population by fitness for elitism selection
-        population.sort(key=lambda c: c.fitness, reverse=True)
-        
-        # Create new population with slice of len elitism values at start of list
-        newPopulation = [copy.deepcopy(chromo) for chromo in population[:elitism]]
-        
-        # Generate the new population
-        while len(newPopulation) < populationSize:
-            # Choose parents based on fitness, roulette wheel
-            parent1 = SelectIndividual(population)
-            parent2 = SelectIndividual(population)
-
-            # Combine parents by crossover to create offspring
-            if (random.random() < crossoverRate):
-                offspring1, offspring2 = Crossover(parent1, parent2)
-            else:
-                offspring1 = copy.deepcopy(parent1)
-                offspring2 = copy.deepcopy(parent2)
-
-            # Mutate the offspring to introduce variation
-            offspring1 = Mutate(offspring1, mutationRate)
-            offspring2 = Mutate(offspring2, mutationRate)
-
-            # Reset the fitness values and variables of offspring objects
-            offspring1.resetValues()
-            offspring2.resetValues()
-            
-            # Add new offspring to new population
-            newPopulation.append(offspring1)
-            newPopulation.append(offspring2)
-
-        # Replace old population with new one, ensuring size stays the same
-        # with odd populations
-        population = newPopulation[:populationSize]
-
-        # Evaluate fitness of population and increase generation
-        f.EvaluateFitness(population)
+    feasability = population.totalViolations.sum().item()
+
+    # Update csv for intial generation, which a resumed run already has
+    stopped = False
+    if resume is None:
+        if sink is not None:
+            sink.Write(DiversityRecord(sink, (generation, population.cost[bestInIteration].item(),
+                                              0, feasability),
+                                       population.genes, instance.numEmps))
+        stopped = stopping is not None and stopping.Update(
+            generation, population.cost[bestInIteration].item(),
+            population.genes[bestInIteration], population.size, population.genes)
+    stopped = stopped or ReachedBound(population.cost[bestInIteration].item(), instance)
+
+    # Iterate through generations of populations, until a stopping criterion is
+    # met or the best cost matches the lower bound and cannot improve
+    while generation < maxGenerations and not stopped:
+
+        # Breed the next population into the other buffer, evaluate its
+        # fitness and increase generation
+        population = NextGeneration(population, buffers[(generation + 1) % 2],
+                                    crossoverRate, mutationRate, elitism, instance,
+                                    cache, rng, selection, tournamentSize, profiler,
+                                    localSearch, index)
         generation += 1
 
         # Save cost/feasability of best individual and time elapsed for graphing
-        bestInIteration = GetBestIndividual(population)
-        elapsedTime = time.perf_counter() - timeStart
-        feasability = sum(chromo.totalViolations for chromo in population)
-        results.append((generation, bestInIteration.cost, elapsedTime,feasability))
+        with profiler.Phase("log"):
+            bestInIteration = population.BestIndex()
+            elapsedTime = time.perf_counter() - timeStart
+            feasability = population.totalViolations.sum().item()
+            if sink is not None:
+                sink.Write(DiversityRecord(sink, (generation,
+                                                  population.cost[bestInIteration].item(),
+                                                  elapsedTime, feasability),
+                                           population.genes, instance.numEmps))
+        profiler.Count("iterations")
+        profiler.EndIteration(generation)
 
-    # Output the generation, cost, time and feasability to csv
-    with open('gaCostResults.csv', 'w', newline='') as csvFile:
-        wr = csv.writer(csvFile)
-        wr.writerow(['generation', 'bestCost', 'elapsedTime', 'feasability'])
-        wr.writerows(results)
+        # Let the caller see progress and stop the run early
+        if callback is not None and callback(generation,
+                                             population.cost[bestInIteration].item(),
+                                             population.genes[bestInIteration].tolist()):
+            break
+        if stopping is not None and stopping.Update(generation,
+                                                    population.cost[bestInIteration].item(),
+                                                    population.genes[bestInIteration],
+                                                    population.size, population.genes):
+            break
+        if ReachedBound(population.cost[bestInIteration].item(), instance):
+            break
+
+        # Save the run's state so it can be resumed from this generation
+        if checkpoint is not None and checkpoint.Due(generation):
+            with profiler.Phase("checkpoint"):
+                checkpoint.Save("ga", generation, params, {"genes": population.genes}, {},
+                                rng, instance, time.perf_counter() - timeStart, sink,
+                                stopping)
+
+    # Flush the rest of the generation, cost, time and feasability log
+    if sink is not None:
+        sink.Close()
+    profiler.End()
 
     # Get the best solution from population
-    best = GetBestIndividual(population)
+    best = population.ToChromosome(population.BestIndex())
 
     return best
 
+# Phases of a generation timed by a Profiler
+GA_PHASES = ("init", "select", "crossover", "mutate", "localsearch", "dedupe", "evaluate",
+             "log", "checkpoint")
+
+# Name: MakeGeneBuffers
+# Purpose: Allocate the two gene buffers generations alternate between.
+#   Offspring are made in pairs, so there is room for a spare row when the
+#   number of offspring is odd.
+# Input: Size of Population, number of elites, number of tasks
+# Output: list of two gene arrays
+def MakeGeneBuffers(populationSize, elitism, numTasks):
+    capacity = elitism + 2 * ((populationSize - elitism + 1) // 2)
+    return [np.empty((capacity, numTasks), dtype=np.int64) for _ in range(2)]
+
+# Name: NextGeneration
+# Purpose: Breed and evaluate the next population. Elites are copied over,
+#   parents are selected and copied into the offspring rows in pairs, then
+#   crossed over and mutated in place.
+# Input: population: current scored Population, newGenes: gene buffer to fill
+#   (not holding the current population), crossoverRate, mutationRate,
+#   elitism, instance: ProblemInstance, cache: optional FitnessCache, rng: numpy
+#   random Generator, selection: parent selection method, tournamentSize:
+#   individuals in each tournament, profiler: Profiler timing each phase,
+#   localSearch: optional LocalSearch improving some of the offspring, index:
+#   optional GenotypeIndex re-mutating offspring that copy another member
+# Output: new scored Population, a view of the first rows of newGenes
+def NextGeneration(population, newGenes, crossoverRate, mutationRate, elitism,
+                   instance, cache, rng, selection="roulette", tournamentSize=2,
+                   profiler=NULL_PROFILER, localSearch=None, index=None):
+    numPairs = (len(newGenes) - elitism) // 2
+
+    with profiler.Phase("select"):
+        # Copy the elitism best rows to the start of the new population
+        elites = np.argsort(-population.fitness, kind="stable")[:elitism]
+        newGenes[:elitism] = population.genes[elites]
+
+        # Choose every parent for the generation based on fitness, and copy
+        # them into the offspring rows in pairs
+        parents = SelectParents(population, 2 * numPairs, selection, rng,
+                                tournamentSize).reshape(numPairs, 2)
+        offspring = newGenes[elitism:].reshape(numPairs, 2, newGenes.shape[1])
+        np.take(population.genes, parents, axis=0, out=offspring)
+
+    # Combine parents by crossover to create offspring
+    with profiler.Phase("crossover"):
+        Crossover(offspring, crossoverRate, rng)
+
+    # Mutate the offspring to introduce variation
+    with profiler.Phase("mutate"):
+        Mutate(newGenes[elitism:], mutationRate, rng)
+
+    # Improve some of the offspring directly
+    if localSearch is not None:
+        with profiler.Phase("localsearch"):
+            localSearch.Improve(newGenes[elitism:population.size], rng)
+
+    # Change offspring that copy the elites or earlier offspring, so no
+    # evaluations are spent on clones
+    if index is not None:
+        with profiler.Phase("dedupe"):
+            changed = index.Deduplicate(newGenes[:population.size], rng, elitism)
+        profiler.Count("duplicates", len(changed))
+
+    # Replace old population with new one, ensuring size stays the same
+    # with odd populations
+    newPopulation = Population(newGenes[:population.size])
+    with profiler.Phase("evaluate"):
+        newPopulation.Evaluate(instance, cache)
+    profiler.Count("evaluations", newPopulation.size)
+
+    return newPopulation
+
 # Name: GenInitPop
-# Purpose: Generate initial population of chromosomes, with random genes 
-#          representing each employee do a task per the idx of the gene in the list.
-# Input: Size of Population
-# Output: List of Chromosome objects with randomized genes
-def GenInitPop(populationSize):
-    initPop = [ Chromosome([random.randint(1,5) for _ in range(10)])
-        for _ in range(populationSize) ]
-
-    return initPop
-
-# Name: SelectIndividual
-# Purpose: Select individuals for crossover by roulette wheel selection,
-#   generating random number and selecting chromosome with value the first value
-#   that has cumulative prob greater than random number
-# Input: Population (list) of chromosome objects
-# Output: Chromosome object selected
-def SelectIndividual(population):     
-    roulette = random.random()
-    for chromo in population:
-        if roulette <= chromo.cumulativeProb:
-            return chromo
-    return population[-1]
+# Purpose: Generate initial population, with random genes representing each
+#          employee do a task per the idx of the gene in the list.
+# Input: Size of Population, ProblemInstance giving the number of tasks and
+#   employees, numpy random Generator, optional gene buffer to fill
+# Output: Population with randomized genes
+def GenInitPop(populationSize, instance, rng, buffer=None):
+    if buffer is None:
+        buffer = np.empty((populationSize, instance.numTasks), dtype=np.int64)
+    genes = buffer[:populationSize]
+    genes[:] = rng.integers(1, instance.numEmps + 1, size=genes.shape)
+
+    return Population(genes)
 
 # Name: Crossover
-# Purpose: Create two offspring from two parents, slicing them by a random interval
-#   and returning offspring that take genes from alternate slices of chromosome
-# Input: Two parent chromosome objects
-# Output: Two offspring chromosome objects
-def Crossover(parent1, parent2):
-    x = random.randint(1,8)
-    offspring1 = copy.deepcopy(parent1)
-    offspring2 = copy.deepcopy(parent2)
-    for i in range(0,x):
-        offspring1.geneList[i] = parent2.geneList[i]
-        offspring2.geneList[i] = parent1.geneList[i]
-    return (offspring1, offspring2)
+# Purpose: Create offspring from pairs of parents, slicing them by a random
+#   interval and swapping the genes before the slice between the pair, in place
+# Input: offspring: gene array (pairs x 2 x tasks) holding copies of the
+#   parents, crossoverRate: rate of genetic crossover, rng: numpy random
+#   Generator, pairTasks: optional array of the real tasks of each pair, when
+#   the rows are padded to a longer length
+# Output: None
+def Crossover(offspring, crossoverRate, rng, pairTasks=None):
+    numPairs, _, numTasks = offspring.shape
+    doCross = rng.random(numPairs) < crossoverRate
+    if pairTasks is None:
+        points = rng.integers(1, max(1, numTasks - 2) + 1, size=numPairs)
+    else:
+        points = rng.integers(1, np.maximum(1, pairTasks - 2) + 1, size=numPairs)
+    swapMask = (np.arange(numTasks) < points[:, np.newaxis]) & doCross[:, np.newaxis]
+
+    first = offspring[:, 0]
+    second = offspring[:, 1]
+    temp = first[swapMask]
+    first[swapMask] = second[swapMask]
+    second[swapMask] = temp
 
 # Name: Mutate
-# Purpose: Swap the genes from two indexes of a chromosome at rate of mutation
-# Input: Offspring chromosome object, and rate of mutation
-# Output: Mutated offspring chromosome object
-def Mutate(offspring, mutationRate):
-    swaps = []
-    for i, gene in enumerate(offspring.geneList):
-        if random.random() < mutationRate:
-            if len(swaps) < 2:
-                swaps.append(i)
-            if len(swaps) == 2:
-                temp = offspring.geneList[i]
-                offspring.geneList[i] = offspring.geneList[swaps[0]]
-                offspring.geneList[swaps[0]] = temp
-                swaps.clear()
-
-    return offspring
-
-# Name : GetBestIndividual
-# Purpose: Return the highest fitness individual from population
-# Input: Population, list of chromosome objects
-# Output: Highest fitness chromsome object from population list
-def GetBestIndividual(population):
-    return max(population, key=lambda c: c.fitness)
+# Purpose: Swap the genes from two indexes of each offspring at rate of
+#   mutation, genes picked for mutation are swapped in consecutive pairs
+# Input: genes: offspring gene array (offspring x tasks), mutated in place,
+#   mutationRate: rate of mutation, rng: numpy random Generator, mask:
+#   optional boolean array of the genes that may be picked, when the rows are
+#   padded to a longer length
+# Output: None
+def Mutate(genes, mutationRate, rng, mask=None):
+    picked = rng.random(genes.shape) < mutationRate
+    if mask is not None:
+        picked &= mask
+    rows, cols = np.nonzero(picked)
+
+    # Position of each picked gene among the picks of its own row
+    counts = np.bincount(rows, minlength=len(genes))
+    rank = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # Pair every even ranked pick with the next pick of the same row
+    first = np.nonzero((rank % 2 == 0) & (rank + 1 < counts[rows]))[0]
+    swapRows = rows[first]
+    temp = genes[swapRows, cols[first]]
+    genes[swapRows, cols[first]] = genes[swapRows, cols[first + 1]]
+    genes[swapRows, cols[first + 1]] = temp
 
 # Allows for seperate execution of genetic algorithm
 if __name__ == "__main__":
-    
+
     # Run Genetic Algorithm
     bestSolGA = GeneticAlgorithm(60, 500, 0.77, 0.2, 0)
     print("GA Best sol:", bestSolGA.geneList)
-    print("GA Best sol cost:", bestSolGA.cost) 
+    print("GA Best sol cost:", bestSolGA.cost)
@@ -0,0 +1,121 @@
+# Compiled problem instance shared by the fitness functions and solvers
+# Contributers: Michael Durkan
+
+from classes import Task, Employee, Error
+import numpy as np
+import json
+import csv
+
+class ProblemInstance:
+    def __init__(self, taskList, empList):
+        if len(taskList) == 0 or len(empList) == 0:
+            raise Error("instance needs at least one task and one employee")
+        self.taskList = taskList
+        self.empList = empList
+        self.numTasks = len(taskList)
+        self.numEmps = len(empList)
+        self.taskIds = [task.id for task in taskList]
+        self.empIds = [emp.id for emp in empList]
+
+        # Task and employee attribute arrays
+        self.taskTime = np.array([task.time for task in taskList])
+        self.taskDifficulty = np.array([task.difficulty for task in taskList])
+        self.taskDeadline = np.array([task.deadline for task in taskList])
+        self.empHours = np.array([emp.hours for emp in empList])
+        self.empLevel = np.array([emp.level for emp in empList])
+
+        # Tasks in stable order of time, and the rank of each task in that order,
+        # matches the ordering of SortTasksByTime
+        self.timeOrder = np.argsort(self.taskTime, kind="stable")
+        self.timeRank = np.empty(self.numTasks, dtype=np.int64)
+        self.timeRank[self.timeOrder] = np.arange(self.numTasks)
+
+        # Skill compatibility is found by matching skill codes rather than
+        # scanning each employee's skill list. Only the skill x employee table
+        # is stored, as task x employee matrices do not fit in memory for
+        # tens of thousands of tasks and thousands of employees.
+        skillCodes = {}
+        for emp in empList:
+            for skill in emp.skills:
+                skillCodes.setdefault(skill, len(skillCodes))
+        empHasSkill = np.zeros((len(skillCodes) + 1, self.numEmps), dtype=bool)
+        for empIdx, emp in enumerate(empList):
+            for skill in emp.skills:
+                empHasSkill[skillCodes[skill], empIdx] = True
+        # Skills nobody holds map to the final all False row
+        self.taskSkillCode = np.array([skillCodes.get(task.skill, len(skillCodes))
+                                       for task in taskList])
+        self.empHasSkill = empHasSkill
+
+        # Lower bound on the cost, worked out by bounds.CostLowerBound on first use
+        self.costBound = None
+
+# Name: InstanceFromDicts
+# Purpose: Build a problem instance from task and employee dictionaries, in the
+#   same layout as data.py
+# Input: taskData: list of task dicts, empData: list of employee dicts
+# Output: ProblemInstance
+def InstanceFromDicts(taskData, empData):
+    return ProblemInstance([Task(**task) for task in taskData],
+                           [Employee(**emp) for emp in empData])
+
+# Name: LoadInstance
+# Purpose: Load a problem instance from a JSON file holding "tasks" and
+#   "employees" lists, or from a pair of task and employee CSV files
+# Input: path: JSON file or task CSV file, empPath: employee CSV file when
+#   loading from CSV
+# Output: ProblemInstance
+def LoadInstance(path, empPath=None):
+    if path.lower().endswith(".json"):
+        with open(path) as jsonFile:
+            roster = json.load(jsonFile)
+        return InstanceFromDicts(roster["tasks"], roster["employees"])
+
+    if empPath is None:
+        raise Error("employee CSV file needed alongside " + path)
+    return InstanceFromDicts(ReadTaskCsv(path), ReadEmployeeCsv(empPath))
+
+# Name: ReadTaskCsv
+# Purpose: Read tasks from a CSV with columns id, time, difficulty, deadline, skill
+# Input: path: csv file path
+# Output: list of task dicts
+def ReadTaskCsv(path):
+    with open(path, newline='') as csvFile:
+        return [{"id": row["id"], "time": ParseNumber(row["time"]),
+                 "difficulty": ParseNumber(row["difficulty"]),
+                 "deadline": ParseNumber(row["deadline"]), "skill": row["skill"]}
+                for row in csv.DictReader(csvFile)]
+
+# Name: ReadEmployeeCsv
+# Purpose: Read employees from a CSV with columns id, hours, level, skills where
+#   skills are separated by semicolons
+# Input: path: csv file path
+# Output: list of employee dicts
+def ReadEmployeeCsv(path):
+    with open(path, newline='') as csvFile:
+        return [{"id": row["id"], "hours": ParseNumber(row["hours"]),
+                 "level": ParseNumber(row["level"]),
+                 "skills": [s.strip() for s in row["skills"].split(";") if s.strip()]}
+                for row in csv.DictReader(csvFile)]
+
+# Name: ParseNumber
+# Purpose: Convert a CSV field to an int, or a float when it is fractional
+# Input: text: field text
+# Output: int or float
+def ParseNumber(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+# Instance for the synthetic data in data.py, built on first use
+defaultInstance = None
+
+# Name: DefaultInstance
+# Purpose: Return the instance for the synthetic data in data.py, building it once
+# Input: None
+# Output: ProblemInstance
+def DefaultInstance():
+    global defaultInstance
+    if defaultInstance is None:
+        from data import tasks, employees
+        defaultInstance = InstanceFromDicts(tasks, employees)
+    return defaultInstance
@@ -0,0 +1,201 @@
+# Island model genetic algorithm, running populations in a process pool
+# Contributers: Michael Durkan
+
+from classes import Error
+from instance import DefaultInstance
+from population import Population
+from ga import GenInitPop, MakeGeneBuffers, NextGeneration
+from telemetry import OpenLog
+from bounds import ReachedBound
+from rng import SpawnRngs
+import multiprocessing
+import numpy as np
+import time
+
+# Migration topologies that can be passed by name
+TOPOLOGIES = ("ring", "full")
+
+# Inputs:
+#   numIslands: number of independent populations
+#   populationSize: size of each island's population
+#   maxGenerations: maximum number of generations
+#   crossoverRate: rate of genetic crossover
+#   mutationRate: rate of genetic mutation
+#   elitism: Number of best chromosomes kept each generation on each island
+#   migrationInterval: generations between migrations
+#   numMigrants: best individuals sent by each island at a migration
+#   topology: ring (to the next island) or full (to every other island)
+#   instance: ProblemInstance to solve, defaults to the synthetic data
+#   seed: seed for the islands' random streams, random when None
+#   processes: worker processes, defaults to one per island up to the cpu
+#       count, 0 runs the islands in this process
+#   selection: parent selection method, roulette, alias, tournament or rank
+#   log: csv file or telemetry Sink streamed the merged generation, cost, time
+#       and feasability after each migration interval, None to skip
+# Outputs:
+#   best: best chromosome over all islands after algorithm finishes
+def IslandGeneticAlgorithm(numIslands, populationSize, maxGenerations, crossoverRate,
+                           mutationRate, elitism, migrationInterval=10, numMigrants=2,
+                           topology="ring", instance=None, seed=None, processes=None,
+                           selection="roulette", log='islandCostResults.csv'):
+    # Wall clock time, as it is compared with times logged in the workers
+    timeStart = time.time()
+    if numIslands < 1:
+        raise Error("numIslands must be at least 1")
+    if migrationInterval < 1:
+        raise Error("migrationInterval must be at least 1")
+    if numMigrants < 0:
+        raise Error("numMigrants must not be negative")
+    if topology not in TOPOLOGIES:
+        raise Error("unknown migration topology " + str(topology))
+    if numMigrants >= populationSize:
+        raise Error("numMigrants must be smaller than the population size")
+    if instance is None:
+        instance = DefaultInstance()
+
+    # Open the log only once the arguments are known to be good, so a bad
+    # call leaves an existing log as it was
+    sink = OpenLog(log)
+    logGeneration = 0
+
+    # Independent random stream for each island
+    rngs = SpawnRngs(seed, numIslands)
+    islands = [{"genes": GenInitPop(populationSize, instance, rng).genes, "rng": rng,
+                "params": (crossoverRate, mutationRate, elitism, selection)}
+               for rng in rngs]
+
+    if processes is None:
+        processes = min(numIslands, multiprocessing.cpu_count())
+    pool = None
+    if processes > 0:
+        pool = multiprocessing.Pool(processes, initializer=InitIslandWorker,
+                                    initargs=(instance,))
+    else:
+        InitIslandWorker(instance)
+
+    try:
+        generation = 0
+        while True:
+            # Run every island for the generations up to the next migration
+            numGens = min(migrationInterval, maxGenerations - generation)
+            for island in islands:
+                island["generations"] = numGens
+                island["first"] = generation == 0
+            if pool is not None:
+                islands = pool.map(EvolveIsland, islands)
+            else:
+                islands = [EvolveIsland(island) for island in islands]
+
+            # Merge the islands' logs, best cost, latest time and total
+            # violations over all islands for each generation
+            bestCost = min(island["log"][-1][0] for island in islands)
+            for step in range(len(islands[0]["log"])):
+                logs = [island["log"][step] for island in islands]
+                if sink is not None:
+                    sink.Write((logGeneration, min(log[0] for log in logs),
+                                max(log[1] for log in logs) - timeStart if logGeneration else 0,
+                                sum(log[2] for log in logs)))
+                logGeneration += 1
+            generation += numGens
+
+            # Stop at the last generation, or once an island's best cost
+            # matches the lower bound and cannot improve
+            if generation >= maxGenerations or ReachedBound(bestCost, instance):
+                break
+            Migrate(islands, numMigrants, topology)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Flush the rest of the generation, cost, time and feasability log
+    if sink is not None:
+        sink.Close()
+
+    # Get the best solution over all islands
+    bestIsland = max(islands, key=lambda island: island["fitness"].max())
+    population = Population(bestIsland["genes"])
+    population.Evaluate(instance)
+    return population.ToChromosome(population.BestIndex())
+
+# Instance used by the islands in a worker process
+islandInstance = None
+
+# Name: InitIslandWorker
+# Purpose: Store the instance once in each worker, so it is not sent with
+#   every batch of generations
+# Input: instance: ProblemInstance
+# Output: None
+def InitIslandWorker(instance):
+    global islandInstance
+    islandInstance = instance
+
+# Name: EvolveIsland
+# Purpose: Evaluate an island's population and run it for a number of
+#   generations, logging the best cost, time and total violations of each
+# Input: island: dict of genes, rng, params and generations
+# Output: the island dict updated with genes, fitness, rng and log
+def EvolveIsland(island):
+    crossoverRate, mutationRate, elitism, selection = island["params"]
+    rng = island["rng"]
+    populationSize = len(island["genes"])
+    buffers = MakeGeneBuffers(populationSize, elitism, island["genes"].shape[1])
+    buffers[0][:populationSize] = island["genes"]
+
+    population = Population(buffers[0][:populationSize])
+    population.Evaluate(islandInstance)
+    log = []
+    if island["first"]:
+        log.append((population.cost.min().item(), time.time(),
+                    population.totalViolations.sum().item()))
+
+    for generation in range(island["generations"]):
+        population = NextGeneration(population, buffers[(generation + 1) % 2],
+                                    crossoverRate, mutationRate, elitism,
+                                    islandInstance, None, rng, selection)
+        log.append((population.cost.min().item(), time.time(),
+                    population.totalViolations.sum().item()))
+
+    island["genes"] = population.genes.copy()
+    island["fitness"] = population.fitness
+    island["log"] = log
+    return island
+
+# Name: Migrate
+# Purpose: Send copies of each island's best individuals to its neighbours
+#   in the topology, replacing the worst individuals of the receiving island
+# Input: islands: list of island dicts, numMigrants: individuals sent by each
+#   island, topology: ring or full
+# Output: None
+def Migrate(islands, numMigrants, topology):
+    numIslands = len(islands)
+    if numIslands < 2 or numMigrants < 1:
+        return
+
+    # Take every island's migrants before any island is changed
+    outgoing = []
+    for island in islands:
+        best = np.argsort(-island["fitness"], kind="stable")[:numMigrants]
+        outgoing.append((island["genes"][best], island["fitness"][best]))
+
+    for dest, island in enumerate(islands):
+        if topology == "ring":
+            genes, fitness = outgoing[(dest - 1) % numIslands]
+        else:
+            # Keep the best of the migrants from every other island
+            genes = np.concatenate([outgoing[src][0] for src in range(numIslands) if src != dest])
+            fitness = np.concatenate([outgoing[src][1] for src in range(numIslands) if src != dest])
+            keep = np.argsort(-fitness, kind="stable")[:numMigrants]
+            genes, fitness = genes[keep], fitness[keep]
+
+        worst = np.argsort(island["fitness"], kind="stable")[:len(genes)]
+        island["genes"][worst] = genes
+        island["fitness"][worst] = fitness
+
+# Allows for seperate execution of the island model genetic algorithm
+if __name__ == "__main__":
+
+    # Run Island Genetic Algorithm
+    bestSolIsland = IslandGeneticAlgorithm(4, 60, 500, 0.77, 0.2, 1)
+    print("Island GA Best sol:", bestSolIsland.geneList)
+    print("Island GA Best sol cost:", bestSolIsland.cost)
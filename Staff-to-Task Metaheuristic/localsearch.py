@@ -0,0 +1,159 @@
+# Local improvement of candidate rosters, run inside the GA, ACO and PSO
+# Contributers: Michael Durkan
+
+from classes import Error
+from delta import DeltaEvaluator
+import numpy as np
+import time
+
+# Name: LocalSearch
+# Purpose: Improve some of a population's gene lists in place with greedy
+#   moves scored by the delta evaluator: giving tasks without a skilled
+#   employee to one with the skill, moving tasks off overloaded employees and
+#   moving the latest tasks of employees missing deadlines. Only moves that
+#   lower the total violations are kept.
+class LocalSearch:
+    # Inputs:
+    #   instance: ProblemInstance
+    #   rate: fraction of the gene lists improved at each call
+    #   maxEvaluations: move evaluations allowed for each gene list
+    #   neighbours: employees tried for each task moved, those with the most
+    #       spare hours
+    #   maxTime: optional seconds allowed for each call, over all gene lists
+    def __init__(self, instance, rate=0.2, maxEvaluations=100, neighbours=4, maxTime=None):
+        if not 0.0 <= rate <= 1.0:
+            raise Error("rate must be between 0 and 1")
+        if maxEvaluations < 1 or neighbours < 1:
+            raise Error("maxEvaluations and neighbours must be at least 1")
+        self.instance = instance
+        self.rate = rate
+        self.maxEvaluations = maxEvaluations
+        self.neighbours = neighbours
+        self.maxTime = maxTime
+        self.empHours = instance.empHours.astype(float)
+
+        # Employees holding each skill code
+        self.skilledEmps = [np.nonzero(row)[0] for row in instance.empHasSkill]
+        self.evaluations = 0
+        self.improvements = 0
+
+    # Name: Improve
+    # Purpose: Improve a random selection of gene lists, in place
+    # Input: genes: 2-D gene array (individuals x tasks), rng: numpy random Generator
+    # Output: row indexes of the gene lists that were changed
+    def Improve(self, genes, rng):
+        count = int(np.ceil(self.rate * len(genes)))
+        if count == 0:
+            return np.empty(0, dtype=np.int64)
+        rows = rng.choice(len(genes), size=count, replace=False)
+        timeEnd = None if self.maxTime is None else time.perf_counter() + self.maxTime
+
+        changed = []
+        for row in rows:
+            if timeEnd is not None and time.perf_counter() >= timeEnd:
+                break
+            geneList = self.ImproveGeneList(genes[row].tolist(), rng)
+            if geneList is not None:
+                genes[row] = geneList
+                changed.append(row)
+        return np.array(changed, dtype=np.int64)
+
+    # Name: ImproveGeneList
+    # Purpose: Run the repair, rebalancing and deadline moves on one gene list
+    #   until its evaluation budget runs out
+    # Input: geneList: list of employee numbers, rng: numpy random Generator
+    # Output: improved gene list, or None when no move helped
+    def ImproveGeneList(self, geneList, rng):
+        delta = DeltaEvaluator(geneList, self.instance)
+        state = {"delta": delta, "budget": self.maxEvaluations,
+                 "violations": delta.Penalties()["totalViolations"], "moved": False}
+        for Moves in (self.SkillRepair, self.Rebalance, self.DeadlineMoves):
+            if state["budget"] <= 0 or state["violations"] == 0:
+                break
+            Moves(state, rng)
+
+        if not state["moved"]:
+            return None
+        self.improvements += 1
+        return delta.geneList
+
+    # Name: TryTask
+    # Purpose: Try moving one task to each of a set of employees, applying the
+    #   best move if it lowers the total violations
+    # Input: state: search state dict, taskIdx: task index, emps: employee
+    #   indexes to try
+    # Output: True when the task was moved
+    def TryTask(self, state, taskIdx, emps):
+        delta = state["delta"]
+        current = delta.geneList[taskIdx] - 1
+
+        # Prefer the employees with the most spare hours
+        emps = emps[emps != current]
+        if len(emps) > self.neighbours:
+            spare = self.empHours[emps] - np.array([delta.empLoad[e] for e in emps])
+            emps = emps[np.argpartition(-spare, self.neighbours - 1)[:self.neighbours]]
+
+        bestEmp, bestViolations = None, state["violations"]
+        for emp in emps[:max(state["budget"], 0)].tolist():
+            violations = delta.EvaluateReassign(taskIdx, emp + 1)["totalViolations"]
+            state["budget"] -= 1
+            self.evaluations += 1
+            if violations < bestViolations:
+                bestEmp, bestViolations = emp, violations
+
+        if bestEmp is None:
+            return False
+        delta.ApplyReassign(taskIdx, bestEmp + 1)
+        state["violations"] = bestViolations
+        state["moved"] = True
+        return True
+
+    # Name: SkillRepair
+    # Purpose: Give tasks done by employees without the skill to employees with it
+    # Input: state: search state dict, rng: numpy random Generator
+    # Output: None
+    def SkillRepair(self, state, rng):
+        instance = self.instance
+        genes = np.array(state["delta"].geneList) - 1
+        mismatched = np.nonzero(~instance.empHasSkill[instance.taskSkillCode, genes])[0]
+        for taskIdx in rng.permutation(mismatched).tolist():
+            if state["budget"] <= 0:
+                return
+            emps = self.skilledEmps[instance.taskSkillCode[taskIdx]]
+            if len(emps):
+                self.TryTask(state, taskIdx, emps)
+
+    # Name: Rebalance
+    # Purpose: Move tasks from the most overloaded employees to the employees
+    #   with the most spare hours
+    # Input: state: search state dict, rng: numpy random Generator
+    # Output: None
+    def Rebalance(self, state, rng):
+        delta = state["delta"]
+        overload = np.array(delta.empLoad) - self.empHours
+        allEmps = np.arange(self.instance.numEmps)
+        for emp in np.argsort(-overload, kind="stable").tolist():
+            if overload[emp] <= 0 or state["budget"] <= 0:
+                return
+            tasks = [delta.timeOrder[rank] for rank in delta.empRanks[emp]]
+            for taskIdx in rng.permutation(tasks).tolist():
+                if state["budget"] <= 0 or delta.empLoad[emp] <= self.empHours[emp]:
+                    break
+                self.TryTask(state, taskIdx, allEmps)
+
+    # Name: DeadlineMoves
+    # Purpose: Move the last tasks of the employees with the most deadline
+    #   violation, which finish latest, to employees with spare hours
+    # Input: state: search state dict, rng: numpy random Generator
+    # Output: None
+    def DeadlineMoves(self, state, rng):
+        delta = state["delta"]
+        tardiness = np.array(delta.empDeadline)
+        allEmps = np.arange(self.instance.numEmps)
+        for emp in np.argsort(-tardiness, kind="stable").tolist():
+            if tardiness[emp] <= 0 or state["budget"] <= 0:
+                return
+            for rank in delta.empRanks[emp][::-1]:
+                if state["budget"] <= 0 or delta.empDeadline[emp] == 0:
+                    break
+                self.TryTask(state, delta.timeOrder[rank], allEmps)
@@ -1,29 +1,143 @@
 # Main executable file
 # Contributers: Michael Durkan
 
-from data import tasks, employees
 from classes import Task, Employee, Chromosome
+from instance import DefaultInstance, LoadInstance
 import ga as g
-import test as t
 import aco as a
 import pso as p
-import random
-import copy
+import portfolio as pf
+from profiler import Profiler
+from stopping import StoppingCriteria
+from bounds import CostLowerBound, OptimalityGap
+from localsearch import LocalSearch
+from checkpoint import Checkpointer
+import argparse
+import sys
 
 if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Staff-to-Task metaheuristic search")
+    parser.add_argument("roster", nargs="*",
+                        help="roster.json, or tasks.csv employees.csv (default: data.py)")
+    parser.add_argument("--portfolio", type=float, metavar="SECONDS",
+                        help="run all solvers concurrently for this many seconds")
+    parser.add_argument("--seeds", type=int, default=2,
+                        help="seeded runs of each solver in portfolio mode")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each solver phase, writing *Profile.csv files")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="stop each solver after this many seconds")
+    parser.add_argument("--target", type=float, metavar="COST",
+                        help="stop each solver once it reaches this cost")
+    parser.add_argument("--stagnation", type=int, metavar="ITERATIONS",
+                        help="stop each solver after this many iterations without improvement")
+    parser.add_argument("--local-search", action="store_true",
+                        help="improve some offspring, ants and particles by local moves")
+    parser.add_argument("--checkpoint-every", type=int, metavar="ITERATIONS",
+                        help="save each solver's state to *Checkpoint.npz this often")
+    parser.add_argument("--resume", metavar="CHECKPOINT",
+                        help="carry on the run saved in a checkpoint file")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="re-mutate duplicate GA offspring and ACO ants before scoring")
+    parser.add_argument("--seed", type=int,
+                        help="seed every solver's random stream, for reproducible runs")
+    parser.add_argument("--config", metavar="FILE",
+                        help="solver settings json, such as one written by tuner.py")
+    args = parser.parse_args()
+
+    # Load the roster given on the command line, otherwise use the synthetic data
+    if len(args.roster) > 2:
+        parser.error("give roster.json, or tasks.csv and employees.csv")
+    if args.roster:
+        instance = LoadInstance(*args.roster)
+    else:
+        instance = DefaultInstance()
+
+    # Solver settings, tuned ones from a config file over the defaults
+    params = pf.LoadSolverParams(args.config)
+
+    # Run the portfolio of solvers under one time budget
+    if args.portfolio is not None:
+        report = pf.RunPortfolio(args.portfolio, args.seeds, instance=instance,
+                                 seed=args.seed, params=params)
+        print("Portfolio Best sol:", report["bestSolution"])
+        print("Portfolio Best sol cost:", report["bestCost"], "from", report["bestSolver"])
+        print("Optimality gap:", report["gap"])
+        for solver, solverStats in report["stats"].items():
+            print(solver, solverStats)
+        raise SystemExit
+
+    # Carry on a checkpointed run, saving to the same file as it goes
+    if args.resume is not None:
+        checkpoint = None
+        if args.checkpoint_every is not None:
+            checkpoint = Checkpointer(args.resume, args.checkpoint_every)
+        bestSol, bestCost = pf.ResumeRun(
+            args.resume, instance, checkpoint=checkpoint,
+            localSearch=LocalSearch(instance) if args.local_search else None)
+        print("Resumed Best sol:", bestSol)
+        print("Resumed Best sol cost:", bestCost)
+        print("Optimality gap:", OptimalityGap(bestCost, instance))
+        raise SystemExit
     
+    # Profile each solver's phases when asked
+    profilers = {}
+    if args.profile:
+        for solver in ("ga", "aco", "pso"):
+            profilers[solver] = Profiler(solver + "Profile.csv")
+
+    # Stop each solver early when given a budget, target or stagnation window,
+    # a time budget alone replaces the iteration limit
+    stoppingArgs = {"timeBudget": args.time_budget, "targetCost": args.target,
+                    "stagnationWindow": args.stagnation}
+    maxIterations = 500
+    if args.time_budget is not None:
+        maxIterations = sys.maxsize
+    def Stopping():
+        if all(value is None for value in stoppingArgs.values()):
+            return None
+        return StoppingCriteria(**stoppingArgs)
+
+    # Local improvement stage shared by the solvers when asked
+    localSearch = LocalSearch(instance) if args.local_search else None
+
+    # Save each solver's state every so often when asked
+    def Checkpoint(solver):
+        if args.checkpoint_every is None:
+            return None
+        return Checkpointer(solver + "Checkpoint.npz", args.checkpoint_every)
+
     # Run Genetic Algorithm
-    bestSolGA = g.GeneticAlgorithm(60, 500, 0.77, 0.2, 1)
+    bestSolGA = g.GeneticAlgorithm(maxGenerations=maxIterations, **params["ga"], instance=instance,
+                                   profiler=profilers.get("ga"), stopping=Stopping(),
+                                   localSearch=localSearch, checkpoint=Checkpoint("ga"),
+                                   dedupe=args.dedupe, seed=args.seed)
     print("GA Best sol:", bestSolGA.geneList)
     print("GA Best sol cost:", bestSolGA.cost) 
+    print("GA Optimality gap:", OptimalityGap(bestSolGA.cost, instance))
 
     # Run Ant Colony Optimisation
-    bestSolACO, bestCostACO= a.AntColonyOptimisation(120,0.15,60,500)
+    bestSolACO, bestCostACO= a.AntColonyOptimisation(maxIterations=maxIterations, **params["aco"], instance=instance,
+                                                     profiler=profilers.get("aco"),
+                                                     stopping=Stopping(),
+                                                     localSearch=localSearch,
+                                                     checkpoint=Checkpoint("aco"),
+                                                     dedupe=args.dedupe, seed=args.seed)
     print("ACO Best sol:", bestSolACO)
     print("ACO Best sol cost:", bestCostACO)
+    print("ACO Optimality gap:", OptimalityGap(bestCostACO, instance))
 
     # Run Particle Swarm Optimisation
-    bestSolPSO, bestCostPSO = p.pso(numTasks=10, numEmployee=5, numParticles=180,
-        maxIter=500)
+    bestSolPSO, bestCostPSO = p.pso(maxIter=maxIterations, **params["pso"], instance=instance,
+                                    profiler=profilers.get("pso"), stopping=Stopping(),
+                                    localSearch=localSearch, checkpoint=Checkpoint("pso"),
+                                    seed=args.seed)
     print("PSO Best sol:", bestSolPSO)
     print("PSO Best sol cost:", bestCostPSO)
+    print("PSO Optimality gap:", OptimalityGap(bestCostPSO, instance))
+    print("Lower bound on cost:", CostLowerBound(instance))
+
+    # Show where each solver spent its time
+    for solver, profiler in profilers.items():
+        print(profiler.Report(solver.upper() + " profile"))
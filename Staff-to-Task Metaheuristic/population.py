@@ -0,0 +1,79 @@
+# Array backed population store for the genetic algorithm
+# Contributers: Michael Durkan
+
+from classes import Chromosome, Error
+from fitness import EvaluateFitnessBatch
+import numpy as np
+
+# Per individual score arrays, named as the Chromosome fields
+SCORE_FIELDS = ("overPenalty", "skillPenalty", "diffPenalty", "deadlinePenalty",
+                "assignPenalty", "totalViolations", "cost", "fitness",
+                "fitnessRatio", "cumulativeProb")
+
+class Population:
+    # Inputs:
+    #   genes: 2-D integer array (individuals x tasks), rows are used in place
+    def __init__(self, genes):
+        self.genes = genes
+        self.size = len(genes)
+        for field in SCORE_FIELDS:
+            setattr(self, field, np.zeros(self.size))
+
+    # Name: Evaluate
+    # Purpose: Score every individual, filling the parallel score arrays
+    # Input: instance: ProblemInstance, cache: optional FitnessCache
+    # Output: None
+    def Evaluate(self, instance, cache=None):
+        scores = EvaluateFitnessBatch(self.genes, instance, cache)
+        for field in SCORE_FIELDS:
+            setattr(self, field, scores[field])
+
+    # Name: BestIndex
+    # Purpose: Index of the highest fitness individual, first one on ties
+    # Input: None
+    # Output: row index
+    def BestIndex(self):
+        return int(np.argmax(self.fitness))
+
+    # Name: ToChromosome
+    # Purpose: Copy one individual out as a Chromosome object
+    # Input: idx: row index
+    # Output: Chromosome with its gene list and scores set
+    def ToChromosome(self, idx):
+        chromo = Chromosome(self.genes[idx].tolist())
+        for field in SCORE_FIELDS:
+            setattr(chromo, field, getattr(self, field)[idx].item())
+        chromo.violation = chromo.deadlinePenalty
+        return chromo
+
+# Name: CheckGeneList
+# Purpose: Check a gene list given by the caller fits an instance
+# Input: geneList: employee number (1 to numEmps) for each task, instance:
+#   ProblemInstance
+# Output: gene list as an integer array
+def CheckGeneList(geneList, instance):
+    genes = np.asarray(geneList, dtype=np.int64)
+    if genes.shape != (instance.numTasks,):
+        raise Error("gene list length does not match number of tasks")
+    if genes.min() < 1 or genes.max() > instance.numEmps:
+        raise Error("gene list needs every task assigned to an employee")
+    return genes
+
+# Name: WarmGenes
+# Purpose: Start a population from a previous solution: the first row is the
+#   solution itself, and in each other row a random fraction of the genes is
+#   given to random employees
+# Input: geneList: previous solution, count: rows, perturbation: fraction of
+#   genes changed in each copy, instance: ProblemInstance, rng: numpy random
+#   Generator, out: optional gene array (count x tasks) to fill
+# Output: gene array (count x tasks)
+def WarmGenes(geneList, count, perturbation, instance, rng, out=None):
+    if not 0.0 < perturbation <= 1.0:
+        raise Error("perturbation must be above 0 and at most 1")
+    if out is None:
+        out = np.empty((count, instance.numTasks), dtype=np.int64)
+    out[:] = CheckGeneList(geneList, instance)
+
+    changed = rng.random(out[1:].shape) < perturbation
+    out[1:][changed] = rng.integers(1, instance.numEmps + 1, size=int(changed.sum()))
+    return out
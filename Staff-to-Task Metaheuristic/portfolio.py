@@ -0,0 +1,239 @@
+# Portfolio runner, running GA, ACO and PSO concurrently under one time budget
+# Contributers: Michael Durkan
+
+from classes import Error
+from instance import DefaultInstance
+from ga import GeneticAlgorithm
+from aco import AntColonyOptimisation
+from pso import pso
+from bounds import CostLowerBound, OptimalityGap, ReachedBound
+from checkpoint import LoadCheckpoint
+from rng import SpawnRngs
+import multiprocessing
+import json
+import time
+import sys
+
+# Solver settings from main.py, the iteration limit is left to the time budget
+SOLVER_PARAMS = {
+    "ga": {"populationSize": 60, "crossoverRate": 0.77, "mutationRate": 0.2, "elitism": 1},
+    "aco": {"numAnts": 120, "evapRate": 0.15, "depositConstant": 60},
+    "pso": {"numParticles": 180, "w": 0.95, "c1": 1.5, "c2": 1.3},
+}
+
+# Name: LoadSolverParams
+# Purpose: Read solver settings from a json config file, such as one written
+#   by the tuner, over the defaults in SOLVER_PARAMS
+# Input: path: json file of solver name to settings, None for the defaults
+# Output: dict of solver name to settings
+def LoadSolverParams(path=None):
+    params = {solver: dict(settings) for solver, settings in SOLVER_PARAMS.items()}
+    if path is None:
+        return params
+    with open(path) as configFile:
+        config = json.load(configFile)
+    for solver, settings in config.items():
+        if solver not in params:
+            raise Error("unknown solver " + str(solver) + " in " + path)
+        if not isinstance(settings, dict):
+            raise Error("settings of " + solver + " in " + path + " must be an object")
+        params[solver].update(settings)
+    return params
+
+# Inputs:
+#   timeBudget: seconds every run must finish within
+#   seedsPerSolver: number of differently seeded runs of each solver
+#   solvers: names of the solvers to run, from ga, aco and pso
+#   instance: ProblemInstance to solve, defaults to the synthetic data
+#   seed: seed for the runs' random streams, random when None
+#   processes: worker processes, defaults to one per run so every run starts
+#       at once, fewer than the number of runs is an error as the rest would
+#       only start once the deadline had passed
+#   graceFraction: fraction of the budget a run has before it can be cancelled
+#   cancelRatio: a run is cancelled when its best cost is above this multiple
+#       of the shared best cost
+#   params: optional dict of solver name to settings overriding SOLVER_PARAMS
+# Outputs:
+#   report: dict of the overall best solution, cost and solver, the lower
+#       bound and optimality gap, the per solver statistics and the result of
+#       every run
+def RunPortfolio(timeBudget, seedsPerSolver=2, solvers=("ga", "aco", "pso"),
+                 instance=None, seed=None, processes=None, graceFraction=0.25,
+                 cancelRatio=1.5, params=None):
+    if instance is None:
+        instance = DefaultInstance()
+    for solver in solvers:
+        if solver not in SOLVER_PARAMS:
+            raise Error("unknown solver " + str(solver))
+
+    # One independently seeded configuration per solver and seed
+    configs = []
+    rngs = SpawnRngs(seed, len(solvers) * seedsPerSolver)
+    for i, solver in enumerate(solvers):
+        settings = dict(SOLVER_PARAMS[solver])
+        settings.update((params or {}).get(solver, {}))
+        for run in range(seedsPerSolver):
+            configs.append({"solver": solver, "run": run, "params": settings,
+                            "rng": rngs[i * seedsPerSolver + run]})
+
+    # Every run needs its own process to run concurrently with the others
+    if processes is None:
+        processes = len(configs)
+    if processes < len(configs):
+        raise Error("portfolio needs a process for each of its " + str(len(configs)) +
+                    " runs, not " + str(processes))
+
+    # Best cost known to any worker, and the wall clock deadline they share
+    sharedBest = multiprocessing.Value("d", float("inf"))
+    deadline = time.time() + timeBudget
+
+    runs = []
+    pool = multiprocessing.Pool(processes, initializer=InitPortfolioWorker,
+                                initargs=(instance, sharedBest, deadline, timeBudget,
+                                          graceFraction, cancelRatio))
+    try:
+        pending = pool.imap_unordered(RunConfig, configs)
+        for _ in configs:
+            # Allow runs a little past the deadline to finish their iteration
+            try:
+                runs.append(pending.next(timeout=max(deadline - time.time(), 0) + 5.0))
+            except multiprocessing.TimeoutError:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    report = SummariseRuns(runs, solvers)
+    report["lowerBound"] = CostLowerBound(instance)
+    report["gap"] = OptimalityGap(report["bestCost"], instance)
+    return report
+
+# Settings shared by the runs of a worker process
+portfolioWorker = {}
+
+# Name: InitPortfolioWorker
+# Purpose: Store the instance, shared best cost and cancellation settings
+#   once in each worker process
+# Input: instance, sharedBest: shared best cost value, deadline: wall clock
+#   end time, timeBudget, graceFraction, cancelRatio
+# Output: None
+def InitPortfolioWorker(instance, sharedBest, deadline, timeBudget, graceFraction,
+                        cancelRatio):
+    portfolioWorker.update(instance=instance, sharedBest=sharedBest, deadline=deadline,
+                           timeBudget=timeBudget, graceFraction=graceFraction,
+                           cancelRatio=cancelRatio)
+
+# Name: RunConfig
+# Purpose: Run one solver configuration until it finishes, reaches the
+#   deadline or is cancelled for being well behind the shared best cost
+# Input: config: dict of solver name, run number, settings and rng
+# Output: dict of the run's best solution, cost, iterations, time and status
+def RunConfig(config):
+    timeStart = time.time()
+    sharedBest = portfolioWorker["sharedBest"]
+
+    # A run the pool only got to after the deadline has no result
+    if timeStart >= portfolioWorker["deadline"]:
+        return {"solver": config["solver"], "run": config["run"], "bestSolution": None,
+                "bestCost": None, "iterations": 0, "elapsedTime": 0.0, "status": "late"}
+    progress = {"iterations": 0, "status": "finished"}
+
+    # Called by the solver every iteration, returning True stops it
+    def Callback(iteration, bestCost, bestSolution):
+        progress["iterations"] = iteration
+        with sharedBest.get_lock():
+            if bestCost < sharedBest.value:
+                sharedBest.value = bestCost
+            globalBest = sharedBest.value
+        now = time.time()
+        if now >= portfolioWorker["deadline"]:
+            progress["status"] = "deadline"
+            return True
+        # No run can go below the lower bound
+        if ReachedBound(globalBest, portfolioWorker["instance"]):
+            progress["status"] = ("finished" if ReachedBound(bestCost, portfolioWorker["instance"])
+                                  else "cancelled")
+            return True
+        if (now - timeStart > portfolioWorker["graceFraction"] * portfolioWorker["timeBudget"]
+                and bestCost > portfolioWorker["cancelRatio"] * globalBest):
+            progress["status"] = "cancelled"
+            return True
+        return False
+
+    settings = config["params"]
+    common = {"instance": portfolioWorker["instance"], "rng": config["rng"],
+              "log": None, "callback": Callback}
+    if config["solver"] == "ga":
+        best = GeneticAlgorithm(maxGenerations=sys.maxsize, **settings, **common)
+        bestSolution, bestCost = best.geneList, best.cost
+    elif config["solver"] == "aco":
+        bestSolution, bestCost = AntColonyOptimisation(maxIterations=sys.maxsize, **settings,
+                                                       **common)
+    else:
+        bestSolution, bestCost = pso(maxIter=sys.maxsize, **settings, **common)
+
+    return {"solver": config["solver"], "run": config["run"], "bestSolution": bestSolution,
+            "bestCost": bestCost, "iterations": progress["iterations"],
+            "elapsedTime": time.time() - timeStart, "status": progress["status"]}
+
+# Name: SummariseRuns
+# Purpose: Find the overall best run and work out statistics for each solver,
+#   leaving out runs that only started after the deadline
+# Input: runs: list of run results, solvers: names of the solvers run
+# Output: report dict
+def SummariseRuns(runs, solvers):
+    late = [run for run in runs if run["status"] == "late"]
+    runs = [run for run in runs if run["status"] != "late"]
+    if not runs:
+        raise Error("no portfolio run finished within the time budget")
+    best = min(runs, key=lambda run: run["bestCost"])
+
+    stats = {}
+    for solver in solvers:
+        costs = [run["bestCost"] for run in runs if run["solver"] == solver]
+        solverRuns = [run for run in runs if run["solver"] == solver]
+        stats[solver] = {
+            "runs": len(solverRuns),
+            "bestCost": min(costs) if costs else None,
+            "meanCost": sum(costs) / len(costs) if costs else None,
+            "iterations": sum(run["iterations"] for run in solverRuns),
+            "cancelled": sum(run["status"] == "cancelled" for run in solverRuns),
+            "late": sum(run["solver"] == solver for run in late),
+        }
+
+    return {"bestSolution": best["bestSolution"], "bestCost": best["bestCost"],
+            "bestSolver": best["solver"], "stats": stats, "runs": runs}
+
+# Name: ResumeRun
+# Purpose: Carry on a checkpointed ga, aco or pso run with its saved settings
+# Input: path: checkpoint file, instance: ProblemInstance the run was on,
+#   defaults to the synthetic data, options: further solver arguments, such as
+#   a Checkpointer to keep saving, the LocalSearch the run used, or a larger
+#   iteration limit
+# Output: best solution, best cost
+def ResumeRun(path, instance=None, **options):
+    if instance is None:
+        instance = DefaultInstance()
+    resume = LoadCheckpoint(path)
+    arguments = dict(resume["params"], instance=instance, resume=resume)
+    arguments.update(options)
+
+    if resume["solver"] == "ga":
+        best = GeneticAlgorithm(**arguments)
+        return best.geneList, best.cost
+    if resume["solver"] == "aco":
+        return AntColonyOptimisation(**arguments)
+    if resume["solver"] == "pso":
+        return pso(**arguments)
+    raise Error("unknown solver " + str(resume["solver"]))
+
+# Allows for seperate execution of the portfolio runner
+if __name__ == "__main__":
+
+    # Run all three solvers for ten seconds
+    report = RunPortfolio(10)
+    print("Portfolio Best sol:", report["bestSolution"])
+    print("Portfolio Best sol cost:", report["bestCost"], "from", report["bestSolver"])
+    print("Optimality gap:", report["gap"])
+    for solver, solverStats in report["stats"].items():
+        print(solver, solverStats)
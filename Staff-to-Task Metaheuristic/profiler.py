@@ -0,0 +1,171 @@
+# Phase timers and counters for finding where the solvers spend their time
+# Contributers: Michael Durkan
+
+from telemetry import CsvSink
+import time
+
+# Name: PhaseTimer
+# Purpose: Context manager adding the time spent inside it to one phase
+class PhaseTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.profiler.iterationTimes[self.name] = (
+            self.profiler.iterationTimes.get(self.name, 0.0) + elapsed)
+
+# Name: Profiler
+# Purpose: Collect the time spent in each named phase of a solver and count
+#   events such as fitness evaluations, per iteration and over the whole run
+class Profiler:
+    # Inputs:
+    #   log: optional csv file or telemetry Sink streamed the time spent in
+    #       each phase and the evaluations of every iteration, a Sink should
+    #       have the columns iteration, the solver's phases and evaluations
+    def __init__(self, log=None):
+        self.log = log
+        self.sink = None
+        self.phases = ()
+        self.timers = {}
+        self.iterationTimes = {}
+        self.iterationEvals = 0
+        self.totals = {}
+        self.counters = {}
+        self.cache = None
+        self.cacheStart = (0, 0)
+        self.timeStart = time.perf_counter()
+        self.timeEnd = None
+
+    # Name: Begin
+    # Purpose: Start profiling a run, opening the per iteration phase log
+    # Input: phases: names of the solver's phases in log column order,
+    #   cache: optional FitnessCache whose hits during the run are counted
+    # Output: None
+    def Begin(self, phases, cache=None):
+        self.phases = tuple(phases)
+        self.cache = cache
+        if cache is not None:
+            self.cacheStart = (cache.hits, cache.misses)
+        if isinstance(self.log, str):
+            self.sink = CsvSink(self.log, ("iteration",) + self.phases + ("evaluations",))
+        else:
+            self.sink = self.log
+        self.timeStart = time.perf_counter()
+        self.timeEnd = None
+
+    # Name: Phase
+    # Purpose: Time a block of code as part of a phase
+    # Input: name: phase name
+    # Output: context manager
+    def Phase(self, name):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = PhaseTimer(self, name)
+        return timer
+
+    # Name: Count
+    # Purpose: Add to a named counter
+    # Input: name: counter name, amount: amount to add
+    # Output: None
+    def Count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        if name == "evaluations":
+            self.iterationEvals += amount
+
+    # Name: EndIteration
+    # Purpose: Add the iteration's phase times to the run totals and log them
+    # Input: iteration: iteration or generation number
+    # Output: None
+    def EndIteration(self, iteration):
+        for name, elapsed in self.iterationTimes.items():
+            self.totals[name] = self.totals.get(name, 0.0) + elapsed
+        if self.sink is not None:
+            self.sink.Write([iteration] + [self.iterationTimes.get(name, 0.0)
+                                           for name in self.phases]
+                            + [self.iterationEvals])
+        self.iterationTimes.clear()
+        self.iterationEvals = 0
+
+    # Name: End
+    # Purpose: Finish the run, counting cache hits and closing the phase log
+    # Input: None
+    # Output: None
+    def End(self):
+        if self.iterationTimes:
+            self.EndIteration(self.counters.get("iterations", 0))
+        self.timeEnd = time.perf_counter()
+        if self.cache is not None:
+            self.counters["cacheHits"] = self.cache.hits - self.cacheStart[0]
+            self.counters["cacheMisses"] = self.cache.misses - self.cacheStart[1]
+        if self.sink is not None:
+            self.sink.Close()
+            self.sink = None
+
+    # Name: Summary
+    # Purpose: Work out the time and share of the run of each phase
+    # Input: None
+    # Output: dict of the total time, phases, counters and evaluations per second
+    def Summary(self):
+        total = (self.timeEnd or time.perf_counter()) - self.timeStart
+        phases = {}
+        for name, elapsed in self.totals.items():
+            phases[name] = {"time": elapsed,
+                            "share": elapsed / total if total > 0 else 0.0}
+        evaluations = self.counters.get("evaluations", 0)
+        return {"totalTime": total, "phases": phases, "counters": dict(self.counters),
+                "evalsPerSecond": evaluations / total if total > 0 else 0.0}
+
+    # Name: Report
+    # Purpose: Lay out the summary as text, slowest phase first
+    # Input: title: heading of the report
+    # Output: report string
+    def Report(self, title="Profile"):
+        summary = self.Summary()
+        lines = [title + ": %.3fs total" % summary["totalTime"]]
+        for name, phase in sorted(summary["phases"].items(),
+                                  key=lambda item: -item[1]["time"]):
+            lines.append("  %-12s %9.4fs %6.1f%%" % (name, phase["time"],
+                                                    100.0 * phase["share"]))
+        for name, value in summary["counters"].items():
+            lines.append("  %-12s %d" % (name, value))
+        lines.append("  %-12s %.0f" % ("evals/sec", summary["evalsPerSecond"]))
+        return "\n".join(lines)
+
+# Name: NullContext
+# Purpose: Context manager that does nothing, shared by every disabled phase
+class NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+# Name: NullProfiler
+# Purpose: Stand in for Profiler when profiling is off, every call is a no-op
+class NullProfiler:
+    context = NullContext()
+
+    def Begin(self, phases, cache=None):
+        pass
+
+    def Phase(self, name):
+        return self.context
+
+    def Count(self, name, amount=1):
+        pass
+
+    def EndIteration(self, iteration):
+        pass
+
+    def End(self):
+        pass
+
+# Shared disabled profiler, used when a solver is given no profiler
+NULL_PROFILER = NullProfiler()
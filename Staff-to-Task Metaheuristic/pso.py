@@ -3,11 +3,16 @@
 # brief:implementation of a PSO to create a swarm that solves an assignment task
 
 import time
-import csv
-import random
 import numpy as np
-from classes import Chromosome
-from fitness import EvaluateFitness
+from classes import Error
+from instance import DefaultInstance
+from fitness import EvaluateFitnessBatch
+from telemetry import OpenLog
+from profiler import NULL_PROFILER
+from bounds import ReachedBound
+from population import WarmGenes
+from checkpoint import ResumeState, RestoreRng, RestoreStopping
+from rng import MakeRng
 
 # Inputs:
 #       numTasks: number of tasks to assign
@@ -17,86 +22,194 @@ from fitness import EvaluateFitness
 #       w: inertia
 #       c1: cognitive coefficent
 #       c2: Social coefficient 
+#       instance: ProblemInstance to solve, defaults to the synthetic data
+#       cache: optional FitnessCache to reuse scores of repeated positions
+#       rng: optional numpy random Generator
+#       log: csv file or telemetry Sink streamed the iteration, cost, time and
+#           feasability as they are produced, None to skip
+#       callback: optional function called each iteration with the iteration,
+#           best cost and best position, returning True stops the run
+#       profiler: optional Profiler timing the phases of every iteration
+#       stopping: optional StoppingCriteria ending the run early and holding
+#           the best solution so far
+#       localSearch: optional LocalSearch improving some particles' positions
+#           after each move
+#       checkpoint: optional Checkpointer saving the run's state every so often
+#       resume: optional checkpoint file or loaded checkpoint to carry on
+#           from, giving the same results as a run that was never stopped
+#       initial: optional gene list of a previous solution to start from,
+#           placing one particle on it and the rest on perturbed copies
+#       perturbation: fraction of genes changed in each copy of initial
+#       seed: seed for the random stream when no rng is given, random when
+#           None
 # Outputs:
 #       GlobalBestPosition: best assignment of tasks to employees
 #       GlobalBestCost:     total cost of best solution
-def pso(numTasks, numEmployee, numParticles=90, maxIter=500, w=0.95, c1=1.5, c2=1.3):
+def pso(numTasks=None, numEmployee=None, numParticles=90, maxIter=500, w=0.95,
+        c1=1.5, c2=1.3, instance=None, cache=None, rng=None,
+        log='psoCostResults.csv', callback=None, profiler=None, stopping=None,
+        localSearch=None, checkpoint=None, resume=None, initial=None, perturbation=0.1,
+        seed=None):
     startTime = time.perf_counter()#track time for data collection
-    results = []
-    #intialise a swarm
-    swarm = [Particle(numTasks, numEmployee) for _ in range(numParticles)]
-    #find global best given the lowest cost
-    globalBest = min(swarm, key=lambda p: p.cost)
-    globalBestPosition = globalBest.position[:]
-    globalBestCost = globalBest.cost
-
-    for iteration in range(1, maxIter + 1):
-        for p in swarm:
-            #random factors for c1 and c2
-            r1 = np.random.rand(numTasks)
-            r2 = np.random.rand(numTasks)
+    # task and employee counts come from the instance
+    if instance is None:
+        instance = DefaultInstance()
+    if numTasks not in (None, instance.numTasks) or numEmployee not in (None, instance.numEmps):
+        raise Error("numTasks and numEmployee must match the instance")
+    resume = ResumeState(resume, "pso", instance)
+    #log sink for data collection, cut back to the checkpoint when resuming
+    sink = OpenLog(log, resume["log"] if resume is not None else None)
+    #settings saved with checkpoints, so the run can be resumed
+    params = {"numParticles": numParticles, "maxIter": maxIter, "w": w, "c1": c1, "c2": c2,
+              "log": log if isinstance(log, str) else None}
+    if rng is None:
+        rng = MakeRng(seed)
+    if profiler is None:
+        profiler = NULL_PROFILER
+    profiler.Begin(PSO_PHASES, cache)
+    if stopping is not None:
+        stopping.Begin()
+    startIteration = 0
+    if resume is None:
+        #intialise a swarm
+        with profiler.Phase("init"):
+            swarm = Swarm(numParticles, instance, rng, cache,
+                          initial=initial, perturbation=perturbation)
+        profiler.Count("evaluations", numParticles)
+        profiler.EndIteration(0)
+        #find global best given the lowest cost
+        globalBest = int(np.argmin(swarm.cost))
+        globalBestPosition = swarm.bestPosition[globalBest].copy()
+        globalBestCost = swarm.cost[globalBest].item()
+        if stopping is not None and stopping.Update(0, globalBestCost, globalBestPosition,
+                                                    numParticles, swarm.position):
+            maxIter = 0
+    else:
+        #carry on from the checkpointed swarm, global best and random stream
+        startIteration = resume["iteration"]
+        rng = RestoreRng(resume["rng"])
+        startTime -= resume["elapsedTime"]
+        swarm = Swarm(numParticles, instance, rng, cache, resume["arrays"])
+        globalBestPosition = resume["arrays"]["globalBestPosition"]
+        globalBestCost = resume["values"]["globalBestCost"]
+        RestoreStopping(stopping, resume)
+    #no need to search when the best cost already matches the lower bound
+    if ReachedBound(globalBestCost, instance):
+        maxIter = 0
+
+    for iteration in range(startIteration + 1, maxIter + 1):
+        with profiler.Phase("velocity"):
+            #random factors for c1 and c2, for every particle and task at once
+            r1 = rng.random(swarm.position.shape)
+            r2 = rng.random(swarm.position.shape)
 
             # Update velocity given inertia, c1 and c2
-            p.velocity = [
-                w * v +
-                c1 * r1[i] * (p.bestPosition[i] - p.position[i]) +
-                c2 * r2[i] * (globalBestPosition[i] - p.position[i])
-                for i, v in enumerate(p.velocity)
-            ]
+            swarm.velocity = (w * swarm.velocity +
+                              c1 * r1 * (swarm.bestPosition - swarm.position) +
+                              c2 * r2 * (globalBestPosition - swarm.position))
 
             # apply the velocy and rounde to an employee
-            p.position = [
-                int(np.clip(round(p.position[i] + p.velocity[i]), 1, numEmployee))
-                for i in range(numTasks)
-            ]
-
-            # Evaluate new position
-            particleWrapper = Chromosome(p.position[:])
-            EvaluateFitness([particleWrapper])
-            p.violation = particleWrapper.totalViolations
-
-            # Update if personal best is better
-            if particleWrapper.fitness > p.bestFitness:
-                p.bestPosition = p.position[:]
-                p.bestFitness = particleWrapper.fitness
-                p.cost = particleWrapper.cost
-
-                # Update global best if personal best is better
-                if particleWrapper.cost < globalBestCost:
-                    globalBestPosition = p.position[:]
-                    globalBestCost = particleWrapper.cost
+            swarm.position = np.clip(np.rint(swarm.position + swarm.velocity),
+                                     1, instance.numEmps).astype(np.int64)
+
+        #improve some of the new positions directly
+        if localSearch is not None:
+            with profiler.Phase("localsearch"):
+                localSearch.Improve(swarm.position, rng)
+
+        # Evaluate new positions of the whole swarm
+        with profiler.Phase("evaluate"):
+            scores = EvaluateFitnessBatch(swarm.position, instance, cache)
+        profiler.Count("evaluations", numParticles)
+        swarm.violation = scores["totalViolations"]
+
+        with profiler.Phase("bests"):
+            # Update particles whose personal best is better
+            improved = scores["fitness"] > swarm.bestFitness
+            swarm.bestPosition[improved] = swarm.position[improved]
+            swarm.bestFitness[improved] = scores["fitness"][improved]
+            swarm.cost[improved] = scores["cost"][improved]
+
+            # Update global best if an improved personal best is better
+            if improved.any():
+                bestImproved = int(np.argmin(np.where(improved, scores["cost"], np.inf)))
+                if scores["cost"][bestImproved] < globalBestCost:
+                    globalBestPosition = swarm.position[bestImproved].copy()
+                    globalBestCost = scores["cost"][bestImproved].item()
         # timings for data collection
-        elapsed = time.perf_counter() - startTime
-        totalViolations = sum(particle.violation for particle in swarm)
-        results.append([iteration, globalBestCost, elapsed, totalViolations])
-    # writing to file gor graph
-    with open('psoCostResults.csv', 'w', newline='') as csvFile:
-        wr = csv.writer(csvFile)
-        wr.writerow(['generation', 'bestCost', 'elapsedTime', 'feasability'])
-        wr.writerows(results)
-
-    return globalBestPosition, globalBestCost
-
-#Particle class, 
-#Import number of tasks and number of employees
-class Particle:
-    def __init__(self, numTasks, numEmployee):
-        #randomly assign employees (between 1 and10)
-        self.position = [random.randint(1, numEmployee) for _ in range(numTasks)]
-        self.velocity = [0.0] * numTasks #creates arry for velocity @ 0
-        self.bestPosition = self.position[:]#stores personal best
+        with profiler.Phase("log"):
+            elapsed = time.perf_counter() - startTime
+            totalViolations = swarm.violation.sum().item()
+            if sink is not None:
+                sink.Write([iteration, globalBestCost, elapsed, totalViolations])
+        profiler.Count("iterations")
+        profiler.EndIteration(iteration)
+        # let the caller see progress and stop the run early
+        if callback is not None and callback(iteration, globalBestCost,
+                                             globalBestPosition.tolist()):
+            break
+        if stopping is not None and stopping.Update(iteration, globalBestCost,
+                                                    globalBestPosition, numParticles,
+                                                    swarm.position):
+            break
+        #stop once the best cost matches the lower bound, it cannot improve
+        if ReachedBound(globalBestCost, instance):
+            break
+        #save the run's state so it can be resumed from this iteration
+        if checkpoint is not None and checkpoint.Due(iteration):
+            with profiler.Phase("checkpoint"):
+                checkpoint.Save("pso", iteration, params,
+                                {"position": swarm.position, "velocity": swarm.velocity,
+                                 "bestPosition": swarm.bestPosition,
+                                 "bestFitness": swarm.bestFitness, "cost": swarm.cost,
+                                 "violation": swarm.violation,
+                                 "globalBestPosition": globalBestPosition},
+                                {"globalBestCost": globalBestCost}, rng, instance,
+                                time.perf_counter() - startTime, sink, stopping)
+    # flush the rest of the log for graph
+    if sink is not None:
+        sink.Close()
+    profiler.End()
+
+    return globalBestPosition.tolist(), globalBestCost
+
+#phases of an iteration timed by a Profiler
+PSO_PHASES = ("init", "velocity", "localsearch", "evaluate", "bests", "log", "checkpoint")
+
+#Swarm class, positions, velocities and personal bests of every particle
+#stored as matrices (particles x tasks)
+#Import number of particles, the instance, random generator, optional cache,
+#optional checkpointed swarm arrays to carry on from and optional previous
+#solution to start around
+class Swarm:
+    def __init__(self, numParticles, instance, rng, cache=None, state=None, initial=None,
+                 perturbation=0.1):
+        if state is not None:
+            #copy the saved swarm instead of starting a new one
+            for field in ("position", "velocity", "bestPosition", "bestFitness",
+                          "cost", "violation"):
+                setattr(self, field, state[field].copy())
+            return
+        if initial is not None:
+            #start on and around the previous solution
+            self.position = WarmGenes(initial, numParticles, perturbation, instance, rng)
+        else:
+            #randomly assign employees (between 1 and numEmps)
+            self.position = rng.integers(1, instance.numEmps + 1,
+                                         size=(numParticles, instance.numTasks))
+        self.velocity = np.zeros(self.position.shape) #creates arry for velocity @ 0
+        self.bestPosition = self.position.copy()#stores personal best
 
         # Evaluate initial fitness
-        particleWrapper = Chromosome(self.position[:])
-        EvaluateFitness([particleWrapper])
-        self.bestFitness = particleWrapper.fitness
-        self.cost = particleWrapper.cost
-        self.violation = particleWrapper.totalViolations
+        scores = EvaluateFitnessBatch(self.position, instance, cache)
+        self.bestFitness = scores["fitness"]
+        self.cost = scores["cost"]
+        self.violation = scores["totalViolations"]
 
 # allows for execution of particle swarm indivdually
 if __name__ == "__main__":
     
-    bestSolPSO, bestScorePSO = p.pso(numTasks=10, numEmployee=5, numParticles=180,
+    bestSolPSO, bestScorePSO = pso(numTasks=10, numEmployee=5, numParticles=180,
         maxIter=500)
     print("PSO Best sol:", bestSolPSO)
     print("PSO Best sol cost:", bestScorePSO)
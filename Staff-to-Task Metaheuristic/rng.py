@@ -0,0 +1,78 @@
+# Seeded random streams shared by the solvers, split per worker so runs are
+# reproducible however they are spread over processes
+# Contributers: Michael Durkan
+
+from classes import Error
+import numpy as np
+
+# Name: MakeRng
+# Purpose: Random Generator for a run
+# Input: seed: None for a fresh random seed, an int or SeedSequence, or a
+#   Generator which is used as it is
+# Output: numpy random Generator
+def MakeRng(seed=None):
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+# Name: SpawnRngs
+# Purpose: Independent random Generators split from one seed, one for each
+#   island, run or worker
+# Input: seed: None, an int or SeedSequence, count: number of streams
+# Output: list of numpy random Generators
+def SpawnRngs(seed, count):
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(count)]
+
+# Name: RootEntropy
+# Purpose: Entropy of a seed, sent to worker processes which rebuild streams
+#   from it with KeyedRng
+# Input: seed: None for a fresh random seed, or an int
+# Output: entropy int
+def RootEntropy(seed=None):
+    return np.random.SeedSequence(seed).entropy
+
+# Name: KeyedRng
+# Purpose: Random Generator for one unit of work, the same in any process
+#   for the same entropy and key, so work may be split over any number of
+#   workers and still give the same results
+# Input: entropy: from RootEntropy, key: ints naming the unit of work
+# Output: numpy random Generator
+def KeyedRng(entropy, *key):
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=key))
+
+# Name: RandomBlock
+# Purpose: Hand out single random numbers to loops that need them one at a
+#   time, drawn from a Generator in blocks instead of one call each. Blocks
+#   are only drawn when needed, so a loop that takes none leaves the stream
+#   untouched.
+class RandomBlock:
+    # Inputs:
+    #   rng: numpy random Generator the blocks are drawn from
+    #   blockSize: random numbers drawn at a time
+    def __init__(self, rng, blockSize=256):
+        if blockSize < 1:
+            raise Error("blockSize must be at least 1")
+        self.rng = rng
+        self.blockSize = blockSize
+        self.block = []
+        self.used = 0
+
+    # Name: Random
+    # Purpose: Next uniform random number in [0, 1)
+    # Input: None
+    # Output: float
+    def Random(self):
+        if self.used == len(self.block):
+            self.block = self.rng.random(self.blockSize).tolist()
+            self.used = 0
+        self.used += 1
+        return self.block[self.used - 1]
+
+    # Name: Integer
+    # Purpose: Next random integer in [low, high)
+    # Input: low, high: bounds
+    # Output: int
+    def Integer(self, low, high):
+        return low + min(int(self.Random() * (high - low)), high - low - 1)
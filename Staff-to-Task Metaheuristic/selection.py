@@ -0,0 +1,106 @@
+# Parent selection methods for the genetic algorithm
+# Contributers: Michael Durkan
+
+from classes import Error
+import numpy as np
+
+# Name: RouletteSelect
+# Purpose: Roulette wheel selection by binary search of the cumulative
+#   probabilities, picking the first individual whose cumulative prob is at
+#   least the random number
+# Input: cumulativeProb: cumulative probability array, num: number of picks,
+#   rng: numpy random Generator
+# Output: array of selected row indexes
+def RouletteSelect(cumulativeProb, num, rng):
+    picks = np.searchsorted(cumulativeProb, rng.random(num), side="left")
+    return np.minimum(picks, len(cumulativeProb) - 1)
+
+# Name: AliasTable
+# Purpose: Walker/Vose alias table, built in O(n) from a set of weights, which
+#   then draws each sample in O(1)
+class AliasTable:
+    # Inputs:
+    #   weights: non negative weight of each individual
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        total = weights.sum()
+        if len(weights) == 0 or not total > 0:
+            raise Error("alias table needs a positive total weight")
+        size = len(weights)
+        scaled = (weights * (size / total)).tolist()
+        prob = [1.0] * size
+        alias = list(range(size))
+
+        small = [i for i in range(size) if scaled[i] < 1.0]
+        large = [i for i in range(size) if scaled[i] >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = (scaled[more] + scaled[less]) - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever is left over is 1 up to rounding error, so keeps prob 1
+
+        self.prob = np.array(prob)
+        self.alias = np.array(alias)
+
+    # Name: Sample
+    # Purpose: Draw individuals in proportion to their weights
+    # Input: num: number of picks, rng: numpy random Generator
+    # Output: array of selected row indexes
+    def Sample(self, num, rng):
+        column = rng.integers(0, len(self.prob), size=num)
+        keep = rng.random(num) < self.prob[column]
+        return np.where(keep, column, self.alias[column])
+
+# Name: TournamentSelect
+# Purpose: Tournament selection, each pick is the fittest of a group of
+#   individuals chosen uniformly at random
+# Input: fitness: fitness array, num: number of picks, rng: numpy random
+#   Generator, tournamentSize: individuals in each tournament
+# Output: array of selected row indexes
+def TournamentSelect(fitness, num, rng, tournamentSize=2):
+    entrants = rng.integers(0, len(fitness), size=(num, tournamentSize))
+    winners = np.argmax(fitness[entrants], axis=1)
+    return entrants[np.arange(num), winners]
+
+# Name: RankSelect
+# Purpose: Linear rank selection, individuals are picked in proportion to
+#   their fitness rank rather than the fitness value itself
+# Input: fitness: fitness array, num: number of picks, rng: numpy random
+#   Generator, pressure: expected picks of the best individual (1 to 2)
+# Output: array of selected row indexes
+def RankSelect(fitness, num, rng, pressure=1.5):
+    size = len(fitness)
+    rank = np.empty(size)
+    rank[np.argsort(fitness, kind="stable")] = np.arange(size)
+    if size > 1:
+        weights = (2.0 - pressure) + 2.0 * (pressure - 1.0) * rank / (size - 1)
+    else:
+        weights = np.ones(1)
+    cumulative = np.cumsum(weights / weights.sum())
+    return RouletteSelect(cumulative, num, rng)
+
+# Selection methods that can be passed by name
+SELECTION_METHODS = ("roulette", "alias", "tournament", "rank")
+
+# Name: SelectParents
+# Purpose: Draw every parent needed for a generation in one call
+# Input: population: scored Population, num: number of parents, method: one
+#   of SELECTION_METHODS, rng: numpy random Generator, tournamentSize:
+#   individuals in each tournament
+# Output: array of selected row indexes
+def SelectParents(population, num, method, rng, tournamentSize=2):
+    if method == "roulette":
+        return RouletteSelect(population.cumulativeProb, num, rng)
+    if method == "alias":
+        return AliasTable(population.fitnessRatio).Sample(num, rng)
+    if method == "tournament":
+        return TournamentSelect(population.fitness, num, rng, tournamentSize)
+    if method == "rank":
+        return RankSelect(population.fitness, num, rng)
+    raise Error("unknown selection method " + str(method))
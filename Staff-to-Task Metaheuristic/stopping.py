@@ -0,0 +1,186 @@
+# Stopping criteria shared by the solvers, for anytime runs under a budget
+# Contributers: Michael Durkan
+
+from classes import Error
+import numpy as np
+import threading
+import time
+
+# Name: StoppingCriteria
+# Purpose: Decide when a solver should stop and hold the best solution found
+#   so far. The solver reports each iteration to Update, while other threads
+#   may read the incumbent with Best or end the run with RequestStop.
+class StoppingCriteria:
+    # Inputs:
+    #   timeBudget: seconds the run may take, it stops early rather than start
+    #       an iteration expected to run past the budget
+    #   evalBudget: fitness evaluations the run may use, it stops rather than
+    #       start an iteration that would go over
+    #   targetCost: stop once the best cost is at or below this
+    #   stagnationWindow: stop after this many iterations without improvement
+    #   minImprovement: decrease in best cost that counts as an improvement
+    #   diversityThreshold: stop once the population's mean fraction of genes
+    #       differing from the best solution falls below this
+    def __init__(self, timeBudget=None, evalBudget=None, targetCost=None,
+                 stagnationWindow=None, minImprovement=0.0, diversityThreshold=None):
+        if timeBudget is not None and timeBudget <= 0:
+            raise Error("timeBudget must be positive")
+        if evalBudget is not None and evalBudget < 1:
+            raise Error("evalBudget must be at least 1")
+        if stagnationWindow is not None and stagnationWindow < 1:
+            raise Error("stagnationWindow must be at least 1")
+        self.timeBudget = timeBudget
+        self.evalBudget = evalBudget
+        self.targetCost = targetCost
+        self.stagnationWindow = stagnationWindow
+        self.minImprovement = minImprovement
+        self.diversityThreshold = diversityThreshold
+        self.lock = threading.Lock()
+        self.stopRequested = False
+        self.Begin()
+
+    # Name: Begin
+    # Purpose: Reset the clock, counters and incumbent at the start of a run.
+    #   A stop requested before the run started is kept, so the run stops
+    #   after its first iteration.
+    # Input: None
+    # Output: None
+    def Begin(self):
+        with self.lock:
+            self.timeStart = time.perf_counter()
+            self.lastUpdate = self.timeStart
+            self.longestIteration = 0.0
+            self.evaluations = 0
+            self.lastEvaluations = 0
+            self.iteration = 0
+            self.lastImprovement = 0
+            self.bestCost = float("inf")
+            self.bestSolution = None
+            self.diversity = None
+            self.reason = None
+
+    # Name: Reset
+    # Purpose: Clear any stop request as well as the counters, to reuse the
+    #   criteria for another run
+    # Input: None
+    # Output: None
+    def Reset(self):
+        with self.lock:
+            self.stopRequested = False
+        self.Begin()
+
+    # Name: Update
+    # Purpose: Record an iteration's result and decide whether to stop
+    # Input: iteration: iteration or generation number, bestCost: best cost of
+    #   the iteration, bestSolution: its gene list or array, evaluations:
+    #   fitness evaluations used by the iteration, genes: optional population
+    #   gene array for the diversity check
+    # Output: True when the solver should stop, with the reason in self.reason
+    def Update(self, iteration, bestCost, bestSolution, evaluations, genes=None):
+        now = time.perf_counter()
+        diversity = None
+        if self.diversityThreshold is not None and genes is not None and len(genes) > 1:
+            diversity = (np.asarray(genes) != np.asarray(bestSolution)).mean().item()
+
+        with self.lock:
+            self.iteration = iteration
+            self.evaluations += evaluations
+            self.lastEvaluations = evaluations
+            self.longestIteration = max(self.longestIteration, now - self.lastUpdate)
+            self.lastUpdate = now
+            self.diversity = diversity
+            if bestCost < self.bestCost - self.minImprovement or self.bestSolution is None:
+                self.lastImprovement = iteration
+            if bestCost < self.bestCost or self.bestSolution is None:
+                self.bestCost = bestCost
+                self.bestSolution = np.array(bestSolution)
+
+            self.reason = self.CheckReason(now)
+            return self.reason is not None
+
+    # Name: CheckReason
+    # Purpose: Find the first criterion met, called with the lock held
+    # Input: now: current perf_counter time
+    # Output: reason string, or None to carry on
+    def CheckReason(self, now):
+        if self.stopRequested:
+            return "requested"
+        if self.targetCost is not None and self.bestCost <= self.targetCost:
+            return "target"
+        if (self.timeBudget is not None and
+                now - self.timeStart + self.longestIteration > self.timeBudget):
+            return "time"
+        if (self.evalBudget is not None and
+                self.evaluations + self.lastEvaluations > self.evalBudget):
+            return "evaluations"
+        if (self.stagnationWindow is not None and
+                self.iteration - self.lastImprovement >= self.stagnationWindow):
+            return "stagnation"
+        if (self.diversity is not None and
+                self.diversity < self.diversityThreshold):
+            return "diversity"
+        return None
+
+    # Name: Snapshot
+    # Purpose: Copy the counters and incumbent, for saving in a checkpoint
+    # Input: None
+    # Output: dict of the run's state, with the elapsed time in place of the clock
+    def Snapshot(self):
+        with self.lock:
+            return {"elapsedTime": time.perf_counter() - self.timeStart,
+                    "longestIteration": self.longestIteration,
+                    "evaluations": self.evaluations,
+                    "lastEvaluations": self.lastEvaluations,
+                    "iteration": self.iteration,
+                    "lastImprovement": self.lastImprovement,
+                    "bestCost": self.bestCost,
+                    "bestSolution": self.bestSolution}
+
+    # Name: Restore
+    # Purpose: Carry on from a Snapshot when a run is resumed, after Begin
+    # Input: snapshot: dict from Snapshot
+    # Output: None
+    def Restore(self, snapshot):
+        now = time.perf_counter()
+        with self.lock:
+            self.timeStart = now - snapshot["elapsedTime"]
+            self.lastUpdate = now
+            self.longestIteration = snapshot["longestIteration"]
+            self.evaluations = snapshot["evaluations"]
+            self.lastEvaluations = snapshot["lastEvaluations"]
+            self.iteration = snapshot["iteration"]
+            self.lastImprovement = snapshot["lastImprovement"]
+            self.bestCost = snapshot["bestCost"]
+            bestSolution = snapshot["bestSolution"]
+            self.bestSolution = None if bestSolution is None else np.array(bestSolution)
+
+    # Name: RequestStop
+    # Purpose: Ask the solver to stop after its current iteration
+    # Input: None
+    # Output: None
+    def RequestStop(self):
+        with self.lock:
+            self.stopRequested = True
+
+    # Name: Best
+    # Purpose: Get the best solution found so far, safe to call while the
+    #   solver is running in another thread
+    # Input: None
+    # Output: best gene list (None before the first iteration), best cost
+    def Best(self):
+        with self.lock:
+            if self.bestSolution is None:
+                return None, self.bestCost
+            return self.bestSolution.tolist(), self.bestCost
+
+    # Name: Status
+    # Purpose: Summarise the run so far
+    # Input: None
+    # Output: dict of the iteration, evaluations, elapsed time, best cost,
+    #   diversity and the reason for stopping
+    def Status(self):
+        with self.lock:
+            return {"iteration": self.iteration, "evaluations": self.evaluations,
+                    "elapsedTime": time.perf_counter() - self.timeStart,
+                    "bestCost": self.bestCost, "diversity": self.diversity,
+                    "reason": self.reason}
@@ -0,0 +1,293 @@
+# Streaming sinks for the per iteration convergence log of the solvers
+# Contributers: Michael Durkan
+
+from classes import Error
+from abc import ABC, abstractmethod
+import numpy as np
+import json
+import csv
+import os
+
+# Columns written by the solvers for each iteration
+LOG_COLUMNS = ("generation", "bestCost", "elapsedTime", "feasability")
+
+# Columns written by the genetic algorithm and ant colony, adding the mean
+# gene entropy and the number of distinct gene lists of each iteration
+DIVERSITY_LOG_COLUMNS = LOG_COLUMNS + ("entropy", "uniqueCount")
+
+# Name: Sink
+# Purpose: Base class for the log sinks. Keeps every Nth record, holding the
+#   latest skipped record back so the final state of a run is always written.
+#   Subclasses provide Emit, writing one kept record.
+class Sink(ABC):
+    def __init__(self, columns=LOG_COLUMNS, every=1):
+        if every < 1:
+            raise Error("every must be at least 1")
+        self.columns = tuple(columns)
+        self.every = every
+        self.count = 0
+        self.held = None
+
+    # Name: Write
+    # Purpose: Add one iteration record to the log
+    # Input: record: sequence of values in column order
+    # Output: None
+    def Write(self, record):
+        if len(record) != len(self.columns):
+            raise Error("record does not match the log columns")
+        if self.count % self.every == 0:
+            self.Emit(record)
+            self.held = None
+        else:
+            self.held = record
+        self.count += 1
+
+    # Name: Close
+    # Purpose: Write any held back record and release the sink
+    # Input: None
+    # Output: None
+    def Close(self):
+        if self.held is not None:
+            self.Emit(self.held)
+            self.held = None
+        self.Flush()
+
+    @abstractmethod
+    def Emit(self, record):
+        pass
+
+    def Flush(self):
+        pass
+
+    # Name: Offset
+    # Purpose: Flush the log and get its length, for cutting it back to this
+    #   point when a checkpointed run is resumed
+    # Input: None
+    # Output: file offset, or None for sinks without a file
+    def Offset(self):
+        return None
+
+    # Name: Resume
+    # Purpose: Cut the log back to an offset from Offset, so a resumed run
+    #   does not repeat the records written after its checkpoint
+    # Input: offset: file offset
+    # Output: None
+    def Resume(self, offset):
+        raise Error(type(self).__name__ + " cannot resume a log from an offset")
+
+    # Name: State
+    # Purpose: Flush the log and get what a checkpoint needs to carry it on,
+    #   its offset and where the run is in downsampling
+    # Input: None
+    # Output: dict of the offset, records written and held back record
+    def State(self):
+        held = self.held
+        if held is not None:
+            held = [value.item() if isinstance(value, np.generic) else value
+                    for value in held]
+        return {"offset": self.Offset(), "count": self.count, "held": held}
+
+    # Name: Restore
+    # Purpose: Carry the log on from a State saved with a checkpoint, keeping
+    #   the same records as a run that was never stopped
+    # Input: state: dict from State
+    # Output: None
+    def Restore(self, state):
+        if state["offset"] is not None:
+            self.Resume(state["offset"])
+        self.count = state["count"]
+        self.held = state["held"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+# Name: CsvSink
+# Purpose: Buffered CSV log, written to disk every flushEvery records. Given a
+#   resumeOffset from Offset, an existing log is cut back to that point and
+#   appended to instead of started again.
+class CsvSink(Sink):
+    def __init__(self, path, columns=LOG_COLUMNS, every=1, flushEvery=100,
+                 resumeOffset=None):
+        Sink.__init__(self, columns, every)
+        self.flushEvery = flushEvery
+        self.buffer = []
+        if resumeOffset is not None and os.path.exists(path):
+            self.csvFile = open(path, 'r+', newline='')
+            self.csvFile.truncate(resumeOffset)
+            self.csvFile.seek(resumeOffset)
+            self.writer = csv.writer(self.csvFile)
+        else:
+            self.csvFile = open(path, 'w', newline='')
+            self.writer = csv.writer(self.csvFile)
+            self.writer.writerow(self.columns)
+        self.csvFile.flush()
+
+    def Emit(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.flushEvery:
+            self.Flush()
+
+    def Flush(self):
+        self.writer.writerows(self.buffer)
+        self.buffer.clear()
+        self.csvFile.flush()
+
+    def Offset(self):
+        self.Flush()
+        return self.csvFile.tell()
+
+    def Resume(self, offset):
+        self.Flush()
+        TruncateLog(self.csvFile, offset)
+
+    def Close(self):
+        Sink.Close(self)
+        self.csvFile.close()
+
+# Name: TruncateLog
+# Purpose: Cut an open log file back to an offset and carry on writing there
+# Input: logFile: open file, offset: file offset
+# Output: None
+def TruncateLog(logFile, offset):
+    logFile.seek(0, 2)
+    if logFile.tell() < offset:
+        raise Error("log is shorter than the checkpoint offset, it may have been "
+                    "started again, open it with resumeOffset instead")
+    logFile.truncate(offset)
+    logFile.seek(offset)
+
+# Header marking a binary log file
+BINARY_MAGIC = b"STLOG1\n"
+
+# Name: BinarySink
+# Purpose: Compact binary log of fixed width records, one float64 per column,
+#   after a short header naming the columns. Records are collected in a
+#   preallocated array and appended to the file every flushEvery records.
+#   Resumes an existing log as CsvSink does.
+class BinarySink(Sink):
+    def __init__(self, path, columns=LOG_COLUMNS, every=1, flushEvery=1000,
+                 resumeOffset=None):
+        Sink.__init__(self, columns, every)
+        self.buffer = np.empty((flushEvery, len(self.columns)))
+        self.used = 0
+        if resumeOffset is not None and os.path.exists(path):
+            self.logFile = open(path, 'r+b')
+            self.logFile.truncate(resumeOffset)
+            self.logFile.seek(resumeOffset)
+        else:
+            self.logFile = open(path, 'wb')
+            header = json.dumps(self.columns).encode()
+            self.logFile.write(BINARY_MAGIC + np.uint32(len(header)).tobytes() + header)
+        self.logFile.flush()
+
+    def Emit(self, record):
+        self.buffer[self.used] = record
+        self.used += 1
+        if self.used == len(self.buffer):
+            self.Flush()
+
+    def Flush(self):
+        self.buffer[:self.used].tofile(self.logFile)
+        self.used = 0
+        self.logFile.flush()
+
+    def Offset(self):
+        self.Flush()
+        return self.logFile.tell()
+
+    def Resume(self, offset):
+        self.Flush()
+        TruncateLog(self.logFile, offset)
+
+    def Close(self):
+        Sink.Close(self)
+        self.logFile.close()
+
+# Name: ReadBinaryLog
+# Purpose: Open a binary log as a read only memory map without loading it
+# Input: path: log file written by BinarySink
+# Output: column names, memory mapped array (records x columns)
+def ReadBinaryLog(path):
+    with open(path, 'rb') as logFile:
+        if logFile.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise Error(path + " is not a binary log")
+        headerLen = int(np.frombuffer(logFile.read(4), dtype=np.uint32)[0])
+        columns = tuple(json.loads(logFile.read(headerLen)))
+        offset = logFile.tell()
+        logFile.seek(0, 2)
+        numRecords = (logFile.tell() - offset) // (8 * len(columns))
+
+    if numRecords == 0:
+        return columns, np.empty((0, len(columns)))
+    return columns, np.memmap(path, dtype=np.float64, mode='r', offset=offset,
+                              shape=(numRecords, len(columns)))
+
+# Name: CallbackSink
+# Purpose: Pass each kept record to a function, for example a live dashboard
+class CallbackSink(Sink):
+    def __init__(self, callback, columns=LOG_COLUMNS, every=1):
+        Sink.__init__(self, columns, every)
+        self.callback = callback
+
+    def Emit(self, record):
+        self.callback(dict(zip(self.columns, record)))
+
+# Name: MultiSink
+# Purpose: Send every record to several sinks, each downsampling on its own.
+#   Offsets and checkpoint states are lists with one entry for each sink.
+class MultiSink(Sink):
+    def __init__(self, sinks):
+        Sink.__init__(self, sinks[0].columns if sinks else LOG_COLUMNS)
+        self.sinks = sinks
+
+    def Emit(self, record):
+        for sink in self.sinks:
+            sink.Write(record)
+
+    def Offset(self):
+        return [sink.Offset() for sink in self.sinks]
+
+    def Resume(self, offset):
+        if len(offset) != len(self.sinks):
+            raise Error("offset does not match the number of sinks")
+        for sink, sinkOffset in zip(self.sinks, offset):
+            if sinkOffset is not None:
+                sink.Resume(sinkOffset)
+
+    def State(self):
+        return {"offset": None, "count": self.count, "held": None,
+                "sinks": [sink.State() for sink in self.sinks]}
+
+    def Restore(self, state):
+        if len(state.get("sinks", ())) != len(self.sinks):
+            raise Error("log state does not match the number of sinks")
+        for sink, sinkState in zip(self.sinks, state["sinks"]):
+            sink.Restore(sinkState)
+        self.count = state["count"]
+
+    def Close(self):
+        for sink in self.sinks:
+            sink.Close()
+
+# Name: OpenLog
+# Purpose: Turn a solver's log argument into a sink
+# Input: log: csv file path, a Sink, or None for no log, resumeState:
+#   optional log State saved with a checkpoint to carry the log on from,
+#   columns: columns of a csv file log
+# Output: Sink or None
+def OpenLog(log, resumeState=None, columns=LOG_COLUMNS):
+    if log is None:
+        return log
+    if isinstance(log, Sink):
+        if resumeState is not None:
+            log.Restore(resumeState)
+        return log
+    if resumeState is None:
+        return CsvSink(log, columns)
+    sink = CsvSink(log, columns, resumeOffset=resumeState["offset"])
+    sink.count = resumeState["count"]
+    sink.held = resumeState["held"]
+    return sink
@@ -0,0 +1,145 @@
+# Checks that the fast evaluators and resumed runs give the same results as
+# the plain per-vector code and uninterrupted runs
+# Contributers: Michael Durkan
+
+from classes import Chromosome
+from fitness import (CalcOverloadPenalty, CalcSkillPenalty, CalcDiffPenalty,
+                     CalcDeadlinePenalty, CalcAssignmentPenalty, CalcCost, CalcCumulative,
+                     CalcPenaltiesBatch, EvaluateFitnessBatch, PENALTY_FIELDS)
+from delta import DeltaEvaluator
+from bounds import SolveExact
+from batch import InstanceBatch, CalcPenaltiesBatched, BatchGeneticAlgorithm
+from bench import GenerateInstance
+from ga import GeneticAlgorithm
+from aco import AntColonyOptimisation
+from pso import pso
+from checkpoint import Checkpointer
+from portfolio import ResumeRun
+import numpy as np
+import itertools
+import pytest
+import csv
+
+# Name: PerVectorPenalties
+# Purpose: Score gene lists with the per-vector penalty functions
+# Input: genes: 2-D gene array, instance: ProblemInstance
+# Output: list of Chromosomes with their penalties, cost and probabilities
+def PerVectorPenalties(genes, instance):
+    population = [Chromosome(row.tolist()) for row in genes]
+    for vector in population:
+        for CalcPenalty in (CalcOverloadPenalty, CalcSkillPenalty, CalcDiffPenalty,
+                            CalcDeadlinePenalty, CalcAssignmentPenalty):
+            CalcPenalty(vector, instance.taskList, instance.empList)
+    CalcCost(population)
+    CalcCumulative(population)
+    return population
+
+def test_batch_penalties_match_per_vector():
+    rng = np.random.default_rng(0)
+    for seed in range(20):
+        instance = GenerateInstance(int(rng.integers(1, 40)), int(rng.integers(1, 8)),
+                                    seed=seed)
+        # Genes below 1 count as unassigned and wrap like list indexing
+        genes = rng.integers(1 - instance.numEmps, instance.numEmps + 1,
+                             size=(12, instance.numTasks))
+        population = PerVectorPenalties(genes, instance)
+        penalties = CalcPenaltiesBatch(genes.copy(), instance)
+        scores = EvaluateFitnessBatch(genes, instance)
+        for i, vector in enumerate(population):
+            assert penalties[i].tolist() == [getattr(vector, field) for field in PENALTY_FIELDS]
+            assert scores["cost"][i] == vector.cost
+            assert scores["cumulativeProb"][i] == pytest.approx(vector.cumulativeProb)
+
+def test_delta_matches_full_evaluation():
+    rng = np.random.default_rng(1)
+    instance = GenerateInstance(60, 7, seed=1)
+    genes = rng.integers(1, instance.numEmps + 1, size=instance.numTasks)
+    evaluator = DeltaEvaluator(genes.tolist(), instance)
+
+    def Full(geneList):
+        penalties = CalcPenaltiesBatch(np.array([geneList]), instance)[0]
+        return dict(zip(PENALTY_FIELDS, penalties.tolist()))
+
+    for _ in range(200):
+        taskIdx = int(rng.integers(instance.numTasks))
+        emp = int(rng.integers(1, instance.numEmps + 1))
+        moved = list(evaluator.geneList)
+        moved[taskIdx] = emp
+        breakdown = evaluator.EvaluateReassign(taskIdx, emp)
+        assert {field: breakdown[field] for field in PENALTY_FIELDS} == Full(moved)
+
+        taskIdx2 = int(rng.integers(instance.numTasks))
+        swapped = list(evaluator.geneList)
+        swapped[taskIdx], swapped[taskIdx2] = swapped[taskIdx2], swapped[taskIdx]
+        breakdown = evaluator.EvaluateSwap(taskIdx, taskIdx2)
+        assert {field: breakdown[field] for field in PENALTY_FIELDS} == Full(swapped)
+
+        evaluator.ApplyReassign(taskIdx, emp)
+        breakdown = evaluator.Penalties()
+        assert {field: breakdown[field] for field in PENALTY_FIELDS} == Full(evaluator.geneList)
+
+def test_solve_exact_matches_brute_force():
+    for seed in range(5):
+        instance = GenerateInstance(6, 3, seed=seed)
+        allGenes = np.array(list(itertools.product(range(1, 4), repeat=6)))
+        bestCost = EvaluateFitnessBatch(allGenes, instance)["cost"].min()
+        genes, cost, optimal = SolveExact(instance)
+        assert optimal
+        assert cost == pytest.approx(bestCost)
+        assert EvaluateFitnessBatch([genes], instance)["cost"][0] == pytest.approx(cost)
+
+def test_batched_ga_matches_single_evaluation():
+    rng = np.random.default_rng(2)
+    instances = [GenerateInstance(5 + i % 13, 2 + i % 5, seed=i) for i in range(12)]
+    batch = InstanceBatch(instances)
+    genes = np.ones((batch.size, 6, batch.numTasks), dtype=np.int64)
+    for i, instance in enumerate(instances):
+        genes[i, :, :instance.numTasks] = rng.integers(1, instance.numEmps + 1,
+                                                       size=(6, instance.numTasks))
+    penalties = CalcPenaltiesBatched(genes, batch)
+    for i, instance in enumerate(instances):
+        single = CalcPenaltiesBatch(genes[i, :, :instance.numTasks].copy(), instance)
+        assert np.array_equal(penalties[i], single)
+
+    best = BatchGeneticAlgorithm(instances, 20, 15, 0.77, 0.2, 1, seed=3)
+    for vector, instance in zip(best, instances):
+        assert len(vector.geneList) == instance.numTasks
+        assert EvaluateFitnessBatch([vector.geneList], instance)["cost"][0] == \
+            pytest.approx(vector.cost)
+
+# Name: RunSolver
+# Purpose: Run a solver with fixed settings
+# Input: solver: ga, aco or pso, instance: ProblemInstance, options: further
+#   solver arguments
+# Output: best solution, best cost
+def RunSolver(solver, instance, **options):
+    if solver == "ga":
+        best = GeneticAlgorithm(30, 40, 0.8, 0.1, 1, instance=instance, **options)
+        return best.geneList, best.cost
+    if solver == "aco":
+        return AntColonyOptimisation(20, 0.15, 60, 40, instance=instance, **options)
+    return pso(numParticles=25, maxIter=40, instance=instance, **options)
+
+# Name: LogRows
+# Purpose: Read a csv log without its elapsed time column
+# Input: path: log file
+# Output: list of rows
+def LogRows(path):
+    with open(path, newline='') as logFile:
+        return [row[:2] + row[3:] for row in csv.reader(logFile)]
+
+@pytest.mark.parametrize("solver", ["ga", "aco", "pso"])
+def test_resume_matches_uninterrupted_run(solver, tmp_path):
+    instance = GenerateInstance(50, 6, seed=4)
+    fullLog, partLog = str(tmp_path / "full.csv"), str(tmp_path / "part.csv")
+    checkpointPath = str(tmp_path / "checkpoint.npz")
+
+    full = RunSolver(solver, instance, seed=5, log=fullLog)
+    RunSolver(solver, instance, seed=5, log=partLog,
+              checkpoint=Checkpointer(checkpointPath, every=7),
+              callback=lambda iteration, cost, solution: iteration == 23)
+    resumed = ResumeRun(checkpointPath, instance)
+
+    assert list(resumed[0]) == list(full[0])
+    assert resumed[1] == full[1]
+    assert LogRows(partLog) == LogRows(fullLog)
@@ -0,0 +1,318 @@
+# Racing tuner for the solver settings, run over training instances in a
+# process pool, writing the winning settings to a json config file
+# Contributers: Michael Durkan
+
+from classes import Error
+from instance import LoadInstance
+from portfolio import SOLVER_PARAMS
+from bench import GenerateInstance, RunSolver
+import multiprocessing
+import numpy as np
+import argparse
+import json
+import math
+
+# Settings tuned for each solver: (low, high) ranges of integers or floats,
+# or lists of choices
+PARAM_SPACES = {
+    "ga": {"populationSize": (20, 200), "crossoverRate": (0.5, 1.0),
+           "mutationRate": (0.01, 0.5), "elitism": (0, 4),
+           "selection": ["roulette", "alias", "tournament", "rank"]},
+    "aco": {"numAnts": (20, 300), "evapRate": (0.02, 0.5), "depositConstant": (10.0, 200.0),
+            "candidateLists": [False, True]},
+    "pso": {"numParticles": (20, 300), "w": (0.4, 1.0), "c1": (0.5, 2.5), "c2": (0.5, 2.5)},
+}
+
+# Name: SampleConfigs
+# Purpose: Draw random settings from a solver's space, the first being the
+#   current defaults so the race shows whether tuning helped
+# Input: solver: ga, aco or pso, count: configurations, rng: numpy random Generator
+# Output: list of settings dicts
+def SampleConfigs(solver, count, rng):
+    configs = [dict(SOLVER_PARAMS[solver])]
+    while len(configs) < count:
+        config = {}
+        for name, space in PARAM_SPACES[solver].items():
+            if isinstance(space, list):
+                config[name] = space[rng.integers(len(space))]
+            elif isinstance(space[0], int):
+                config[name] = int(rng.integers(space[0], space[1] + 1))
+            else:
+                config[name] = round(float(rng.uniform(space[0], space[1])), 4)
+        configs.append(config)
+    return configs
+
+# Name: Race
+# Purpose: Race settings against each other. Each round runs every surviving
+#   configuration on the next training instance and seed, then a Friedman
+#   test on the costs ranked within each round drops configurations whose
+#   rank sum is significantly worse than the best (Conover's post hoc test).
+# Input: solver: ga, aco or pso, instances: training ProblemInstances,
+#   configs: settings dicts, budget: fitness evaluations per run, maxRounds:
+#   rounds before stopping, firstTest: rounds run before any are dropped,
+#   alpha: significance level, seed, processes: worker processes, defaults to
+#   the cpu count, 0 runs in this process
+# Output: dict of the best settings, the surviving configuration indexes, the
+#   cost of every run (rounds x configurations, nan where not run) and the
+#   number of runs
+def Race(solver, instances, configs, budget, maxRounds=20, firstTest=5, alpha=0.05,
+         seed=0, processes=None):
+    if not instances or not configs:
+        raise Error("racing needs instances and configurations")
+    if firstTest < 2:
+        raise Error("firstTest must be at least 2")
+    alive = list(range(len(configs)))
+    costs = np.full((maxRounds, len(configs)), np.nan)
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = None
+    if processes > 0:
+        pool = multiprocessing.Pool(processes, initializer=InitTunerWorker,
+                                    initargs=(instances,))
+    else:
+        InitTunerWorker(instances)
+
+    rounds = 0
+    try:
+        while rounds < maxRounds and len(alive) > 1:
+            # Every configuration meets the same instance and seed in a round
+            jobs = [(solver, configs[c], rounds % len(instances), seed + rounds, budget)
+                    for c in alive]
+            roundCosts = pool.map(RunTrial, jobs) if pool is not None else list(map(RunTrial, jobs))
+            costs[rounds, alive] = roundCosts
+            rounds += 1
+            if rounds >= firstTest:
+                alive = [alive[i] for i in Survivors(costs[:rounds, alive], alpha)]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Best survivor by mean rank over the rounds run
+    meanRanks = RankRows(costs[:rounds, alive]).mean(axis=0)
+    best = alive[int(np.argmin(meanRanks))]
+    return {"best": configs[best], "bestIndex": best, "alive": alive,
+            "costs": costs[:rounds], "runs": int(np.isfinite(costs).sum())}
+
+# Name: Tune
+# Purpose: Race sampled settings of several solvers and write the winners
+# Input: solvers: names, instances: training ProblemInstances, numConfigs:
+#   configurations raced per solver, budget, maxRounds, firstTest, alpha,
+#   seed, processes as for Race, path: optional json file to write
+# Output: dict of solver name to its race result
+def Tune(solvers, instances, numConfigs=16, budget=5000, maxRounds=20, firstTest=5,
+         alpha=0.05, seed=0, processes=None, path=None):
+    rng = np.random.default_rng(seed)
+    races = {}
+    for solver in solvers:
+        if solver not in PARAM_SPACES:
+            raise Error("unknown solver " + str(solver))
+        configs = SampleConfigs(solver, numConfigs, rng)
+        races[solver] = Race(solver, instances, configs, budget, maxRounds, firstTest,
+                             alpha, seed, processes)
+    if path is not None:
+        with open(path, "w") as configFile:
+            json.dump({solver: race["best"] for solver, race in races.items()}, configFile,
+                      indent=2)
+    return races
+
+# Training instances used in a worker process
+tunerInstances = None
+
+# Name: InitTunerWorker
+# Purpose: Store the training instances once in each worker
+# Input: instances: list of ProblemInstance
+# Output: None
+def InitTunerWorker(instances):
+    global tunerInstances
+    tunerInstances = instances
+
+# Name: RunTrial
+# Purpose: Run one configuration on one training instance
+# Input: job: solver, settings, instance index, seed, budget
+# Output: final cost
+def RunTrial(job):
+    solver, settings, instanceIdx, seed, budget = job
+    return RunSolver(solver, tunerInstances[instanceIdx], budget, seed, trackMemory=False,
+                     params=settings)["finalCost"]
+
+# Name: RankRows
+# Purpose: Rank the costs within each round, 1 for the lowest, tied costs
+#   sharing the mean of their ranks
+# Input: costs: array (rounds x configurations)
+# Output: rank array of the same shape
+def RankRows(costs):
+    ranks = np.empty(costs.shape)
+    for row, values in enumerate(costs):
+        order = np.argsort(values, kind="stable")
+        rowRanks = np.empty(len(values))
+        rowRanks[order] = np.arange(1, len(values) + 1)
+        for value in np.unique(values):
+            tied = values == value
+            rowRanks[tied] = rowRanks[tied].mean()
+        ranks[row] = rowRanks
+    return ranks
+
+# Name: Survivors
+# Purpose: Friedman test of whether configurations differ, and if they do,
+#   Conover's test of each one against the best rank sum
+# Input: costs: array (rounds x configurations), alpha: significance level
+# Output: indexes of the configurations kept
+def Survivors(costs, alpha):
+    numRounds, numConfigs = costs.shape
+    keep = list(range(numConfigs))
+    if numConfigs < 2 or numRounds < 2:
+        return keep
+    ranks = RankRows(costs)
+    rankSums = ranks.sum(axis=0)
+    sumSquares = (ranks ** 2).sum()
+    tieTerm = numRounds * numConfigs * (numConfigs + 1) ** 2 / 4.0
+    if sumSquares - tieTerm <= 1e-12:
+        # Every round a tie, nothing to tell apart
+        return keep
+
+    statistic = ((numConfigs - 1) * ((rankSums ** 2).sum() - numRounds * tieTerm) /
+                 (sumSquares - tieTerm))
+    if ChiSquareSurvival(statistic, numConfigs - 1) >= alpha:
+        return keep
+
+    dof = (numRounds - 1) * (numConfigs - 1)
+    spread = 2.0 * numRounds * (sumSquares - (rankSums ** 2).sum() / numRounds) / dof
+    critical = StudentTQuantile(1.0 - alpha / 2.0, dof) * math.sqrt(max(spread, 0.0))
+    best = rankSums.min()
+    return [c for c in keep if rankSums[c] - best <= critical]
+
+# Name: ChiSquareSurvival
+# Purpose: Chance of a chi-square value at least x
+# Input: x, dof: degrees of freedom
+# Output: probability
+def ChiSquareSurvival(x, dof):
+    if x <= 0:
+        return 1.0
+    return RegularizedGammaQ(dof / 2.0, x / 2.0)
+
+# Name: RegularizedGammaQ
+# Purpose: Upper regularized incomplete gamma function, by its series below
+#   a + 1 and its continued fraction above
+# Input: a, x
+# Output: Q(a, x)
+def RegularizedGammaQ(a, x):
+    logPrefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1.0:
+        term = total = 1.0 / a
+        n = a
+        for _ in range(1000):
+            n += 1.0
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return 1.0 - total * math.exp(logPrefix)
+
+    # Lentz's method for the continued fraction
+    tiny = 1e-300
+    b = x + 1.0 - a
+    c = 1.0 / tiny
+    d = 1.0 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2.0
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        h *= d * c
+        if abs(d * c - 1.0) < 1e-15:
+            break
+    return math.exp(logPrefix) * h
+
+# Name: RegularizedBeta
+# Purpose: Regularized incomplete beta function, by its continued fraction
+# Input: x in [0, 1], a, b
+# Output: I_x(a, b)
+def RegularizedBeta(x, a, b):
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    if x > (a + 1.0) / (a + b + 2.0):
+        return 1.0 - RegularizedBeta(1.0 - x, b, a)
+    logPrefix = (math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                 a * math.log(x) + b * math.log(1.0 - x))
+
+    # Lentz's method for the continued fraction
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (tiny if abs(d) < tiny else d)
+    h = d
+    for m in range(1, 1000):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (tiny if abs(d) < tiny else d)
+            c = 1.0 + numerator / c
+            c = tiny if abs(c) < tiny else c
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-15:
+            break
+    return math.exp(logPrefix) * h / a
+
+# Name: StudentTQuantile
+# Purpose: Value a Student t variable is below with probability p, found by
+#   bisection on its upper tail
+# Input: p: probability above 0.5, dof: degrees of freedom
+# Output: quantile
+def StudentTQuantile(p, dof):
+    low, high = 0.0, 1e6
+    for _ in range(200):
+        middle = (low + high) / 2.0
+        tail = 0.5 * RegularizedBeta(dof / (dof + middle * middle), dof / 2.0, 0.5)
+        if tail > 1.0 - p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2.0
+
+# Allows the settings to be tuned from the command line
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Staff-to-Task solver tuner")
+    parser.add_argument("rosters", nargs="*",
+                        help="roster.json training instances (default: generated)")
+    parser.add_argument("--solvers", nargs="+", default=["ga", "aco", "pso"])
+    parser.add_argument("--tasks", type=int, default=200,
+                        help="tasks in each generated training instance")
+    parser.add_argument("--emps", type=int, default=20,
+                        help="employees in each generated training instance")
+    parser.add_argument("--instances", type=int, default=4,
+                        help="generated training instances")
+    parser.add_argument("--configs", type=int, default=16,
+                        help="settings raced for each solver")
+    parser.add_argument("--budget", type=int, default=5000,
+                        help="fitness evaluations of each run")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--first-test", type=int, default=5,
+                        help="rounds run before settings can be dropped")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--out", default="tuned.json", help="config file to write")
+    args = parser.parse_args()
+
+    if args.rosters:
+        instances = [LoadInstance(path) for path in args.rosters]
+    else:
+        instances = [GenerateInstance(args.tasks, args.emps, seed=args.seed + i)
+                     for i in range(args.instances)]
+
+    races = Tune(args.solvers, instances, args.configs, args.budget, args.rounds,
+                 args.first_test, args.alpha, args.seed, args.processes, args.out)
+    for solver, race in races.items():
+        print(solver, "best:", race["best"])
+        print(solver, "runs:", race["runs"], "survivors:", len(race["alive"]),
+              "of", len(race["costs"][0]))
+    print("Settings written to", args.out)
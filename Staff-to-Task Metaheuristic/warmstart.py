@@ -0,0 +1,210 @@
+# Warm started re-solving after small changes to the tasks and employees
+# Contributers: Michael Durkan
+
+from classes import Task, Employee, Error
+from instance import ProblemInstance
+from localsearch import LocalSearch
+from delta import DeltaEvaluator
+from portfolio import SOLVER_PARAMS
+from ga import GeneticAlgorithm
+from aco import AntColonyOptimisation
+from pso import pso
+import numpy as np
+
+# Fields that may change on a task or an employee, in constructor order
+TASK_FIELDS = ("time", "difficulty", "deadline", "skill")
+EMP_FIELDS = ("hours", "level", "skills")
+
+# Name: ApplyDiff
+# Purpose: Build the instance left after a change to the tasks and employees.
+#   A diff is a dict with any of the entries addTasks and addEmployees (lists
+#   of Task, Employee or dicts in the data.py layout), removeTasks and
+#   removeEmployees (lists of ids), and modifyTasks and modifyEmployees
+#   (dicts of id to a dict of the changed fields).
+# Input: instance: ProblemInstance before the change, diff: dict
+# Output: new ProblemInstance
+def ApplyDiff(instance, diff):
+    taskList = ChangeItems(instance.taskList, diff.get("removeTasks"),
+                           diff.get("modifyTasks"), diff.get("addTasks"), Task, TASK_FIELDS)
+    empList = ChangeItems(instance.empList, diff.get("removeEmployees"),
+                          diff.get("modifyEmployees"), diff.get("addEmployees"), Employee,
+                          EMP_FIELDS)
+    if not empList:
+        raise Error("diff removes every employee, no one is left to assign tasks to")
+    if not taskList:
+        raise Error("diff removes every task")
+    return ProblemInstance(taskList, empList)
+
+# Name: ChangeItems
+# Purpose: Remove, modify and add tasks or employees
+# Input: items: Task or Employee list, removed: ids, modified: dict of id to
+#   changed fields, added: new items or dicts, Kind: Task or Employee class,
+#   fields: its changeable fields
+# Output: new list, unchanged items are shared with the old list
+def ChangeItems(items, removed, modified, added, Kind, fields):
+    removed = set(removed or ())
+    modified = modified or {}
+    ids = {item.id for item in items}
+    for itemId in removed | set(modified):
+        if itemId not in ids:
+            raise Error("no task or employee with id " + str(itemId))
+
+    result = []
+    for item in items:
+        if item.id in removed:
+            continue
+        changes = modified.get(item.id)
+        if changes:
+            if not set(changes) <= set(fields):
+                raise Error("unknown fields changed on " + str(item.id))
+            item = Kind(item.id, *[changes.get(field, getattr(item, field))
+                                   for field in fields])
+        result.append(item)
+
+    ids -= removed
+    for item in added or ():
+        if isinstance(item, dict):
+            item = Kind(item["id"], *[item[field] for field in fields])
+        if item.id in ids:
+            raise Error("duplicate task or employee id " + str(item.id))
+        ids.add(item.id)
+        result.append(item)
+    return result
+
+# Name: DiffInstances
+# Purpose: Work out the diff between two instances, matching tasks and
+#   employees by id
+# Input: oldInstance, newInstance: ProblemInstance
+# Output: diff dict as taken by ApplyDiff
+def DiffInstances(oldInstance, newInstance):
+    diff = {}
+    for kind, oldItems, newItems, fields in (
+            ("Tasks", oldInstance.taskList, newInstance.taskList, TASK_FIELDS),
+            ("Employees", oldInstance.empList, newInstance.empList, EMP_FIELDS)):
+        oldById = {item.id: item for item in oldItems}
+        newIds = {item.id for item in newItems}
+        diff["add" + kind] = [item for item in newItems if item.id not in oldById]
+        diff["remove" + kind] = [item.id for item in oldItems if item.id not in newIds]
+        diff["modify" + kind] = {}
+        for item in newItems:
+            old = oldById.get(item.id)
+            if old is None:
+                continue
+            changes = {field: getattr(item, field) for field in fields
+                       if FieldChanged(getattr(old, field), getattr(item, field))}
+            if changes:
+                diff["modify" + kind][item.id] = changes
+    return diff
+
+# Name: FieldChanged
+# Purpose: Compare a field of two versions of a task or employee, skills
+#   being compared regardless of order
+# Input: old, new: field values
+# Output: True when the value changed
+def FieldChanged(old, new):
+    if isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)):
+        return set(old) != set(new)
+    return old != new
+
+# Name: MapSolution
+# Purpose: Carry a previous solution over to a changed instance, matching
+#   tasks and employees by id
+# Input: geneList: previous solution, oldInstance: its ProblemInstance,
+#   newInstance: changed ProblemInstance
+# Output: gene list for the new instance, 0 where a task is new or its
+#   employee was removed
+def MapSolution(geneList, oldInstance, newInstance):
+    if len(geneList) != oldInstance.numTasks:
+        raise Error("gene list length does not match number of tasks")
+    oldTaskIdx = {taskId: i for i, taskId in enumerate(oldInstance.taskIds)}
+    newEmpNum = {empId: i + 1 for i, empId in enumerate(newInstance.empIds)}
+
+    mapped = []
+    for taskId in newInstance.taskIds:
+        gene = 0
+        taskIdx = oldTaskIdx.get(taskId)
+        if taskIdx is not None and 1 <= geneList[taskIdx] <= oldInstance.numEmps:
+            gene = newEmpNum.get(oldInstance.empIds[geneList[taskIdx] - 1], 0)
+        mapped.append(gene)
+    return mapped
+
+# Name: RepairSolution
+# Purpose: Turn a previous solution into a good one for a changed instance,
+#   touching only what changed. Unplaced tasks go to the skilled employee
+#   with the fewest added penalties and most spare hours, then every affected
+#   task (unplaced, modified, or done by a modified employee) is moved to the
+#   best of its skilled and least loaded employees if that lowers the total
+#   violations, scored by the delta evaluator instead of full evaluations.
+# Input: geneList: previous solution, oldInstance: its ProblemInstance,
+#   newInstance: changed ProblemInstance, neighbours: employees tried for each
+#   affected task, maxEvaluations: optional limit on the moves scored
+# Output: repaired gene list, its penalty breakdown
+def RepairSolution(geneList, oldInstance, newInstance, neighbours=8, maxEvaluations=None):
+    diff = DiffInstances(oldInstance, newInstance)
+    genes = np.array(MapSolution(geneList, oldInstance, newInstance), dtype=np.int64)
+    placed = genes > 0
+    search = LocalSearch(newInstance, neighbours=neighbours)
+
+    # Tasks whose own terms or employee changed may now be better elsewhere
+    affected = ~placed
+    taskIdx = {taskId: i for i, taskId in enumerate(newInstance.taskIds)}
+    for taskId in diff["modifyTasks"]:
+        affected[taskIdx[taskId]] = True
+    empChanged = np.array([empId in diff["modifyEmployees"] for empId in newInstance.empIds])
+    affected[placed] |= empChanged[genes[placed] - 1]
+
+    # Place each unplaced task, longest first, keeping the loads up to date
+    empLoad = np.bincount(genes[placed] - 1, weights=newInstance.taskTime[placed],
+                          minlength=newInstance.numEmps)
+    unplaced = np.nonzero(~placed)[0]
+    for task in unplaced[np.argsort(-newInstance.taskTime[unplaced], kind="stable")].tolist():
+        emps = search.skilledEmps[newInstance.taskSkillCode[task]]
+        if len(emps) == 0:
+            emps = np.arange(newInstance.numEmps)
+        spare = search.empHours[emps] - empLoad[emps]
+        added = (np.maximum(newInstance.taskDifficulty[task] - newInstance.empLevel[emps], 0) +
+                 np.maximum(newInstance.taskTime[task] - spare, 0))
+        emp = emps[np.lexsort((-spare, added))[0]]
+        genes[task] = emp + 1
+        empLoad[emp] += newInstance.taskTime[task]
+
+    # Move the affected tasks by delta evaluation
+    delta = DeltaEvaluator(genes.tolist(), newInstance)
+    affectedTasks = np.nonzero(affected)[0].tolist()
+    if maxEvaluations is None:
+        maxEvaluations = 2 * neighbours * max(len(affectedTasks), 1)
+    state = {"delta": delta, "budget": maxEvaluations,
+             "violations": delta.Penalties()["totalViolations"], "moved": False}
+    allEmps = np.arange(newInstance.numEmps)
+    for task in affectedTasks:
+        if state["budget"] <= 0:
+            break
+        emps = search.skilledEmps[newInstance.taskSkillCode[task]]
+        if not (len(emps) and search.TryTask(state, task, emps)):
+            search.TryTask(state, task, allEmps)
+
+    return delta.geneList, delta.Penalties()
+
+# Name: WarmResolve
+# Purpose: Re-solve a changed instance starting from the previous solution,
+#   repaired for the change, instead of from random solutions
+# Input: solver: ga, aco or pso, geneList: previous solution, oldInstance:
+#   its ProblemInstance, newInstance: changed ProblemInstance, iterations:
+#   iterations or generations to run, perturbation: fraction of each seeded
+#   solution changed at random, options: further solver arguments
+# Output: best solution, best cost
+def WarmResolve(solver, geneList, oldInstance, newInstance, iterations=100,
+                perturbation=0.1, **options):
+    if solver not in SOLVER_PARAMS:
+        raise Error("unknown solver " + str(solver))
+    initial, _ = RepairSolution(geneList, oldInstance, newInstance)
+    arguments = dict(SOLVER_PARAMS[solver], instance=newInstance, initial=initial,
+                     perturbation=perturbation, log=None)
+    arguments.update(options)
+
+    if solver == "ga":
+        best = GeneticAlgorithm(maxGenerations=iterations, **arguments)
+        return best.geneList, best.cost
+    if solver == "aco":
+        return AntColonyOptimisation(maxIterations=iterations, **arguments)
+    return pso(maxIter=iterations, **arguments)